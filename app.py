@@ -6,17 +6,28 @@ ICT PRO BOT V7.4 - PRODUCTION READY
 ✅ Position Reconciliation | ✅ Emergency Exit | ✅ Complete Lifecycle Management
 """
 
-from flask import Flask, request, jsonify, redirect
+from flask import Flask, Blueprint, Response, request, jsonify, redirect, stream_with_context
 import requests
+from requests.adapters import HTTPAdapter
 import json
 from datetime import datetime, time as dt_time
 import logging
 import os
-from threading import Thread
+from threading import Thread, Event, Lock, Condition
+from collections import deque
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import threading
 import time
 import signal
 import sys
+import base64
+import hashlib
+import random
 import pytz
+import numpy as np
+from cryptography.fernet import Fernet, InvalidToken
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONFIGURATION
@@ -30,65 +41,624 @@ UPSTOX_API_KEY = os.environ.get("UPSTOX_API_KEY")
 UPSTOX_API_SECRET = os.environ.get("UPSTOX_API_SECRET")
 UPSTOX_REDIRECT_URI = os.environ.get("UPSTOX_REDIRECT_URI", "https://your-render-url.onrender.com/callback")
 
+# Token Vault (encrypted at rest → warm restarts without /login)
+TOKEN_VAULT_FILE = os.environ.get("TOKEN_VAULT_FILE", "token.vault")
+TOKEN_VAULT_KEY = os.environ.get("TOKEN_VAULT_KEY")  # Fernet key; derived from API secret if unset
+TOKEN_FALLBACK_HOURS = 20  # only used when the JWT carries no exp claim
+
+# Multi-Account Fan-out: the env credentials above are the "primary" account; extra
+# accounts come from ACCOUNTS_FILE as [{"name", "api_key", "api_secret", "qty_multiplier"}]
+ACCOUNTS_FILE = os.environ.get("ACCOUNTS_FILE", "accounts.json")
+PRIMARY_ACCOUNT = "primary"
+ACCOUNT_RATE_LIMIT = float(os.environ.get("ACCOUNT_RATE_LIMIT", 10))  # broker requests/sec per account
+ACCOUNT_POOL_SIZE = 10  # pooled HTTPS connections per account
+FANOUT_WORKERS = 16     # max accounts executing one signal in parallel
+
 # Trading Configuration
 MAX_ORDER_RETRIES = 3
 ORDER_FILL_TIMEOUT = 30  # seconds
-POSITION_RECONCILE_INTERVAL = 300  # 5 minutes
+FILL_POLL_SCHEDULE = [0.05, 0.1, 0.15, 0.25, 0.5, 1.0, 2.0]  # seconds between fill probes, last repeats
+POSITION_RECONCILE_INTERVAL = int(os.environ.get("POSITION_RECONCILE_INTERVAL", 10))  # seconds
+RECONCILE_CONFIRM_PASSES = 2  # a drift must persist this many passes before it is repaired
+RECOVERY_SL_PCT = float(os.environ.get("RECOVERY_SL_PCT", 1.0))  # fallback SL % when a crash lost the SL price
+ORPHAN_ORDER_GRACE = 60  # seconds - webhook may still be attaching a fresh leg to its position
+PARTIAL_TP_FRACTION = 0.5  # share of filled qty exited at partial TP
+
+# Event Stream (SSE) - replay buffer for reconnecting dashboards
+EVENT_BUFFER_SIZE = 1000
+EVENT_HEARTBEAT = 15  # seconds
+EVENT_STREAM_SECONDS = 300  # an /events response ends after this; EventSource reconnects with Last-Event-ID
+
+# Risk Limits (0 = disabled) - checked in O(1) against the live P&L book
+MAX_DAILY_LOSS = float(os.environ.get("MAX_DAILY_LOSS", 0))   # ₹, realized + unrealized
+MAX_EXPOSURE = float(os.environ.get("MAX_EXPOSURE", 0))       # ₹, gross notional at LTP
+
+# Trade Ledger (columnar, one compressed .npz per day)
+LEDGER_DIR = os.environ.get("LEDGER_DIR", "ledger")
+LEDGER_COMPACT_INTERVAL = 300  # seconds between checks for past-day journals to fold into .npz
+
+# Ingest Spool (append-only segments, group-commit fsync) - signals survive crashes/restarts
+SPOOL_DIR = os.environ.get("SPOOL_DIR", "spool")
+SPOOL_MAX_AGE = float(os.environ.get("SPOOL_MAX_AGE", 60))  # seconds - older unfinished signals expire, never replay
+SPOOL_SEGMENT_BYTES = 4 * 1024 * 1024  # roll to a new segment past this size
+SPOOL_CHECK_INTERVAL = 1  # seconds
+
+# Market Data: UPSTOX (batched LTP poll) | REPLAY (csv file) | MOCK (random walk) | OFF
+MARKET_DATA_SOURCE = os.environ.get("MARKET_DATA_SOURCE", "UPSTOX").upper()
+MARKET_DATA_INTERVAL = float(os.environ.get("MARKET_DATA_INTERVAL", 1))  # seconds
+MARKET_DATA_REPLAY_FILE = os.environ.get("MARKET_DATA_REPLAY_FILE", "ticks.csv")
+
+# Trailing Stop (0 = disabled; per-signal 'trail' points override the % default)
+TRAILING_STOP_PCT = float(os.environ.get("TRAILING_STOP_PCT", 0))
+TRAIL_MIN_STEP = float(os.environ.get("TRAIL_MIN_STEP", 0.05))  # ₹, min ratchet per modify
+TRAIL_CHECK_INTERVAL = 2  # seconds
+
+# Pre-market Warm-up (IST, weekdays): instruments, token check, funds, pooled connections, watchlist
+PREMARKET_WARMUP_TIME = os.environ.get("PREMARKET_WARMUP_TIME", "09:00")  # HH:MM
+PREMARKET_TOUCH_LEAD = 45  # seconds before 9:15 to re-touch pooled connections (idle keep-alives get dropped)
+WARMUP_CHECK_INTERVAL = 15  # seconds
+WATCHLIST = [s.strip().upper() for s in os.environ.get("WATCHLIST", "").split(",") if s.strip()]  # symbols we trade
+
+# Margin Sizing: SCALE (shrink qty to free margin) | REJECT | OFF - checked locally, never per-signal broker calls
+MARGIN_SIZING = os.environ.get("MARGIN_SIZING", "SCALE").upper()
+MARGIN_LEVERAGE = float(os.environ.get("MARGIN_LEVERAGE", 5))  # intraday equity: margin = notional / leverage
+MARGIN_BUFFER_PCT = float(os.environ.get("MARGIN_BUFFER_PCT", 5))  # free margin kept back for charges / slippage
+FUNDS_REFRESH_INTERVAL = int(os.environ.get("FUNDS_REFRESH_INTERVAL", 60))  # seconds between funds snapshots
+
+# In-process ICT Signal Engine: UPSTOX (LTP poll → candles) | REPLAY (candle csv) | MOCK (random walk) | OFF
+SIGNAL_ENGINE_SOURCE = os.environ.get("SIGNAL_ENGINE_SOURCE", "OFF").upper()
+SIGNAL_WATCHLIST = [s.strip().upper() for s in os.environ.get("SIGNAL_WATCHLIST", "").split(",") if s.strip()] or WATCHLIST
+SIGNAL_REPLAY_FILE = os.environ.get("SIGNAL_REPLAY_FILE", "candles.csv")  # timestamp,symbol,open,high,low,close
+SIGNAL_TIMEFRAME = int(os.environ.get("SIGNAL_TIMEFRAME", 60))  # seconds per candle
+SIGNAL_MIN_CONFLUENCE = float(os.environ.get("SIGNAL_MIN_CONFLUENCE", 10))  # out of 15
+SIGNAL_QTY = int(os.environ.get("SIGNAL_QTY", 1))
+SIGNAL_RR = float(os.environ.get("SIGNAL_RR", 2))
+# Dry run = log/stream signals, send no orders. MOCK / REPLAY prices are synthetic or stale → always dry run
+SIGNAL_DRY_RUN = os.environ.get("SIGNAL_DRY_RUN", "false").lower() == "true" or SIGNAL_ENGINE_SOURCE != "UPSTOX"
+SIGNAL_POLL_INTERVAL = 1  # seconds between LTP polls
+SIGNAL_RING_SIZE = 128    # candles kept per symbol
+SIGNAL_SWEEP_LOOKBACK = 20  # candles whose high/low form the liquidity pool
+SIGNAL_SETUP_BARS = 10    # a sweep / FVG stays tradeable this many candles
+SIGNAL_COOLDOWN_BARS = 15  # min candles between two signals on one symbol
+SIGNAL_EMA_FAST = 20
+SIGNAL_EMA_SLOW = 50
+
+# Option Routing: trade an underlying's signal as an NFO option (BUY → long CE, SELL → long PE)
+OPTION_ROUTING = os.environ.get("OPTION_ROUTING", "OFF").upper()  # ON = every signal; per-signal 'route': 'option'
+OPTION_EXPIRY = os.environ.get("OPTION_EXPIRY", "WEEKLY").upper()  # WEEKLY = nearest expiry | MONTHLY
+OPTION_STRIKE_OFFSET = int(os.environ.get("OPTION_STRIKE_OFFSET", 0))  # strikes from ATM: +n OTM, -n ITM
+OPTION_LOTS = int(os.environ.get("OPTION_LOTS", 1))
+OPTION_DELTA = float(os.environ.get("OPTION_DELTA", 0.5))  # maps underlying SL/TP distances onto the premium
+OPTION_MIN_DAYS_TO_EXPIRY = int(os.environ.get("OPTION_MIN_DAYS_TO_EXPIRY", 0))  # 1 = roll off expiry-day contracts
+OPTION_TICK = 0.05
+
+# Admission Control on /webhook: bounded entry execution, fast 429/503 + Retry-After when overloaded
+WEBHOOK_MAX_INFLIGHT = int(os.environ.get("WEBHOOK_MAX_INFLIGHT", 8))  # entry signals executing at once
+WEBHOOK_MAX_QUEUE = int(os.environ.get("WEBHOOK_MAX_QUEUE", 16))  # entry signals waiting for a slot; more → 429
+WEBHOOK_QUEUE_TIMEOUT = float(os.environ.get("WEBHOOK_QUEUE_TIMEOUT", 5))  # seconds waiting for a slot; then → 503
+
+# Bracket execution mode:
+#   LEGS - separate LIMIT partial / LIMIT TP / SL-M orders, siblings cancelled by the monitor
+#   GTT  - broker-side GTT groups (ENTRY + TARGET + STOPLOSS), broker cancels siblings (OCO)
+BRACKET_MODE = os.environ.get("BRACKET_MODE", "LEGS").upper()
 
 # Global State
-access_token = None
-token_generated_at = None
-active_positions = {}  # symbol → full state dict
-instruments_dict = {}
+accounts = {}  # name → account state (token, session, positions, ...) - see BROKER ACCOUNTS
+instruments_dict = {}  # shared by every account
+option_chains = {}     # underlying → {'expiries', 'monthly', 'sides'} - see OPTION ROUTING
+option_contracts = {}  # option trading symbol → contract
+instruments_ready = Event()
+instruments_loading = Event()  # a download is in flight - lookups wait only while this is set
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'ict-pro-bot-v7-4-production'
+# Lifecycle State (see APPLICATION FACTORY)
+readiness = {
+    'logging': False,
+    'accounts': False,
+    'positions': False,
+    'token_vault': False,
+    'instruments': False,
+    'token_monitor': False,
+    'position_monitor': False,
+    'reconciler': False,
+    'market_data': False,
+    'trailing_stop': False,
+    'recovery': False,
+    'funds': False,
+    'premarket': False,
+    'spool': False,
+    'signal_engine': False
+}
+services_started = False
+services_lock = Lock()
+
+bp = Blueprint('bot', __name__)
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # LOGGING SETUP
 # ═══════════════════════════════════════════════════════════════════════════════
-if not os.path.exists("logs"):
-    os.makedirs("logs")
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f"logs/trade_log_{datetime.now().strftime('%Y%m%d')}.txt"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def setup_logging():
+    """Configure file + console logging (called by create_app, not at import)"""
+    if not os.path.exists("logs"):
+        os.makedirs("logs")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(f"logs/trade_log_{datetime.now().strftime('%Y%m%d')}.txt"),
+            logging.StreamHandler()
+        ]
+    )
+    readiness['logging'] = True
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BROKER ACCOUNTS (MULTI-ACCOUNT FAN-OUT)
+# ═══════════════════════════════════════════════════════════════════════════════
+# Each account owns its token, HTTP pool, rate budget and position book; the
+# instrument index, market data and P&L/risk book are shared. Code always acts
+# for current_account() - the primary one unless a thread is bound to another.
+account_local = threading.local()
+
+def new_account(name, api_key, api_secret, qty_multiplier=1.0):
+    """Fresh state for one broker account"""
+    primary = name == PRIMARY_ACCOUNT
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=ACCOUNT_POOL_SIZE, pool_maxsize=ACCOUNT_POOL_SIZE)
+    session.mount("https://", adapter)
+    return {
+        'name': name,
+        'api_key': api_key,
+        'api_secret': api_secret,
+        'qty_multiplier': qty_multiplier,
+        'vault_file': TOKEN_VAULT_FILE if primary else f"token_{name}.vault",
+        'positions_file': "positions.json" if primary else f"positions_{name}.json",
+        'access_token': None,
+        'token_generated_at': None,
+        'token_expires_at': None,   # epoch seconds from JWT exp
+        'token_verified': False,    # True once a vault-loaded token passed the profile check
+        'positions': {},            # symbol → Position
+        'positions_lock': Lock(),   # one writer of positions_file at a time
+        'order_ids': {},            # order_id → placed_at, every order placed this process (orphan detection)
+        'reconcile': {
+            'positions': None,      # symbol → signed net qty
+            'orders': None,         # order_id → (status, filled_qty)
+            'version': -1,          # state_version at last pass
+            'suspects': {},         # symbol → (signature, passes seen)
+            'alerted': set()        # untracked / side-mismatch signatures already reported
+        },
+        'recovery_ready': Event(),  # set once broker state has been rebuilt - webhooks wait for it
+        'funds': {
+            'available': None,      # available margin at the last snapshot (None = no snapshot yet)
+            'used': 0.0,
+            'fetched_at': 0.0,
+            'ledger': {},           # symbol → margin blocked by the bot's position / pending entry
+            'ledger_total': 0.0,
+            'ledger_at_fetch': 0.0, # ledger_total (less pending entries) when the snapshot was taken
+            'pending': set(),       # ledger symbols that are entries not yet filled
+            'scaled': 0,
+            'rejected': 0,
+            'lock': Lock()
+        },
+        'fill_waiters': {},         # order_id → pending fill wait (see wait_for_fill)
+        'fill_lock': Lock(),
+        'fill_wake': Event(),
+        'fill_poller': None,        # running fill_poller thread, if any
+        'session': session,
+        'rate': {'tokens': ACCOUNT_RATE_LIMIT, 'updated': time.monotonic(), 'lock': Lock()}
+    }
+
+accounts[PRIMARY_ACCOUNT] = new_account(PRIMARY_ACCOUNT, UPSTOX_API_KEY, UPSTOX_API_SECRET)
+
+def load_accounts():
+    """Add the extra accounts from ACCOUNTS_FILE (primary always comes from env)"""
+    try:
+        if os.path.exists(ACCOUNTS_FILE):
+            with open(ACCOUNTS_FILE, "r") as f:
+                for entry in json.load(f):
+                    name = str(entry.get('name', '')).strip()
+                    if not name or name == PRIMARY_ACCOUNT or not entry.get('api_key') or not entry.get('api_secret'):
+                        logger.error(f"❌ Skipping invalid account entry: {name or entry}")
+                        continue
+                    accounts[name] = new_account(name, entry['api_key'], entry['api_secret'],
+                                                 safe_float(entry.get('qty_multiplier'), 1.0))
+            logger.info(f"✅ Accounts: {list(accounts.keys())}")
+    except Exception as e:
+        logger.error(f"❌ Accounts load failed: {e}")
+    readiness['accounts'] = True
+
+def current_account():
+    """Account the calling thread acts for"""
+    return getattr(account_local, 'account', None) or accounts[PRIMARY_ACCOUNT]
+
+@contextmanager
+def account_context(account):
+    """Bind the calling thread to an account for the duration of the block"""
+    previous = getattr(account_local, 'account', None)
+    account_local.account = account
+    try:
+        yield account
+    finally:
+        account_local.account = previous
+
+def each_account():
+    """Iterate accounts, each iteration running inside that account's context.
+    Loop to the end - to leave early, use account_context() directly."""
+    previous = getattr(account_local, 'account', None)
+    try:
+        for account in list(accounts.values()):
+            account_local.account = account
+            yield account
+            account_local.account = previous
+    finally:
+        account_local.account = previous
+
+def run_in_account(account, func, *args):
+    """Call func inside an account context (thread-pool entry point)"""
+    with account_context(account):
+        return func(*args)
+
+def account_label():
+    """Account name for messages - empty for the primary account"""
+    name = current_account()['name']
+    return "" if name == PRIMARY_ACCOUNT else name
+
+def broker_request(method, url, **kwargs):
+    """Upstox call through the current account's pooled session, inside its rate budget"""
+    account = current_account()
+    rate = account['rate']
+    with rate['lock']:
+        now = time.monotonic()
+        rate['tokens'] = min(ACCOUNT_RATE_LIMIT, rate['tokens'] + (now - rate['updated']) * ACCOUNT_RATE_LIMIT)
+        rate['updated'] = now
+        wait = (1 - rate['tokens']) / ACCOUNT_RATE_LIMIT if rate['tokens'] < 1 else 0
+        rate['tokens'] -= 1
+    if wait > 0:
+        time.sleep(wait)
+    return account['session'].request(method, url, **kwargs)
+
+class AccountPositions(MutableMapping):
+    """active_positions → the current account's positions dict"""
+    def __getitem__(self, symbol):
+        return current_account()['positions'][symbol]
+
+    def __setitem__(self, symbol, pos):
+        current_account()['positions'][symbol] = pos
+
+    def __delitem__(self, symbol):
+        del current_account()['positions'][symbol]
+
+    def __iter__(self):
+        return iter(current_account()['positions'])
+
+    def __len__(self):
+        return len(current_account()['positions'])
+
+active_positions = AccountPositions()
+
+def account_summaries():
+    """Per-account status for the dashboards"""
+    summaries = []
+    for account in each_account():
+        summaries.append({
+            'name': account['name'],
+            'token_valid': is_token_valid(),
+            'recovered': account['recovery_ready'].is_set(),
+            'positions': list(account['positions'].keys()),
+            'qty_multiplier': account['qty_multiplier'],
+            'funds': funds_summary()
+        })
+    return summaries
+
+def bind_request_account():
+    """?account=<name> scopes a dashboard / close request to that account"""
+    name = request.args.get('account')
+    account_local.account = None
+    if name and name not in accounts:
+        return jsonify({'error': f'Unknown account {name}'}), 404
+    account_local.account = accounts.get(name)
+
+def unbind_request_account(exc=None):
+    """Request threads are reused - never carry an account into the next request"""
+    account_local.account = None
+
+bp.before_request(bind_request_account)
+bp.teardown_request(unbind_request_account)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# POSITION MODEL
+# ═══════════════════════════════════════════════════════════════════════════════
+# Positions and their order legs are slotted objects. positions.json stores them
+# as compact rows plus the field names of the schema version that wrote them,
+# so rows from older/newer layouts still load; v1 free-form dict files migrate.
+POSITIONS_SCHEMA_VERSION = 2
+
+class OrderLeg:
+    """One broker order of a position - or a GTT group when rules is set"""
+    __slots__ = ('order_id', 'quantity', 'price', 'trigger_price', 'order_type',
+                 'transaction_type', 'instrument_token', 'tag', 'rules', 'sent_at', 'acked_at')
+
+    def __init__(self, order_id=None, quantity=0, price=0.0, trigger_price=0.0, order_type="MARKET",
+                 transaction_type="BUY", instrument_token=None, tag=None, rules=None, sent_at=0.0, acked_at=0.0):
+        self.order_id = order_id
+        self.quantity = int(quantity or 0)
+        self.price = float(price or 0)
+        self.trigger_price = float(trigger_price or 0)
+        self.order_type = order_type
+        self.transaction_type = transaction_type
+        self.instrument_token = instrument_token
+        self.tag = tag
+        self.rules = rules
+        self.sent_at = float(sent_at or 0)    # epoch s the place request went out
+        self.acked_at = float(acked_at or 0)  # epoch s the broker answered with an order id
+
+    @classmethod
+    def from_payload(cls, payload, order_id=None, placed=None):
+        """Order / GTT request body (+ place_order result for timing) → leg (None if no payload)"""
+        if not payload:
+            return None
+        placed = placed or {}
+        return cls(order_id, payload.get('quantity'), payload.get('price'), payload.get('trigger_price'),
+                   payload.get('order_type', "MARKET"), payload.get('transaction_type'),
+                   payload.get('instrument_token'), payload.get('tag'), payload.get('rules'),
+                   placed.get('sent_at'), placed.get('acked_at'))
+
+    @property
+    def ref_price(self):
+        """Price the leg was meant to fill at (limit, else trigger)"""
+        return self.price if self.order_type == "LIMIT" else self.trigger_price
+
+    def payload(self):
+        """Broker request body (v2 order, or v3 GTT group)"""
+        if self.rules is not None:
+            return {
+                "type": "MULTIPLE",
+                "quantity": self.quantity,
+                "product": "I",
+                "instrument_token": self.instrument_token,
+                "transaction_type": self.transaction_type,
+                "rules": [dict(rule) for rule in self.rules]
+            }
+        return {
+            "quantity": self.quantity,
+            "product": "I",
+            "validity": "DAY",
+            "price": self.price,
+            "instrument_token": self.instrument_token,
+            "order_type": self.order_type,
+            "transaction_type": self.transaction_type,
+            "disclosed_quantity": 0,
+            "trigger_price": self.trigger_price,
+            "is_amo": False,
+            "tag": self.tag
+        }
+
+    def with_changes(self, **changes):
+        """Copy with some fields replaced (modify requests are built from the copy)"""
+        leg = OrderLeg(*self.to_row())
+        for field, value in changes.items():
+            setattr(leg, field, value)
+        return leg
+
+    def rule_price(self, strategy):
+        """Trigger price of a GTT rule (TARGET / STOPLOSS), 0 if absent"""
+        for rule in self.rules or []:
+            if (rule.get('strategy') or '').upper() == strategy:
+                return float(rule.get('trigger_price') or 0)
+        return 0.0
+
+    def to_row(self):
+        return [getattr(self, field) for field in self.__slots__]
+
+    @classmethod
+    def from_row(cls, row, fields):
+        """Stored row → leg (fields this version does not know are dropped)"""
+        return cls(**{k: v for k, v in zip(fields, row) if k in cls.__slots__})
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__ if getattr(self, field) is not None}
+
+class Position:
+    """Tracked state of one open position (GTT mode: entry = main group, partial = partial group)"""
+    __slots__ = ('symbol', 'action', 'position_id', 'bracket_mode', 'qty_requested', 'filled_qty',
+                 'entry_price', 'entry', 'sl', 'tp', 'partial', 'partial_filled', 'trail_points',
+                 'signal', 'created_at', 'realized_pnl')
+    LEGS = ('entry', 'sl', 'tp', 'partial')
+
+    def __init__(self, symbol, action, position_id=None, bracket_mode="LEGS", qty_requested=0, filled_qty=0,
+                 entry_price=0.0, entry=None, sl=None, tp=None, partial=None, partial_filled=False,
+                 trail_points=0.0, signal=None, created_at=None, realized_pnl=0.0):
+        self.symbol = symbol
+        self.action = action
+        self.position_id = position_id
+        self.bracket_mode = bracket_mode
+        self.qty_requested = int(qty_requested or 0)
+        self.filled_qty = int(filled_qty or 0)
+        self.entry_price = float(entry_price or 0)
+        self.entry = entry
+        self.sl = sl
+        self.tp = tp
+        self.partial = partial
+        self.partial_filled = bool(partial_filled)
+        self.trail_points = float(trail_points or 0)
+        self.signal = signal or {}
+        self.created_at = created_at or time.time()
+        self.realized_pnl = float(realized_pnl or 0)
+
+    @property
+    def instrument_key(self):
+        return self.entry.instrument_token if self.entry else None
+
+    @property
+    def exit_action(self):
+        return "SELL" if self.action == "BUY" else "BUY"
+
+    @property
+    def remaining_qty(self):
+        """Qty still held: filled minus an executed partial TP"""
+        if self.partial_filled and self.partial:
+            return self.filled_qty - self.partial.quantity
+        return self.filled_qty
+
+    @property
+    def open_legs(self):
+        """Exit legs placed at the broker - filled or not (GTT mode: the groups)"""
+        names = ('entry', 'partial') if self.bracket_mode == "GTT" else ('partial', 'tp', 'sl')
+        return [leg for leg in (getattr(self, name) for name in names) if leg and leg.order_id]
+
+    def leg_id(self, name):
+        """Broker id of a leg ('entry' / 'sl' / 'tp' / 'partial'), None if not placed"""
+        leg = getattr(self, name)
+        return leg.order_id if leg else None
+
+    def to_row(self):
+        return [getattr(self, field).to_row() if field in self.LEGS and getattr(self, field) else getattr(self, field)
+                for field in self.__slots__]
+
+    @classmethod
+    def from_row(cls, row, fields, leg_fields):
+        values = dict(zip(fields, row))
+        for name in cls.LEGS:
+            if values.get(name):
+                values[name] = OrderLeg.from_row(values[name], leg_fields)
+        return cls(**{k: v for k, v in values.items() if k in cls.__slots__})
+
+    def to_dict(self):
+        """Readable form for the API"""
+        view = {field: getattr(self, field) for field in self.__slots__ if field not in self.LEGS}
+        view['legs'] = {name: getattr(self, name).to_dict() for name in self.LEGS if getattr(self, name)}
+        view['remaining_qty'] = self.remaining_qty
+        return view
+
+    @classmethod
+    def from_legacy(cls, symbol, data):
+        """v1 positions.json dict → Position"""
+        gtt = data.get('bracket_mode') == "GTT"
+        return cls(
+            symbol, data['action'],
+            position_id=data.get('position_id'),
+            bracket_mode=data.get('bracket_mode', "LEGS"),
+            qty_requested=data.get('qty_requested'),
+            filled_qty=data.get('filled_qty'),
+            entry_price=data.get('entry_price'),
+            entry=OrderLeg.from_payload(data.get('entry_order_data'),
+                                        data.get('gtt_order_id') if gtt else data.get('entry_order_id')),
+            sl=OrderLeg.from_payload(data.get('sl_order_data'), data.get('sl_order_id')),
+            tp=None if gtt else OrderLeg.from_payload(data.get('tp_order_data'), data.get('tp_order_id')),
+            partial=OrderLeg.from_payload(data.get('partial_order_data'),
+                                          data.get('partial_gtt_order_id') if gtt else data.get('partial_order_id')),
+            partial_filled=data.get('partial_filled'),
+            trail_points=data.get('trail_points'),
+            signal=data.get('signal'),
+            created_at=data.get('created_at'),
+            realized_pnl=data.get('realized_pnl')
+        )
+
+def positions_document(positions):
+    """symbol → Position  →  versioned positions.json document"""
+    return {
+        'version': POSITIONS_SCHEMA_VERSION,
+        'fields': {'position': list(Position.__slots__), 'leg': list(OrderLeg.__slots__)},
+        'positions': {symbol: pos.to_row() for symbol, pos in positions.items()}
+    }
+
+def positions_from_document(doc):
+    """positions.json document (any version) → symbol → Position"""
+    if 'version' not in doc:
+        return {symbol: Position.from_legacy(symbol, data) for symbol, data in doc.items()}
+    fields = doc['fields']
+    return {symbol: Position.from_row(row, fields['position'], fields['leg']) for symbol, row in doc['positions'].items()}
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # STATE MANAGEMENT
 # ═══════════════════════════════════════════════════════════════════════════════
 def save_positions():
     """Save positions to disk for crash recovery"""
+    account = current_account()
+    path = account['positions_file']
     try:
-        with open("positions.json", "w") as f:
-            json.dump(active_positions, f, indent=2)
+        with account['positions_lock']:
+            # Write aside, then swap - a crash mid-write never leaves a truncated file
+            tmp_file = path + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(positions_document(dict(account['positions'])), f, separators=(',', ':'))
+            os.replace(tmp_file, path)
         logger.info(f"✅ Positions saved: {list(active_positions.keys())}")
     except Exception as e:
         logger.error(f"❌ Position save failed: {e}")
 
+# Every mutation of active_positions bumps state_version and publishes one event;
+# /events streams them, /positions uses the version as its ETag.
+state_version = 0
+state_epoch = int(time.time())  # changes per process → no stale 304s after restart
+state_events = deque(maxlen=EVENT_BUFFER_SIZE)  # (version, event)
+state_cond = Condition()
+
+def publish_event(event_type, symbol, **fields):
+    """Record an incremental position/order change and wake SSE listeners"""
+    global state_version
+    with state_cond:
+        state_version += 1
+        event = {'version': state_version, 'type': event_type, 'symbol': symbol, 'ts': time.time()}
+        if account_label():
+            event['account'] = account_label()
+        event.update(fields)
+        state_events.append((state_version, event))
+        state_cond.notify_all()
+    return event
+
+def events_since(version):
+    """Buffered events newer than version (None if the buffer no longer reaches back)"""
+    with state_cond:
+        if state_events and state_events[0][0] > version + 1:
+            return None
+        return [e for v, e in state_events if v > version]
+
+def position_summary(symbol, pos):
+    """Slim view of a position (no raw order payloads)"""
+    return {
+        'symbol': symbol,
+        'account': current_account()['name'],
+        'action': pos.action,
+        'filled_qty': pos.filled_qty,
+        'partial_filled': pos.partial_filled,
+        'sl_trigger': pos.sl.trigger_price if pos.sl else None,
+        'bracket_mode': pos.bracket_mode
+    }
+
+def close_position_state(symbol, reason, exit_price=None):
+    """Drop a closed position everywhere: state, disk, P&L book, trade ledger, event stream"""
+    pos = active_positions.pop(symbol, None)
+    if pos is None:
+        return
+    save_positions()
+    pnl = pos.realized_pnl + book_close(symbol, exit_price)
+    ledger_append(symbol, pos, reason, pnl)
+    publish_event('position_closed', symbol, reason=reason, pnl=round(pnl, 2))
+
 def load_positions():
     """Load positions from disk on startup"""
-    global active_positions
+    account = current_account()
     try:
-        if os.path.exists("positions.json"):
-            with open("positions.json", "r") as f:
-                active_positions = json.load(f)
-            logger.info(f"✅ Restored {len(active_positions)} positions from disk")
+        if os.path.exists(account['positions_file']):
+            with open(account['positions_file'], "r") as f:
+                account['positions'] = positions_from_document(json.load(f))
+            logger.info(f"✅ Restored {len(account['positions'])} positions from disk ({account['name']})")
     except Exception as e:
         logger.error(f"❌ Position restore failed: {e}")
-        active_positions = {}
-
-load_positions()
+        account['positions'] = {}
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # MARKET HOURS VALIDATION
 # ═══════════════════════════════════════════════════════════════════════════════
+IST = pytz.timezone('Asia/Kolkata')
+
+def in_session(ts):
+    """Quiet NSE-hours test for poll loops (is_market_open logs every miss)"""
+    now = datetime.fromtimestamp(ts, IST)
+    return now.weekday() < 5 and dt_time(9, 15) <= now.time() <= dt_time(15, 30)
+
 def is_market_open():
     """Check if NSE market is open (9:15 AM - 3:30 PM IST, Mon-Fri)"""
     try:
@@ -121,6 +691,9 @@ def is_market_open():
 # ═══════════════════════════════════════════════════════════════════════════════
 # TELEGRAM NOTIFICATIONS
 # ═══════════════════════════════════════════════════════════════════════════════
+telegram_session = requests.Session()  # pooled - the pre-market warm-up opens it before the bell
+telegram_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
 def send_telegram_message(message, parse_mode='HTML'):
     """Send Telegram notification"""
     if not TELEGRAM_TOKEN or not CHAT_ID:
@@ -132,7 +705,9 @@ def send_telegram_message(message, parse_mode='HTML'):
             'parse_mode': parse_mode,
             'disable_web_page_preview': True
         }
-        response = requests.post(TELEGRAM_API_URL, json=payload, timeout=10)
+        if account_label():
+            payload['text'] = f"👤 <b>{account_label()}</b>\n{message}"
+        response = telegram_session.post(TELEGRAM_API_URL, json=payload, timeout=10)
         return response.status_code == 200
     except Exception as e:
         logger.error(f"Telegram send failed: {e}")
@@ -147,6 +722,43 @@ def safe_float(value, default=0.0):
     except:
         return default
 
+def signal_metadata(data):
+    """Strategy context of a signal (what the alerts show) - kept with the position for analytics"""
+    return {
+        'price': safe_float(data.get('price')),
+        'sl': safe_float(data.get('sl')),
+        'tp': safe_float(data.get('tp')),
+        'risk': safe_float(data.get('risk')),
+        'rr': safe_float(data.get('rr'), 1),
+        'confluence': safe_float(data.get('confluence', 0)),
+        'regime': str(data.get('regime', 'N/A')),
+        'killzone': str(data.get('killzone', 'N/A')),
+        'underlying': str(data.get('underlying', ''))
+    }
+
+def parse_signal(data):
+    """Normalise a webhook payload (shared by /webhook and the backtester)"""
+    return {
+        'action': str(data.get('action', '')).upper(),
+        'symbol': str(data.get('symbol', '')).replace("-EQ", "").replace("NSE:", "").strip().upper(),
+        'qty': max(1, int(round(safe_float(data.get('qty', 1))))),
+        'price': safe_float(data.get('price')),
+        'sl': safe_float(data.get('sl')),
+        'tp': safe_float(data.get('tp')),
+        'partial_tp': safe_float(data.get('partial_tp'))
+    }
+
+def partial_quantity(filled_qty, partial_tp_price, fraction=PARTIAL_TP_FRACTION, lot_size=1):
+    """Qty for the partial TP leg in whole lots (0 = no partial leg)"""
+    if not partial_tp_price or filled_qty < 2 * lot_size:
+        return 0
+    return int(filled_qty * fraction / lot_size) * lot_size
+
+def lot_size(symbol):
+    """Exchange lot for symbol (1 for equity)"""
+    contract = option_contracts.get(symbol)
+    return contract['lot_size'] if contract else 1
+
 def format_buy_alert(data):
     """Format BUY signal alert message"""
     symbol = data.get('symbol', 'N/A')
@@ -236,27 +848,136 @@ def format_sell_alert(data):
 # ═══════════════════════════════════════════════════════════════════════════════
 # UPSTOX TOKEN MANAGEMENT
 # ═══════════════════════════════════════════════════════════════════════════════
+def decode_token_expiry(token):
+    """Read the exp claim (epoch seconds) from a JWT without verifying it"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims['exp']) if claims.get('exp') else None
+    except Exception:
+        return None
+
+def get_vault_cipher():
+    """Fernet cipher for the current account's token vault (None if no key material)"""
+    account = current_account()
+    key = TOKEN_VAULT_KEY
+    if not key:
+        if not account['api_secret']:
+            return None
+        key = base64.urlsafe_b64encode(hashlib.sha256(f"advbot-vault:{account['api_secret']}".encode()).digest())
+    try:
+        return Fernet(key)
+    except Exception as e:
+        logger.error(f"❌ Token vault key invalid: {e}")
+        return None
+
+def save_token_vault():
+    """Persist current token encrypted at rest"""
+    account = current_account()
+    cipher = get_vault_cipher()
+    if not cipher or not account['access_token']:
+        return False
+    try:
+        blob = json.dumps({
+            'access_token': account['access_token'],
+            'generated_at': account['token_generated_at'].timestamp() if account['token_generated_at'] else None,
+            'expires_at': account['token_expires_at']
+        }).encode()
+        tmp_file = f"{account['vault_file']}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(cipher.encrypt(blob))
+        os.replace(tmp_file, account['vault_file'])
+        logger.info(f"✅ Token saved to vault ({account['name']})")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Token vault save failed: {e}")
+        return False
+
+def load_token_vault():
+    """Restore token from vault on startup (validated lazily on first use)"""
+    account = current_account()
+    cipher = get_vault_cipher()
+    if not cipher or not os.path.exists(account['vault_file']):
+        return False
+    try:
+        with open(account['vault_file'], "rb") as f:
+            stored = json.loads(cipher.decrypt(f.read()))
+        expires_at = stored.get('expires_at') or decode_token_expiry(stored['access_token'])
+        if expires_at and expires_at <= time.time():
+            logger.warning(f"⚠️ Vault token already expired - login required ({account['name']})")
+            return False
+        account['access_token'] = stored['access_token']
+        account['token_generated_at'] = datetime.fromtimestamp(stored['generated_at']) if stored.get('generated_at') else datetime.now()
+        account['token_expires_at'] = expires_at
+        account['token_verified'] = False
+        logger.info(f"✅ Token restored from vault ({account['name']})")
+        return True
+    except InvalidToken:
+        logger.error("❌ Token vault decrypt failed (key changed?)")
+        return False
+    except Exception as e:
+        logger.error(f"❌ Token vault load failed: {e}")
+        return False
+
+def clear_token():
+    """Drop in-memory token and vault copy"""
+    account = current_account()
+    account['access_token'] = None
+    account['token_generated_at'] = None
+    account['token_expires_at'] = None
+    account['token_verified'] = False
+    try:
+        if os.path.exists(account['vault_file']):
+            os.remove(account['vault_file'])
+    except Exception as e:
+        logger.error(f"❌ Token vault delete failed: {e}")
+
+def verify_token_with_broker():
+    """Single cheap profile call - confirms a vault-loaded token still works"""
+    account = current_account()
+    try:
+        url = "https://api.upstox.com/v2/user/profile"
+        headers = {'Authorization': f"Bearer {account['access_token']}", 'Accept': 'application/json'}
+        response = broker_request('GET', url, headers=headers, timeout=10)
+        if response.status_code == 200:
+            account['token_verified'] = True
+            logger.info(f"✅ Vault token verified with broker ({account['name']})")
+            return True
+        if response.status_code == 401:
+            logger.warning(f"⚠️ Vault token rejected by broker - login required ({account['name']})")
+            clear_token()
+            return False
+        # Broker hiccup - keep token, retry verification on next use
+        return True
+    except Exception as e:
+        logger.error(f"Token verification failed: {e}")
+        return True
+
 def generate_access_token(auth_code):
     """Generate Upstox access token from authorization code"""
-    global access_token, token_generated_at
+    account = current_account()
     url = "https://api.upstox.com/v2/login/authorization/token"
     data = {
         'code': auth_code,
-        'client_id': UPSTOX_API_KEY,
-        'client_secret': UPSTOX_API_SECRET,
+        'client_id': account['api_key'],
+        'client_secret': account['api_secret'],
         'redirect_uri': UPSTOX_REDIRECT_URI,
         'grant_type': 'authorization_code'
     }
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
     
     try:
-        response = requests.post(url, data=data, headers=headers, timeout=10)
+        response = broker_request('POST', url, data=data, headers=headers, timeout=10)
         
         if response.status_code == 200:
             token_data = response.json()
-            access_token = token_data['access_token']
-            token_generated_at = datetime.now()
-            logger.info("✅ Upstox Access Token Generated Successfully!")
+            account['access_token'] = token_data['access_token']
+            account['token_generated_at'] = datetime.now()
+            account['token_expires_at'] = decode_token_expiry(account['access_token'])
+            account['token_verified'] = True
+            save_token_vault()
+            logger.info(f"✅ Upstox Access Token Generated Successfully! ({account['name']})")
             send_telegram_message("✅ <b>Upstox Token Auto-Generated!</b>\nBot अब live trading के लिए ready है।")
             return True
         else:
@@ -266,34 +987,51 @@ def generate_access_token(auth_code):
         logger.error(f"❌ Token generation error: {e}")
         return False
 
+def token_seconds_left():
+    """Seconds until token expiry (JWT exp, else 20h heuristic), 0 if no token"""
+    account = current_account()
+    if not account['access_token']:
+        return 0
+    if account['token_expires_at']:
+        return max(0, account['token_expires_at'] - time.time())
+    if account['token_generated_at']:
+        elapsed = (datetime.now() - account['token_generated_at']).total_seconds()
+        return max(0, TOKEN_FALLBACK_HOURS * 3600 - elapsed)
+    return 0
+
 def is_token_valid():
-    """Check if current token is still valid (< 20 hours old)"""
-    if not access_token or not token_generated_at:
-        return False
-    hours_elapsed = (datetime.now() - token_generated_at).total_seconds() / 3600
-    return hours_elapsed < 20
+    """Check if current token is still valid (JWT exp claim)"""
+    return token_seconds_left() > 0
 
 def get_token():
     """Get valid token or None"""
-    return access_token if is_token_valid() else None
+    if not is_token_valid():
+        return None
+    if not current_account()['token_verified'] and not verify_token_with_broker():
+        return None
+    return current_account()['access_token']
+
+def login_url(base_url):
+    """Login link for the current account"""
+    name = account_label()
+    return f"{base_url}login?account={name}" if name else f"{base_url}login"
 
 def token_expiry_monitor():
-    """Background thread to monitor token expiry"""
+    """Background thread to monitor token expiry (every account)"""
     while True:
         try:
-            if token_generated_at:
-                hours_left = 20 - ((datetime.now() - token_generated_at).total_seconds() / 3600)
-                if hours_left < 1 and hours_left > 0:
-                    msg = f"⚠️ <b>TOKEN EXPIRING SOON!</b>\n\nToken will expire in {int(hours_left * 60)} minutes.\n\nLogin at: {UPSTOX_REDIRECT_URI.replace('/callback', '/login')}"
-                    send_telegram_message(msg)
-                    logger.warning(f"⚠️ Token expiring in {hours_left:.2f} hours")
+            for account in each_account():
+                if account['access_token']:
+                    hours_left = token_seconds_left() / 3600
+                    if hours_left < 1 and hours_left > 0:
+                        msg = f"⚠️ <b>TOKEN EXPIRING SOON!</b>\n\nToken will expire in {int(hours_left * 60)} minutes.\n\nLogin at: {login_url(UPSTOX_REDIRECT_URI.replace('callback', ''))}"
+                        send_telegram_message(msg)
+                        logger.warning(f"⚠️ Token expiring in {hours_left:.2f} hours ({account['name']})")
             time.sleep(1800)  # Check every 30 minutes
         except Exception as e:
             logger.error(f"Token monitor error: {e}")
             time.sleep(1800)
 
-# Start token monitor thread
-Thread(target=token_expiry_monitor, daemon=True).start()
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # INSTRUMENT KEY LOADER
@@ -301,33 +1039,55 @@ Thread(target=token_expiry_monitor, daemon=True).start()
 def load_instruments():
     """Load NSE instrument keys from Upstox"""
     global instruments_dict
+    instruments_loading.set()
     try:
         url = "https://assets.upstox.com/market-quote/instruments/exchange/complete.json.gz"
         response = requests.get(url, timeout=30)
         
         import gzip
-        import io
         data = json.loads(gzip.decompress(response.content))
         
-        for key, info in data.items():
+        loaded = {}
+        options = []
+        rows = data.items() if isinstance(data, dict) else ((row.get('instrument_key'), row) for row in data)
+        for key, info in rows:
             if info.get('instrument_type') == 'EQUITY' and info.get('exchange') == 'NSE':
                 trading_symbol = info['trading_symbol'].upper()
-                instruments_dict[trading_symbol] = key
+                loaded[trading_symbol] = key
                 # Also store without -EQ suffix
                 if trading_symbol.endswith('-EQ'):
                     base_symbol = trading_symbol.replace('-EQ', '')
-                    instruments_dict[base_symbol] = key
+                    loaded[base_symbol] = key
+            elif info.get('segment') == 'NSE_FO' and info.get('instrument_type') in ('CE', 'PE'):
+                options.append((key, info))
         
-        logger.info(f"✅ Loaded {len(instruments_dict)} NSE instruments")
+        # Swap in one step so lookups never see a half-built index
+        instruments_dict = loaded
+        build_option_chains(options)
+        instruments_ready.set()
+        readiness['instruments'] = True
+        logger.info(f"✅ Loaded {len(instruments_dict)} NSE instruments | {len(option_contracts)} NFO options")
     except Exception as e:
         logger.error(f"❌ Instruments load failed: {e}")
+    finally:
+        instruments_loading.clear()
 
-load_instruments()
+def wait_for_instruments(timeout=30):
+    """Block only while a download is in flight → True once the index is usable"""
+    deadline = time.monotonic() + timeout
+    while not instruments_ready.is_set() and instruments_loading.is_set() and time.monotonic() < deadline:
+        instruments_ready.wait(0.1)
+    return instruments_ready.is_set()
 
 def get_instrument_key(symbol):
     """Get Upstox instrument key for symbol"""
     symbol_clean = symbol.upper().replace("NSE:", "").strip()
     
+    # Instruments load in the background - wait for them on the first signals, fail fast if the load failed
+    if not wait_for_instruments():
+        logger.error(f"❌ Instrument index not loaded - cannot resolve {symbol_clean}")
+        return None
+    
     # Try exact match first
     if symbol_clean in instruments_dict:
         return instruments_dict[symbol_clean]
@@ -338,14 +1098,178 @@ def get_instrument_key(symbol):
         if eq_symbol in instruments_dict:
             return instruments_dict[eq_symbol]
     
+    # Option contract picked by the router
+    if symbol_clean in option_contracts:
+        return option_contracts[symbol_clean]['instrument_key']
+    
     logger.error(f"❌ Instrument not found: {symbol_clean}")
     return None
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# OPTION ROUTING (underlying signal → NFO CE/PE contract)
+# ═══════════════════════════════════════════════════════════════════════════════
+def option_expiry_day(value):
+    """Instrument-master expiry (epoch ms or YYYY-MM-DD) → IST calendar day"""
+    if isinstance(value, (int, float)) and value > 0:
+        return np.datetime64(datetime.fromtimestamp(value / 1000, IST).date(), 'D')
+    try:
+        return np.datetime64(str(value)[:10], 'D')
+    except ValueError:
+        return None
+
+def build_option_chains(options):
+    """Index NFO option rows once: underlying → sorted expiries + per-expiry sorted CE/PE strike arrays"""
+    global option_chains, option_contracts
+    grouped = {}
+    contracts = {}
+    for key, info in options:
+        underlying = str(info.get('underlying_symbol') or info.get('name') or '').upper()
+        strike = safe_float(info.get('strike_price'))
+        expiry = option_expiry_day(info.get('expiry'))
+        if not underlying or not strike or expiry is None:
+            continue
+        contract = {
+            'instrument_key': key,
+            'trading_symbol': info['trading_symbol'].upper(),
+            'underlying': underlying,
+            'option_type': info['instrument_type'],
+            'strike': strike,
+            'expiry': str(expiry),
+            'lot_size': max(int(safe_float(info.get('lot_size'), 1)), 1)
+        }
+        contracts[contract['trading_symbol']] = contract
+        sides = grouped.setdefault(underlying, {}).setdefault(expiry, {})
+        sides.setdefault(contract['option_type'], []).append(contract)
+
+    chains = {}
+    for underlying, by_expiry in grouped.items():
+        days = sorted(by_expiry)
+        expiries = np.array(days, dtype='datetime64[D]')
+        months = expiries.astype('datetime64[M]')
+        sides = []
+        for day in days:
+            side = {}
+            for option_type, rows in by_expiry[day].items():
+                rows.sort(key=lambda c: c['strike'])
+                side[option_type] = (np.array([c['strike'] for c in rows]), rows)
+            sides.append(side)
+        chains[underlying] = {
+            'expiries': expiries,
+            'monthly': np.append(months[1:] != months[:-1], True),  # last expiry of its month
+            'sides': sides
+        }
+
+    # Swap in one step, like instruments_dict
+    option_chains = chains
+    option_contracts = contracts
+
+def select_option(underlying, action, spot, strike_offset=OPTION_STRIKE_OFFSET, expiry=OPTION_EXPIRY, today=None):
+    """Contract for a signal (BUY → CE, SELL → PE); strike_offset > 0 = OTM, < 0 = ITM - two binary searches"""
+    chain = option_chains.get(underlying)
+    if not chain or not spot:
+        return None
+    today = today or np.datetime64(datetime.now(IST).date(), 'D')
+    expiries = chain['expiries']
+    first = int(np.searchsorted(expiries, today + OPTION_MIN_DAYS_TO_EXPIRY))
+    if expiry == "MONTHLY":
+        monthly = np.flatnonzero(chain['monthly'][first:])
+        first = first + int(monthly[0]) if len(monthly) else len(expiries)
+    if first >= len(expiries):
+        return None
+
+    option_type = "CE" if action == "BUY" else "PE"
+    strikes, contracts = chain['sides'][first].get(option_type, (None, None))
+    if strikes is None:
+        return None
+    if not strikes[0] <= spot <= strikes[-1]:
+        return None  # spot outside the listed chain - a bad price, not a deep ITM/OTM request
+    i = int(np.searchsorted(strikes, spot))
+    # ATM = nearest listed strike
+    if i == len(strikes) or (i > 0 and spot - strikes[i - 1] <= strikes[i] - spot):
+        i -= 1
+    # OTM is above spot for calls, below spot for puts
+    i += strike_offset if option_type == "CE" else -strike_offset
+    if not 0 <= i < len(strikes):
+        return None
+    return contracts[i]
+
+def wants_option_route(data):
+    """Per-signal 'route' (option | direct) wins over OPTION_ROUTING"""
+    route = str(data.get('route', '')).lower()
+    if route:
+        return route == 'option'
+    return OPTION_ROUTING == "ON"
+
+def route_to_option(data, signal_data):
+    """Rewrite an underlying signal as a long option signal → (routed payload, None) or (None, reason)"""
+    underlying = signal_data['symbol']
+    spot = signal_data['price']
+    if not spot:
+        return None, 'Option routing needs the underlying price'
+    if not wait_for_instruments():
+        return None, 'Instrument index not loaded'
+
+    expiry = str(data.get('expiry', OPTION_EXPIRY)).upper()
+    strike_offset = int(safe_float(data.get('strike_offset'), OPTION_STRIKE_OFFSET))
+    contract = select_option(underlying, signal_data['action'], spot, strike_offset, expiry)
+    if not contract:
+        return None, f'No {expiry.lower()} option contract for {underlying} @ {spot}'
+
+    with account_context(market_data_account()):
+        premium = fetch_ltp_batch([contract['instrument_key']]).get(contract['instrument_key'])
+    if not premium:
+        return None, f"No quote for {contract['trading_symbol']}"
+
+    # SL/TP are underlying levels - carry the distance onto the premium through delta (puts move against spot)
+    direction = 1 if contract['option_type'] == "CE" else -1
+    def premium_at(level):
+        if not level:
+            return 0.0
+        moved = premium + direction * OPTION_DELTA * (level - spot)
+        return max(round(round(moved / OPTION_TICK) * OPTION_TICK, 2), OPTION_TICK)
+
+    qty = max(1, int(safe_float(data.get('lots'), OPTION_LOTS))) * contract['lot_size']
+    sl = premium_at(signal_data['sl'])
+    routed = dict(data)
+    routed.update({
+        'symbol': contract['trading_symbol'],
+        'action': 'BUY',
+        'qty': qty,
+        'price': premium,
+        'sl': sl,
+        'tp': premium_at(signal_data['tp']),
+        'partial_tp': premium_at(signal_data['partial_tp']),
+        'risk': round((premium - sl) * qty, 2) if sl else safe_float(data.get('risk')),
+        'route': 'direct',  # already a contract - never routed twice
+        'underlying': underlying,
+        'underlying_action': signal_data['action'],
+        'underlying_price': spot,
+        'option_type': contract['option_type'],
+        'strike': contract['strike'],
+        'contract_expiry': contract['expiry']
+    })
+    if data.get('trail'):
+        routed['trail'] = round(safe_float(data.get('trail')) * OPTION_DELTA, 2)
+    return routed, None
+
+def resolve_signal(data, signal_data):
+    """Spooled payload → (payload, signal_data, None) to execute, option contract resolved if routed - or (None, None, reason)"""
+    if not wants_option_route(data):
+        return data, signal_data, None
+    action, symbol = signal_data['action'], signal_data['symbol']
+    routed, reason = route_to_option(data, signal_data)
+    if not routed:
+        logger.warning(f"⚠️ Option routing failed: {action} {symbol} | {reason}")
+        send_telegram_message(f"⚠️ <b>Option Routing Failed</b>\n\nSignal: {action} {symbol}\n{reason}")
+        return None, None, reason
+    logger.info(f"🎯 Option route: {action} {symbol} @ {signal_data['price']} → {routed['symbol']} @ {routed['price']}")
+    return routed, dict(parse_signal(routed), received_at=signal_data['received_at']), None
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # ORDER MANAGEMENT WITH VERIFICATION
 # ═══════════════════════════════════════════════════════════════════════════════
-def get_order_status(order_id):
-    """Get current status of an order"""
+def get_order_details(order_id):
+    """Broker row of an order (status, filled_quantity, average_price, ...) or None"""
     token = get_token()
     if not token or not order_id:
         return None
@@ -353,56 +1277,124 @@ def get_order_status(order_id):
     try:
         url = f"https://api.upstox.com/v2/order/details?order_id={order_id}"
         headers = {'Authorization': f'Bearer {token}'}
-        response = requests.get(url, headers=headers, timeout=10)
+        response = broker_request('GET', url, headers=headers, timeout=10)
         
         if response.status_code == 200:
             data = response.json()
-            return data.get('data', {}).get('status')
+            return data.get('data') or {}
         return None
     except Exception as e:
         logger.error(f"Order status check failed {order_id}: {e}")
         return None
 
+def get_order_status(order_id):
+    """Get current status of an order"""
+    row = get_order_details(order_id)
+    return row.get('status') if row else None
+
+def fetch_order_statuses(order_ids):
+    """Broker rows for pending orders - details call for one order, one order-book call for many"""
+    if len(order_ids) > 1:
+        return fetch_order_book() or {}
+    url = f"https://api.upstox.com/v2/order/details?order_id={order_ids[0]}"
+    headers = {'Authorization': f'Bearer {get_token()}', 'Accept': 'application/json'}
+    response = broker_request('GET', url, headers=headers, timeout=10)
+    if response.status_code != 200:
+        return {}
+    return {order_ids[0]: response.json().get('data') or {}}
+
+def fill_poller():
+    """Per-account thread: one batched status poll serves every pending fill wait, exits when idle"""
+    account = current_account()
+    waiters = account['fill_waiters']
+    while True:
+        with account['fill_lock']:
+            if not waiters:
+                account['fill_poller'] = None
+                return
+            delay = min(w['due'] for w in waiters.values()) - time.monotonic()
+        if delay > 0:
+            # A new waiter sets fill_wake so its first fast probe is not stuck behind a backed-off one
+            account['fill_wake'].wait(delay)
+            account['fill_wake'].clear()
+            continue
+
+        with account['fill_lock']:
+            now = time.monotonic()
+            batch = [oid for oid, w in waiters.items() if w['due'] <= now]
+        try:
+            rows = fetch_order_statuses(batch) if batch and get_token() else {}
+        except Exception as e:
+            logger.error(f"Fill poll failed {batch}: {e}")
+            rows = {}
+
+        with account['fill_lock']:
+            now = time.monotonic()
+            for oid in batch:
+                waiter = waiters.get(oid)
+                if waiter is None:
+                    continue
+                row = rows.get(oid)
+                if row and row.get('status') in ORDER_FINAL_STATES:
+                    waiter['row'] = row
+                    waiter['done'].set()
+                    del waiters[oid]
+                    continue
+                waiter['probes'] += 1
+                waiter['due'] = now + FILL_POLL_SCHEDULE[min(waiter['probes'], len(FILL_POLL_SCHEDULE) - 1)]
+
+def wait_for_fill(order_id, timeout=ORDER_FILL_TIMEOUT):
+    """Block until an order reaches a final state → broker order row (None on timeout)"""
+    account = current_account()
+    waiter = {'done': Event(), 'row': None, 'probes': 0, 'due': time.monotonic() + FILL_POLL_SCHEDULE[0]}
+    with account['fill_lock']:
+        account['fill_waiters'][order_id] = waiter
+        if account['fill_poller'] is None:
+            account['fill_poller'] = Thread(target=run_in_account, args=(account, fill_poller),
+                                            daemon=True, name=f"fill-poller-{account['name']}")
+            account['fill_poller'].start()
+    account['fill_wake'].set()
+    waiter['done'].wait(timeout)
+    with account['fill_lock']:
+        account['fill_waiters'].pop(order_id, None)
+    return waiter['row']
+
 def verify_order_fill(order_id, timeout=ORDER_FILL_TIMEOUT):
-    """Wait and verify if order is filled"""
+    """Wait for an order to fill → (is_filled, filled_qty, avg_fill_price), returned as soon as the broker reports it"""
     if not order_id:
-        return False, 0
-    
-    start_time = time.time()
-    while (time.time() - start_time) < timeout:
-        status = get_order_status(order_id)
-        
-        if status == "complete":
-            logger.info(f"✅ Order {order_id} FILLED")
-            return True, get_filled_quantity(order_id)
-        elif status in ["rejected", "cancelled"]:
-            logger.error(f"❌ Order {order_id} {status.upper()}")
-            return False, 0
-        
-        time.sleep(2)
-    
-    logger.warning(f"⚠️ Order {order_id} fill timeout")
-    return False, 0
+        return False, 0, 0.0
 
-def get_filled_quantity(order_id):
-    """Get actual filled quantity from order"""
-    token = get_token()
-    if not token or not order_id:
-        return 0
-    
-    try:
-        url = f"https://api.upstox.com/v2/order/details?order_id={order_id}"
-        headers = {'Authorization': f'Bearer {token}'}
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            order_data = data.get('data', {})
-            return int(order_data.get('filled_quantity', 0))
-        return 0
-    except Exception as e:
-        logger.error(f"Get filled qty failed {order_id}: {e}")
-        return 0
+    row = wait_for_fill(order_id, timeout)
+    if row is None:
+        logger.warning(f"⚠️ Order {order_id} fill timeout")
+        return False, 0, 0.0
+
+    status = row.get('status')
+    if status == "complete":
+        filled_qty = int(row.get('filled_quantity') or 0)
+        fill_price = safe_float(row.get('average_price'))
+        logger.info(f"✅ Order {order_id} FILLED | Qty: {filled_qty} @ ₹{fill_price:.2f}")
+        return True, filled_qty, fill_price
+
+    logger.error(f"❌ Order {order_id} {status.upper()}")
+    return False, 0, 0.0
+
+ORDER_TAG_PREFIX = "ADV"  # tag = ADV-<leg>-<position_id>, legs: E entry, P partial, T tp, S sl, X exit
+
+def new_position_id():
+    """Short unique id linking a position's orders via their tags"""
+    return f"{int(time.time() * 1000):x}"
+
+def order_tag(leg, position_id=None):
+    """Broker order tag used by crash recovery to rebuild position state"""
+    return f"{ORDER_TAG_PREFIX}-{leg}-{position_id}" if position_id else f"{ORDER_TAG_PREFIX}-{leg}"
+
+def parse_order_tag(tag):
+    """ADV-<leg>-<position_id> → (leg, position_id), None if not ours"""
+    parts = (tag or '').split('-')
+    if len(parts) != 3 or parts[0] != ORDER_TAG_PREFIX:
+        return None
+    return parts[1], parts[2]
 
 def place_order(order_data, label="Order", retry_count=0):
     """Place order with retry logic"""
@@ -419,17 +1411,24 @@ def place_order(order_data, label="Order", retry_count=0):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=order_data, timeout=10)
+        sent_at = time.time()
+        response = broker_request('POST', url, headers=headers, json=order_data, timeout=10)
+        acked_at = time.time()
         result = response.json()
         order_id = result.get('data', {}).get('order_id')
         success = response.status_code == 200 and result.get('status') == 'success'
         
         if success:
+            current_account()['order_ids'][order_id] = time.time()
             logger.info(f"✅ {label} SUCCESS | ID: {order_id} | Symbol: {order_data.get('instrument_token')}")
             if TELEGRAM_TOKEN:
                 qty = order_data.get('quantity')
                 trans_type = order_data.get('transaction_type')
                 send_telegram_message(f"✅ {label}: {trans_type} {qty} | ID: {order_id}")
+        elif is_margin_rejection(result):
+            # Retrying cannot help - resync the funds snapshot so the next signal is sized right
+            logger.error(f"❌ {label} REJECTED (margin) | Response: {result}")
+            refresh_funds()
         else:
             logger.error(f"❌ {label} FAILED | Response: {result}")
             if retry_count < MAX_ORDER_RETRIES:
@@ -441,7 +1440,8 @@ def place_order(order_data, label="Order", retry_count=0):
             "success": success,
             "order_id": order_id,
             "raw": result,
-            "timestamp": time.time()
+            "sent_at": sent_at,
+            "acked_at": acked_at
         }
     except Exception as e:
         logger.error(f"❌ {label} exception: {e}")
@@ -451,123 +1451,2026 @@ def place_order(order_data, label="Order", retry_count=0):
             return place_order(order_data, label, retry_count + 1)
         return {"success": False, "error": str(e), "order_id": None}
 
-def cancel_order(order_id):
-    """Cancel an order"""
-    if not order_id or not get_token():
-        return False
+def cancel_order(order_id):
+    """Cancel an order"""
+    if not order_id or not get_token():
+        return False
+    try:
+        url = f"https://api.upstox.com/v2/order/cancel?order_id={order_id}"
+        headers = {'Authorization': f'Bearer {get_token()}'}
+        response = broker_request('DELETE', url, headers=headers, timeout=10)
+        if response.status_code == 200:
+            logger.info(f"✅ Cancelled order: {order_id}")
+            return True
+        return False
+    except Exception as e:
+        logger.error(f"❌ Cancel failed {order_id}: {e}")
+        return False
+
+def modify_order(order_id, order_data, label="MODIFY"):
+    """Modify a live order in place (quantity / price / trigger) - single call"""
+    token = get_token()
+    if not token or not order_id:
+        return False
+
+    url = "https://api.upstox.com/v2/order/modify"
+    headers = {
+        'Authorization': f'Bearer {token}',
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+    payload = {
+        "order_id": order_id,
+        "quantity": order_data["quantity"],
+        "validity": order_data.get("validity", "DAY"),
+        "price": order_data.get("price", 0),
+        "order_type": order_data["order_type"],
+        "disclosed_quantity": order_data.get("disclosed_quantity", 0),
+        "trigger_price": order_data.get("trigger_price", 0)
+    }
+
+    try:
+        response = broker_request('PUT', url, headers=headers, json=payload, timeout=10)
+        result = response.json()
+        success = response.status_code == 200 and result.get('status') == 'success'
+        if success:
+            logger.info(f"✅ {label} SUCCESS | ID: {order_id} | Qty: {payload['quantity']} | Trigger: {payload['trigger_price']}")
+        else:
+            logger.error(f"❌ {label} FAILED | ID: {order_id} | Response: {result}")
+        return success
+    except Exception as e:
+        logger.error(f"❌ {label} exception {order_id}: {e}")
+        return False
+
+sl_lock = Lock()  # monitor (qty) and trailing engine (trigger) both edit the SL
+SL_FINAL_STATES = ["complete", "cancelled", "rejected"]
+
+def adjust_sl_order(symbol, pos, quantity=None, trigger_price=None):
+    """
+    Change the protective SL of a position (qty and/or trigger).
+    Modify in place first; cancel + re-place only if the broker refuses the modify
+    and the SL is still live. True = SL now matches; False = not adjusted (a failed
+    re-place has already emergency-exited the position and alerted).
+    """
+    with sl_lock:
+        return _adjust_sl_order(symbol, pos, quantity, trigger_price)
+
+def _adjust_sl_order(symbol, pos, quantity, trigger_price):
+    if active_positions.get(symbol) is not pos or not pos.leg_id('sl'):
+        return False  # closed meanwhile (monitor / reversal) - nothing left to protect
+
+    new_sl = pos.sl.with_changes()
+    if quantity is not None:
+        new_sl.quantity = quantity
+    if trigger_price is not None:
+        new_sl.trigger_price = round(trigger_price, 2)
+
+    if modify_order(pos.sl.order_id, new_sl.payload(), "SL MODIFY"):
+        pos.sl = new_sl
+        return True
+
+    # Modify refused → cancel + re-place, but never for a finished SL or a position closed meanwhile
+    status = get_order_status(pos.sl.order_id)
+    if status in SL_FINAL_STATES or active_positions.get(symbol) is not pos:
+        if status in ["cancelled", "rejected"] and active_positions.get(symbol) is pos:
+            logger.critical(f"🚨 SL {pos.sl.order_id} is {status}: {symbol} unprotected")
+            send_telegram_message(f"🚨 <b>SL {status.upper()}</b>\n\nSymbol: {symbol}\nOrder: {pos.sl.order_id}\nPosition is unprotected - check manually!")
+        return False
+    if not cancel_order(pos.sl.order_id):
+        logger.critical(f"🚨 SL modify and cancel both failed: {symbol} | {pos.sl.order_id} left unchanged")
+        send_telegram_message(f"🚨 <b>SL ADJUST FAILED</b>\n\nSymbol: {symbol}\nOrder: {pos.sl.order_id}\nOld SL left in place - check quantity manually!")
+        return False
+
+    new_sl.order_id = None
+    pos.sl = new_sl  # cancelled - keeps the trigger, but no longer counts as a live leg
+    sl_res = place_order(new_sl.payload(), "ADJUSTED SL")
+    if sl_res["success"]:
+        new_sl.order_id = sl_res["order_id"]
+        return True
+
+    # Old SL is gone and the new one failed → flat is the only safe state
+    logger.critical(f"🚨 SL re-place failed: {symbol} - emergency exit")
+    cancel_position_orders(pos)
+    if emergency_exit_position(symbol, new_sl.quantity, pos.action, pos.position_id, pos.instrument_key):
+        close_position_state(symbol, "EMERGENCY")
+    else:
+        send_telegram_message(f"🚨 <b>UNPROTECTED POSITION</b>\n\nSymbol: {symbol}\nQty: {new_sl.quantity}\nSL re-place and emergency exit both failed - exit manually!")
+    return False
+
+def emergency_exit_position(symbol, quantity, action, position_id=None, instrument_key=None):
+    """Emergency market exit for unprotected positions (pass the position's instrument_key when known)"""
+    logger.critical(f"🚨 EMERGENCY EXIT: {symbol} | Qty: {quantity}")
+    
+    instrument_key = instrument_key or get_instrument_key(symbol)
+    if not instrument_key:
+        logger.error(f"❌ Emergency exit failed: Symbol not found")
+        return False
+    
+    exit_action = "SELL" if action == "BUY" else "BUY"
+    exit_order = {
+        "quantity": quantity,
+        "product": "I",
+        "validity": "DAY",
+        "price": 0,
+        "instrument_token": instrument_key,
+        "order_type": "MARKET",
+        "transaction_type": exit_action,
+        "disclosed_quantity": 0,
+        "trigger_price": 0,
+        "is_amo": False,
+        "tag": order_tag("X", position_id)
+    }
+    
+    result = place_order(exit_order, "EMERGENCY EXIT")
+    
+    if result["success"]:
+        send_telegram_message(f"🚨 <b>EMERGENCY EXIT EXECUTED</b>\n\nSymbol: {symbol}\nQuantity: {quantity}\nReason: SL placement failed")
+        return True
+    return False
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# GTT / OCO BRACKET (BROKER-NATIVE)
+# ═══════════════════════════════════════════════════════════════════════════════
+GTT_EXIT_STATES = ["TRIGGERED", "COMPLETED"]
+GTT_DEAD_STATES = ["CANCELLED", "EXPIRED", "FAILED"]
+
+def place_gtt_order(gtt_data, label="GTT"):
+    """Place a GTT group (ENTRY + TARGET + STOPLOSS) - broker cancels the losing sibling"""
+    token = get_token()
+    if not token:
+        logger.error("❌ Cannot place GTT: Token missing")
+        return {"success": False, "error": "Token missing", "gtt_order_id": None}
+
+    url = "https://api.upstox.com/v3/order/gtt/place"
+    headers = {
+        'Authorization': f'Bearer {token}',
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+
+    try:
+        response = broker_request('POST', url, headers=headers, json=gtt_data, timeout=10)
+        result = response.json()
+        gtt_ids = result.get('data', {}).get('gtt_order_ids') or []
+        gtt_order_id = gtt_ids[0] if gtt_ids else None
+        success = response.status_code == 200 and result.get('status') == 'success' and gtt_order_id is not None
+
+        if success:
+            logger.info(f"✅ {label} SUCCESS | GTT ID: {gtt_order_id} | Symbol: {gtt_data.get('instrument_token')}")
+        else:
+            logger.error(f"❌ {label} FAILED | Response: {result}")
+
+        return {
+            "success": success,
+            "gtt_order_id": gtt_order_id,
+            "raw": result,
+            "timestamp": time.time()
+        }
+    except Exception as e:
+        logger.error(f"❌ {label} exception: {e}")
+        return {"success": False, "error": str(e), "gtt_order_id": None}
+
+def cancel_gtt_order(gtt_order_id):
+    """Cancel a GTT group"""
+    if not gtt_order_id or not get_token():
+        return False
+    try:
+        url = "https://api.upstox.com/v3/order/gtt/cancel"
+        headers = {
+            'Authorization': f'Bearer {get_token()}',
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        }
+        response = broker_request('DELETE', url, headers=headers, json={"gtt_order_id": gtt_order_id}, timeout=10)
+        if response.status_code == 200:
+            logger.info(f"✅ Cancelled GTT: {gtt_order_id}")
+            return True
+        return False
+    except Exception as e:
+        logger.error(f"❌ GTT cancel failed {gtt_order_id}: {e}")
+        return False
+
+def get_gtt_orders():
+    """Fetch all GTT groups in ONE call → {gtt_order_id: gtt_data} (None on failure)"""
+    token = get_token()
+    if not token:
+        return None
+    try:
+        url = "https://api.upstox.com/v3/order/gtt"
+        headers = {'Authorization': f'Bearer {token}', 'Accept': 'application/json'}
+        response = broker_request('GET', url, headers=headers, timeout=10)
+        if response.status_code != 200:
+            return None
+        data = response.json().get('data') or []
+        if isinstance(data, dict):
+            data = [data]
+        return {g.get('gtt_order_id'): g for g in data if g.get('gtt_order_id')}
+    except Exception as e:
+        logger.error(f"GTT list fetch failed: {e}")
+        return None
+
+def gtt_exit_strategy(gtt):
+    """Return 'TARGET' / 'STOPLOSS' if an exit leg of the group fired, 'DEAD' if group died, else None"""
+    if not gtt:
+        return None
+    for rule in gtt.get('rules', []):
+        strategy = (rule.get('strategy') or '').upper()
+        if strategy in ["TARGET", "STOPLOSS"] and (rule.get('status') or '').upper() in GTT_EXIT_STATES:
+            return strategy
+    for rule in gtt.get('rules', []):
+        if (rule.get('strategy') or '').upper() == "ENTRY" and (rule.get('status') or '').upper() in GTT_DEAD_STATES:
+            return "DEAD"
+    return None
+
+def build_gtt_bracket(instrument_key, action, quantity, tp_price, sl_price):
+    """GTT group: immediate market ENTRY, TARGET + STOPLOSS as broker-side OCO"""
+    rules = [{"strategy": "ENTRY", "trigger_type": "IMMEDIATE", "trigger_price": 0}]
+    if tp_price:
+        rules.append({"strategy": "TARGET", "trigger_type": "IMMEDIATE", "trigger_price": round(tp_price, 2)})
+    if sl_price:
+        rules.append({"strategy": "STOPLOSS", "trigger_type": "IMMEDIATE", "trigger_price": round(sl_price, 2)})
+    return {
+        "type": "MULTIPLE",
+        "quantity": quantity,
+        "product": "I",
+        "instrument_token": instrument_key,
+        "transaction_type": action,
+        "rules": rules
+    }
+
+def gtt_entry_status(gtt):
+    """Status of a GTT group's ENTRY rule ('' if unknown)"""
+    for rule in (gtt or {}).get('rules', []):
+        if (rule.get('strategy') or '').upper() == "ENTRY":
+            return (rule.get('status') or '').upper()
+    return ''
+
+def confirm_gtt_entries(gtt_ids, timeout=ORDER_FILL_TIMEOUT):
+    """
+    Wait for the ENTRY rule of each GTT group → {gtt_id: (state, filled_qty, avg_price)}.
+    state: FILLED / DEAD / PENDING (never triggered) / UNKNOWN (group not visible); qty/price None if not reported.
+    """
+    results = {}
+    deadline = time.monotonic() + timeout
+    step = 0
+    while True:
+        gtt_orders = get_gtt_orders() or {}
+        for gtt_id in gtt_ids:
+            if gtt_id in results:
+                continue
+            gtt = gtt_orders.get(gtt_id)
+            status = gtt_entry_status(gtt)
+            if status in GTT_EXIT_STATES:
+                entry = next(r for r in gtt['rules'] if (r.get('strategy') or '').upper() == "ENTRY")
+                row = get_order_details(entry.get('order_id')) if entry.get('order_id') else None
+                order_status = (row or {}).get('status')
+                if order_status == "complete":
+                    results[gtt_id] = ("FILLED", int(row.get('filled_quantity') or 0), safe_float(row.get('average_price')))
+                elif order_status in ORDER_FINAL_STATES:
+                    results[gtt_id] = ("DEAD", 0, 0.0)  # entry order rejected / cancelled
+                elif row is None or time.monotonic() >= deadline:
+                    results[gtt_id] = ("FILLED", None, None)  # triggered market entry, fill not reported
+            elif status in GTT_DEAD_STATES:
+                results[gtt_id] = ("DEAD", 0, 0.0)
+            elif time.monotonic() >= deadline:
+                results[gtt_id] = ("PENDING" if gtt else "UNKNOWN", 0, 0.0)
+        if len(results) == len(gtt_ids):
+            return results
+        time.sleep(FILL_POLL_SCHEDULE[min(step, len(FILL_POLL_SCHEDULE) - 1)])
+        step += 1
+
+def open_gtt_bracket(symbol, instrument_key, action, qty_requested, tp_price, sl_price, partial_tp_price, entry_price=0,
+                     position_id=None, received_at=0.0):
+    """
+    Open a position as broker-side GTT groups.
+    Partial TP gets its own group (partial qty, partial TP, same SL) so no SL resize is ever needed.
+    filled_qty counts only groups whose ENTRY is confirmed executed (each recorded as an ENTRY fill). Returns a Position or None.
+    """
+    position = Position(symbol, action, position_id=position_id, bracket_mode="GTT",
+                        qty_requested=qty_requested, filled_qty=0, entry_price=entry_price)
+
+    partial_qty = partial_quantity(qty_requested, partial_tp_price, lot_size=lot_size(symbol))
+    main_qty = qty_requested - partial_qty
+
+    main_gtt = build_gtt_bracket(instrument_key, action, main_qty, tp_price, sl_price)
+    main_res = place_gtt_order(main_gtt, "GTT BRACKET")
+    if not main_res["success"]:
+        return None
+    position.entry = OrderLeg.from_payload(main_gtt, main_res["gtt_order_id"])
+
+    groups = {main_res["gtt_order_id"]: ('entry', main_qty)}
+    if partial_qty:
+        partial_gtt = build_gtt_bracket(instrument_key, action, partial_qty, partial_tp_price, sl_price)
+        partial_res = place_gtt_order(partial_gtt, "GTT PARTIAL (50%)")
+        if partial_res["success"]:
+            position.partial = OrderLeg.from_payload(partial_gtt, partial_res["gtt_order_id"])
+            groups[partial_res["gtt_order_id"]] = ('partial', partial_qty)
+        else:
+            logger.warning(f"⚠️ GTT partial group failed: {symbol} | Continuing with {main_qty} qty")
+
+    # Count only executed entries; an entry never triggered is cancelled (nothing was bought)
+    fill_prices = []
+    for gtt_id, (state, filled, price) in confirm_gtt_entries(list(groups), ORDER_FILL_TIMEOUT).items():
+        leg_name, qty = groups[gtt_id]
+        if state in ["FILLED", "UNKNOWN"]:
+            if state == "UNKNOWN":
+                logger.warning(f"⚠️ GTT {gtt_id} not visible - assuming {qty} filled, reconcile will correct: {symbol}")
+            position.filled_qty += qty if filled is None or state == "UNKNOWN" else filled
+            if price:
+                fill_prices.append((filled, price))
+            group = position.entry if leg_name == 'entry' else position.partial
+            record_execution(symbol, "ENTRY", group, price, filled or qty, ref_price=entry_price,
+                             received_at=received_at, position_id=position_id)
+            continue
+        logger.warning(f"⚠️ GTT {leg_name} entry {state.lower()}: {symbol} | {gtt_id}")
+        if state == "PENDING":
+            cancel_gtt_order(gtt_id)
+        if leg_name == 'partial':
+            position.partial = None
+        else:
+            position.entry.order_id = None
+
+    if not position.filled_qty:
+        if position.leg_id('partial'):
+            cancel_gtt_order(position.partial.order_id)  # main died - never hold a partial-only bracket
+        return None
+    if not position.leg_id('entry'):
+        # Only the partial group filled: it carries its own TP + SL, so track it as the main group
+        position.entry, position.partial = position.partial, None
+    if fill_prices:
+        position.entry_price = sum(q * p for q, p in fill_prices) / sum(q for q, _ in fill_prices)
+    return position
+
+def cancel_position_orders(pos):
+    """Cancel every protective order of a position, whatever the bracket mode"""
+    for leg in pos.open_legs:
+        if pos.bracket_mode == "GTT":
+            cancel_gtt_order(leg.order_id)
+        else:
+            cancel_order(leg.order_id)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PORTFOLIO P&L & EXPOSURE ENGINE
+# ═══════════════════════════════════════════════════════════════════════════════
+# One slot per held instrument in parallel arrays; running totals are updated
+# by deltas on every tick so risk checks never loop over positions.
+book_lock = Lock()
+book_slots = {}          # book id → slot
+book_key_slots = {}      # instrument_key → [slots] (one per account holding it)
+book_symbols = []        # slot → book id (None when free)
+book_qty = np.zeros(64)  # signed qty (+long / -short)
+book_avg = np.zeros(64)  # entry price
+book_ltp = np.zeros(64)  # last traded price
+book_totals = {
+    'unrealized': 0.0,
+    'realized': 0.0,
+    'exposure': 0.0,
+    'peak_equity': 0.0,
+    'max_drawdown': 0.0,
+    'day': None
+}
+
+def book_id(symbol):
+    """Book key of a symbol for the current account (accounts may hold the same symbol)"""
+    name = account_label()
+    return f"{name}:{symbol}" if name else symbol
+
+def _book_roll_day():
+    """Reset daily realized P&L and drawdown at the first touch of a new day"""
+    today = datetime.now(IST).strftime('%Y%m%d')  # IST trading day, whatever the host TZ
+    if book_totals['day'] != today:
+        book_totals['day'] = today
+        book_totals['realized'] = 0.0
+        book_totals['peak_equity'] = book_totals['unrealized']
+        book_totals['max_drawdown'] = 0.0
+
+def _book_mark_equity():
+    equity = book_totals['realized'] + book_totals['unrealized']
+    if equity > book_totals['peak_equity']:
+        book_totals['peak_equity'] = equity
+    drawdown = book_totals['peak_equity'] - equity
+    if drawdown > book_totals['max_drawdown']:
+        book_totals['max_drawdown'] = drawdown
+
+def _book_grow():
+    global book_qty, book_avg, book_ltp
+    size = len(book_qty) * 2
+    book_qty = np.resize(book_qty, size)
+    book_avg = np.resize(book_avg, size)
+    book_ltp = np.resize(book_ltp, size)
+    book_qty[len(book_symbols):] = 0
+    book_avg[len(book_symbols):] = 0
+    book_ltp[len(book_symbols):] = 0
+
+def book_open(symbol, instrument_key, action, quantity, entry_price):
+    """Register an opened position in the P&L book"""
+    if not quantity or not entry_price:
+        return
+    margin_set(symbol, margin_required(quantity, entry_price, symbol))
+    symbol = book_id(symbol)
+    with book_lock:
+        _book_roll_day()
+        if symbol in book_slots:
+            _book_release(symbol, entry_price)
+        if None in book_symbols:
+            slot = book_symbols.index(None)
+            book_symbols[slot] = symbol
+        else:
+            slot = len(book_symbols)
+            book_symbols.append(symbol)
+            if slot >= len(book_qty):
+                _book_grow()
+        signed_qty = quantity if action == "BUY" else -quantity
+        book_slots[symbol] = slot
+        book_key_slots.setdefault(instrument_key, []).append(slot)
+        book_qty[slot] = signed_qty
+        book_avg[slot] = entry_price
+        book_ltp[slot] = entry_price
+        book_totals['exposure'] += abs(signed_qty) * entry_price
+
+def _book_release(symbol, exit_price):
+    """Realize and free a slot (caller holds book_lock)"""
+    slot = book_slots.pop(symbol)
+    for key, key_slots in list(book_key_slots.items()):
+        if slot in key_slots:
+            key_slots.remove(slot)
+            if not key_slots:
+                del book_key_slots[key]
+    price = exit_price or book_ltp[slot]
+    q = book_qty[slot]
+    realized = float(q * (price - book_avg[slot]))
+    book_totals['unrealized'] -= q * (book_ltp[slot] - book_avg[slot])
+    book_totals['realized'] += realized
+    book_totals['exposure'] -= abs(q) * book_ltp[slot]
+    book_qty[slot] = book_avg[slot] = book_ltp[slot] = 0
+    book_symbols[slot] = None
+    return realized
+
+def book_close(symbol, exit_price=None):
+    """Realize P&L of a closed position (at exit_price, else LTP) → realized ₹"""
+    margin_set(symbol, 0)
+    symbol = book_id(symbol)
+    with book_lock:
+        if symbol not in book_slots:
+            return 0.0
+        _book_roll_day()
+        realized = _book_release(symbol, exit_price)
+        _book_mark_equity()
+        return realized
+
+def book_reduce(symbol, quantity, exit_price=None):
+    """Realize P&L on a partial exit (e.g. 50% TP) → realized ₹"""
+    ledger_symbol, symbol = symbol, book_id(symbol)
+    with book_lock:
+        slot = book_slots.get(symbol)
+        if slot is None or not quantity:
+            return 0.0
+        _book_roll_day()
+        q = book_qty[slot]
+        closed = min(quantity, abs(q)) * (1 if q > 0 else -1)
+        price = exit_price or book_ltp[slot]
+        book_totals['unrealized'] -= closed * (book_ltp[slot] - book_avg[slot])
+        realized = float(closed * (price - book_avg[slot]))
+        book_totals['realized'] += realized
+        book_totals['exposure'] -= abs(closed) * book_ltp[slot]
+        book_qty[slot] = q - closed
+        _book_mark_equity()
+        margin_set(ledger_symbol, margin_required(abs(q - closed), book_avg[slot], ledger_symbol))
+        return realized
+
+def book_on_tick(instrument_key, ltp):
+    """O(1) incremental MTM update for one price tick"""
+    with book_lock:
+        slots = book_key_slots.get(instrument_key)
+        if not slots or ltp <= 0:
+            return
+        _book_roll_day()
+        for slot in slots:
+            move = ltp - book_ltp[slot]
+            q = book_qty[slot]
+            book_totals['unrealized'] += q * move
+            book_totals['exposure'] += abs(q) * move
+            book_ltp[slot] = ltp
+        _book_mark_equity()
+
+def book_seed_from_positions():
+    """Rebuild the book from restored positions (startup)"""
+    for symbol, pos in list(active_positions.items()):
+        book_open(symbol, pos.instrument_key, pos.action, pos.remaining_qty, pos.entry_price)
+
+def book_snapshot():
+    """Portfolio + per-position MTM for /pnl and /stats"""
+    with book_lock:
+        _book_roll_day()
+        positions = []
+        for bid, slot in book_slots.items():
+            name, _, symbol = bid.rpartition(':')
+            positions.append({
+                'symbol': symbol,
+                'account': name or PRIMARY_ACCOUNT,
+                'qty': int(book_qty[slot]),
+                'avg_price': round(float(book_avg[slot]), 2),
+                'ltp': round(float(book_ltp[slot]), 2),
+                'mtm': round(float(book_qty[slot] * (book_ltp[slot] - book_avg[slot])), 2),
+                'exposure': round(float(abs(book_qty[slot]) * book_ltp[slot]), 2)
+            })
+        return {
+            'unrealized': round(float(book_totals['unrealized']), 2),
+            'realized': round(float(book_totals['realized']), 2),
+            'day_pnl': round(float(book_totals['realized'] + book_totals['unrealized']), 2),
+            'exposure': round(float(book_totals['exposure']), 2),
+            'max_drawdown': round(float(book_totals['max_drawdown']), 2),
+            'positions': positions
+        }
+
+def check_risk_limits(symbol, quantity, price):
+    """O(1) pre-trade check → (ok, reason)"""
+    with book_lock:
+        _book_roll_day()
+        day_pnl = book_totals['realized'] + book_totals['unrealized']
+        if MAX_DAILY_LOSS and day_pnl <= -MAX_DAILY_LOSS:
+            return False, f"Daily loss limit hit (₹{day_pnl:.2f} / -₹{MAX_DAILY_LOSS:.2f})"
+
+        if MAX_EXPOSURE and price:
+            slot = book_slots.get(book_id(symbol))
+            released = abs(book_qty[slot]) * book_ltp[slot] if slot is not None else 0.0  # reversal frees it
+            projected = book_totals['exposure'] - released + quantity * price
+            if projected > MAX_EXPOSURE:
+                return False, f"Exposure limit (₹{projected:.2f} > ₹{MAX_EXPOSURE:.2f})"
+    return True, None
+
+def book_last_price(symbol):
+    """LTP from the book (0 if not held)"""
+    slot = book_slots.get(book_id(symbol))
+    return float(book_ltp[slot]) if slot is not None else 0.0
+
+def fetch_ltp_batch(instrument_keys):
+    """One LTP call for all held instruments → {instrument_key: ltp}"""
+    token = get_token()
+    if not token or not instrument_keys:
+        return {}
+    try:
+        url = "https://api.upstox.com/v2/market-quote/ltp"
+        headers = {'Authorization': f'Bearer {token}', 'Accept': 'application/json'}
+        response = broker_request('GET', url, headers=headers, params={'instrument_key': ','.join(instrument_keys)}, timeout=5)
+        if response.status_code != 200:
+            return {}
+        prices = {}
+        for quote in (response.json().get('data') or {}).values():
+            key = quote.get('instrument_token')
+            if key and quote.get('last_price'):
+                prices[key] = float(quote['last_price'])
+        return prices
+    except Exception as e:
+        logger.error(f"LTP fetch failed: {e}")
+        return {}
+
+def replay_ticks(path):
+    """Yield (instrument_key, ltp) from a csv replay file: instrument_key,ltp"""
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) < 2 or parts[0] == 'instrument_key':
+                continue
+            yield parts[0], safe_float(parts[1])
+
+def market_data_account():
+    """First account with a live token (the shared feed needs only one)"""
+    for account in list(accounts.values()):
+        with account_context(account):
+            if is_token_valid():
+                return account
+    return accounts[PRIMARY_ACCOUNT]
+
+def market_data_feed():
+    """Background thread - pushes ticks into the P&L book"""
+    replay = None
+    while True:
+        try:
+            keys = list(book_key_slots.keys())
+
+            if MARKET_DATA_SOURCE == "UPSTOX":
+                # One shared feed - polled with whichever account is logged in
+                with account_context(market_data_account()):
+                    prices = fetch_ltp_batch(keys)
+                for key, ltp in prices.items():
+                    book_on_tick(key, ltp)
+
+            elif MARKET_DATA_SOURCE == "REPLAY":
+                if replay is None:
+                    replay = replay_ticks(MARKET_DATA_REPLAY_FILE)
+                for _ in range(max(1, len(keys))):
+                    key, ltp = next(replay)
+                    book_on_tick(key, ltp)
+
+            elif MARKET_DATA_SOURCE == "MOCK":
+                for key in keys:
+                    last = float(book_ltp[book_key_slots[key][0]]) if key in book_key_slots else 0
+                    if last:
+                        book_on_tick(key, round(last * (1 + random.gauss(0, 0.0005)), 2))
+
+            time.sleep(MARKET_DATA_INTERVAL)
+        except StopIteration:
+            logger.info("✅ Market data replay finished")
+            return
+        except Exception as e:
+            logger.error(f"❌ Market data error: {e}")
+            time.sleep(MARKET_DATA_INTERVAL)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# FUNDS & MARGIN SIZING
+# ═══════════════════════════════════════════════════════════════════════════════
+# One get-funds-and-margin call per account per FUNDS_REFRESH_INTERVAL. Between
+# snapshots a local ledger tracks the margin the bot's own positions block, so
+# free margin = snapshot - (ledger now - ledger at snapshot) in O(1), and an
+# oversized signal is scaled down or rejected before any order is sent.
+MARGIN_ERROR_WORDS = ("insufficient", "margin", "funds")
+
+def fetch_funds():
+    """Equity segment funds → (available, used), None on failure"""
+    token = get_token()
+    if not token:
+        return None
+    try:
+        url = "https://api.upstox.com/v2/user/get-funds-and-margin"
+        headers = {'Authorization': f'Bearer {token}', 'Accept': 'application/json'}
+        response = broker_request('GET', url, headers=headers, params={'segment': 'SEC'}, timeout=5)
+        if response.status_code != 200:
+            logger.warning(f"⚠️ Funds fetch failed: {response.status_code} {response.text[:200]}")
+            return None
+        equity = (response.json().get('data') or {}).get('equity') or {}
+        return safe_float(equity.get('available_margin')), safe_float(equity.get('used_margin'))
+    except Exception as e:
+        logger.error(f"❌ Funds fetch error: {e}")
+        return None
+
+def refresh_funds():
+    """Take a fresh funds snapshot for the current account → True on success"""
+    snapshot = fetch_funds()
+    if snapshot is None:
+        return False
+    funds = current_account()['funds']
+    with funds['lock']:
+        funds['available'], funds['used'] = snapshot
+        funds['fetched_at'] = time.time()
+        # Unfilled entries may not be blocked at the broker yet - count them as after the snapshot
+        funds['ledger_at_fetch'] = funds['ledger_total'] - sum(funds['ledger'][s] for s in funds['pending'])
+    return True
+
+def is_margin_rejection(result):
+    """Broker refused an order for lack of funds/margin"""
+    for error in (result or {}).get('errors') or []:
+        message = str(error.get('message', '')).lower()
+        if any(word in message for word in MARGIN_ERROR_WORDS):
+            return True
+    return False
+
+def margin_required(quantity, price, symbol=None):
+    """Estimated intraday margin for quantity @ price (option buys pay the full premium)"""
+    return quantity * price / (1 if symbol in option_contracts else MARGIN_LEVERAGE)
+
+def margin_set(symbol, amount, pending=False):
+    """Record the margin the bot's position (or pending entry) in symbol blocks (0 releases it)"""
+    funds = current_account()['funds']
+    with funds['lock']:
+        held = funds['ledger'].pop(symbol, 0.0)
+        funds['pending'].discard(symbol)
+        if amount > 0:
+            funds['ledger'][symbol] = float(amount)
+            if pending:
+                funds['pending'].add(symbol)
+        funds['ledger_total'] += max(float(amount), 0.0) - held
+
+def size_for_margin(symbol, quantity, price):
+    """Fit a signal's qty into free margin → (qty, reason); qty 0 = reject, reason None = untouched"""
+    if MARGIN_SIZING == "OFF" or not price:
+        return quantity, None
+    funds = current_account()['funds']
+    with funds['lock']:
+        if funds['available'] is None:
+            return quantity, None  # no snapshot yet - leave it to the broker
+        released = funds['ledger'].get(symbol, 0.0)  # a reversal frees the open position's margin
+        free = funds['available'] - (funds['ledger_total'] - funds['ledger_at_fetch']) + released
+        free = max(free * (1 - MARGIN_BUFFER_PCT / 100), 0.0)
+        per_unit = margin_required(1, price, symbol)
+        if quantity * per_unit <= free:
+            return quantity, None
+        fitted = int(free // per_unit) if MARGIN_SIZING == "SCALE" else 0
+        funds['scaled' if fitted else 'rejected'] += 1
+        return fitted, f"Margin ₹{quantity * per_unit:.2f} needed, ₹{free:.2f} free"
+
+def funds_monitor():
+    """Background thread - refreshes every account's funds snapshot during market hours"""
+    while True:
+        try:
+            if in_session(time.time()):
+                for account in each_account():
+                    if is_token_valid():
+                        refresh_funds()
+        except Exception as e:
+            logger.error(f"❌ Funds monitor error: {e}")
+        time.sleep(FUNDS_REFRESH_INTERVAL)
+
+def funds_summary():
+    """Current account's snapshot + ledger for /stats"""
+    funds = current_account()['funds']
+    with funds['lock']:
+        available = funds['available']
+        return {
+            'available': round(available, 2) if available is not None else None,
+            'used': round(funds['used'], 2),
+            'bot_margin': round(funds['ledger_total'], 2),
+            'free_now': round(available - (funds['ledger_total'] - funds['ledger_at_fetch']), 2) if available is not None else None,
+            'snapshot_age': round(time.time() - funds['fetched_at'], 1) if funds['fetched_at'] else None,
+            'scaled': funds['scaled'],
+            'rejected': funds['rejected']
+        }
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PRE-MARKET WARM-UP
+# ═══════════════════════════════════════════════════════════════════════════════
+# The first signals at 9:15 should find a hot process: a fresh instrument
+# index, tokens verified (with a login alert while there is still time),
+# a funds snapshot, TLS connections open in every pool and the watchlist
+# resolved. A last touch just before the bell keeps the pools from idling out.
+warmup_state = {'day': None, 'touched': None, 'last': None}
+watchlist_keys = {}  # symbol → instrument key, resolved at warm-up
+
+def warm_connections():
+    """One cheap call per pool (profile per account, Telegram getMe) → accounts needing login"""
+    login_required = []
+    for account in each_account():
+        if account['access_token']:
+            verify_token_with_broker()
+        if not is_token_valid():
+            login_required.append(account['name'])
+    if TELEGRAM_TOKEN:
+        try:
+            telegram_session.get(f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getMe", timeout=5)
+        except Exception as e:
+            logger.warning(f"⚠️ Telegram warm-up failed: {e}")
+    return login_required
+
+def premarket_warmup():
+    """Instruments, tokens, funds, connections, watchlist → summary (also sent to Telegram)"""
+    started = time.time()
+    load_instruments()
+    login_required = warm_connections()
+
+    available = 0.0
+    for account in each_account():
+        if account['name'] in login_required:
+            send_telegram_message(f"🔑 <b>LOGIN REQUIRED BEFORE OPEN</b>\n\nToken missing or rejected.\n\nLogin at: {login_url(UPSTOX_REDIRECT_URI.replace('callback', ''))}")
+        elif refresh_funds():
+            available += account['funds']['available']
+
+    resolved = {symbol: instruments_dict.get(symbol) or instruments_dict.get(f"{symbol}-EQ") for symbol in WATCHLIST}
+    missing = [symbol for symbol, key in resolved.items() if not key]
+    watchlist_keys.clear()
+    watchlist_keys.update({symbol: key for symbol, key in resolved.items() if key})
+    if watchlist_keys and len(login_required) < len(accounts):
+        with account_context(market_data_account()):
+            fetch_ltp_batch(list(watchlist_keys.values())[:LTP_BATCH_SIZE])  # opens the market-quote path too
+
+    summary = {
+        'at': datetime.now(IST).strftime('%Y-%m-%d %H:%M:%S'),
+        'seconds': round(time.time() - started, 2),
+        'instruments': len(instruments_dict),
+        'login_required': login_required,
+        'available_margin': round(available, 2),
+        'watchlist': len(watchlist_keys),
+        'watchlist_missing': missing
+    }
+    warmup_state['last'] = summary
+    logger.info(f"🌅 Pre-market warm-up done in {summary['seconds']}s | Login required: {login_required or 'none'} | "
+                f"Watchlist: {len(watchlist_keys)}/{len(WATCHLIST)}")
+    send_telegram_message(f"""
+🌅 <b>PRE-MARKET WARM-UP</b>
+━━━━━━━━━━━━━━━━━━━━━
+📚 Instruments: {summary['instruments']}
+🔑 Tokens: {'✅ All valid' if not login_required else '❌ Login required: ' + ', '.join(login_required)}
+💰 Available Margin: ₹{available:,.2f}
+👀 Watchlist: {len(watchlist_keys)}/{len(WATCHLIST)} resolved{(' (missing: ' + ', '.join(missing) + ')') if missing else ''}
+⏱️ Took {summary['seconds']}s
+━━━━━━━━━━━━━━━━━━━━━
+""".strip())
+    return summary
+
+def warmup_clock():
+    """PREMARKET_WARMUP_TIME as a time - a malformed value falls back to 09:00 with a warning"""
+    try:
+        hour, minute = (int(part) for part in PREMARKET_WARMUP_TIME.split(':'))
+        return dt_time(hour, minute)
+    except ValueError:
+        logger.warning(f"⚠️ PREMARKET_WARMUP_TIME={PREMARKET_WARMUP_TIME!r} is not HH:MM - warming up at 09:00")
+        return dt_time(9, 0)
+
+def premarket_scheduler():
+    """Background thread - warm-up once per weekday at PREMARKET_WARMUP_TIME, last touch before 9:15"""
+    warm_at = warmup_clock()
+    touch = 9 * 3600 + 15 * 60 - PREMARKET_TOUCH_LEAD
+    touch_at = dt_time(touch // 3600, touch % 3600 // 60, touch % 60)
+    market_open = dt_time(9, 15)
+    while True:
+        try:
+            now = datetime.now(IST)
+            if now.weekday() < 5:
+                if warm_at <= now.time() < market_open and warmup_state['day'] != now.date():
+                    warmup_state['day'] = now.date()
+                    premarket_warmup()
+                if touch_at <= now.time() < market_open and warmup_state['touched'] != now.date():
+                    warmup_state['touched'] = now.date()
+                    warm_connections()
+                    logger.info("🔥 Pooled connections touched before the open")
+        except Exception as e:
+            logger.error(f"❌ Pre-market warm-up error: {e}")
+        time.sleep(WARMUP_CHECK_INTERVAL)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# TRADE LEDGER & ANALYTICS (COLUMNAR)
+# ═══════════════════════════════════════════════════════════════════════════════
+# Closed trades go to ledger/trades_YYYYMMDD.npz, order fills to
+# ledger/executions_YYYYMMDD.npz: numeric columns as typed arrays, text columns
+# dictionary-encoded (int codes + vocabulary). Aggregations are bincount scans
+# over the codes - no per-row Python. The order path only appends a JSON line
+# to the day's .jsonl journal; ledger_compactor folds finished days into .npz.
+LEDGER_NUMERIC = {
+    'opened_at': np.float64, 'closed_at': np.float64, 'qty': np.int32,
+    'entry_price': np.float64, 'pnl': np.float64, 'rr': np.float32,
+    'risk': np.float64, 'confluence': np.float32
+}
+LEDGER_CATEGORICAL = ['symbol', 'action', 'regime', 'killzone', 'reason', 'account', 'position_id']
+LEDGER_GROUPS = ['symbol', 'action', 'regime', 'killzone', 'reason', 'account', 'confluence']
+EXECUTION_NUMERIC = {
+    'received_at': np.float64, 'sent_at': np.float64, 'acked_at': np.float64, 'filled_at': np.float64,
+    'qty': np.int32, 'ref_price': np.float64, 'fill_price': np.float64,
+    'slippage': np.float64, 'slippage_rs': np.float64
+}
+EXECUTION_CATEGORICAL = ['symbol', 'account', 'leg', 'order_type', 'side', 'time_bucket', 'position_id']
+EXECUTION_GROUPS = ['symbol', 'account', 'leg', 'order_type', 'side', 'time_bucket']
+LEDGER_SCHEMAS = {
+    'trades': (LEDGER_NUMERIC, LEDGER_CATEGORICAL),
+    'executions': (EXECUTION_NUMERIC, EXECUTION_CATEGORICAL)
+}
+
+ledger_lock = Lock()
+ledger_cache = {}  # (kind, day) → (file stamps, columns)
+LEDGER_MARK = '__journal_bytes'  # journal size already folded into an .npz (crash between write and unlink)
+
+def ledger_path(day, kind='trades'):
+    return os.path.join(LEDGER_DIR, f"{kind}_{day}.npz")
+
+def ledger_journal_path(day, kind='trades'):
+    return os.path.join(LEDGER_DIR, f"{kind}_{day}.jsonl")
+
+def ledger_day(ts=None):
+    """IST trading day key (YYYYMMDD) of an epoch timestamp (default now)"""
+    return datetime.fromtimestamp(ts or time.time(), IST).strftime('%Y%m%d')
+
+def ledger_encode(rows, kind='trades'):
+    """Row dicts → columnar arrays"""
+    numeric, categorical = LEDGER_SCHEMAS[kind]
+    columns = {}
+    for name, dtype in numeric.items():
+        columns[name] = np.array([r[name] for r in rows], dtype=dtype)
+    for name in categorical:
+        vocab, codes = np.unique(np.array([r.get(name, '') for r in rows], dtype=str), return_inverse=True)
+        columns[name] = codes.astype(np.int32)
+        columns[f"{name}__vocab"] = vocab
+    return columns
+
+def ledger_decode_rows(columns, kind='trades'):
+    """Columnar arrays → row dicts (only used to merge an .npz with journal rows)"""
+    numeric, categorical = LEDGER_SCHEMAS[kind]
+    n = len(columns[next(iter(numeric))])
+    rows = [{} for _ in range(n)]
+    for name in numeric:
+        for i, v in enumerate(columns[name].tolist()):
+            rows[i][name] = v
+    for name in categorical:
+        values = columns[f"{name}__vocab"][columns[name]].tolist()
+        for i, v in enumerate(values):
+            rows[i][name] = v
+    return rows
+
+def ledger_journal_rows(day, kind='trades', columns=None):
+    """Rows of a day's journal not yet folded into its .npz"""
+    journal = ledger_journal_path(day, kind)
+    if not os.path.exists(journal):
+        return []
+    if columns is not None and LEDGER_MARK in columns and int(columns[LEDGER_MARK]) == os.path.getsize(journal):
+        return []
+    rows = []
+    with open(journal, "r") as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue  # torn last line after a crash
+    return rows
+
+def ledger_load_npz(day, kind='trades'):
+    path = ledger_path(day, kind)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        columns = {k: data[k] for k in data.files}
+    numeric, categorical = LEDGER_SCHEMAS[kind]
+    for name in categorical:
+        if name not in columns:  # written before the column existed → all blank
+            columns[name] = np.zeros(len(columns[next(iter(numeric))]), dtype=np.int32)
+            columns[f"{name}__vocab"] = np.array([''])
+    return columns
+
+def ledger_read(day, kind='trades'):
+    """Columns of one day (.npz + unfolded journal rows, cached by file stamps), None if no rows"""
+    stamps = tuple((os.path.getmtime(p), os.path.getsize(p)) if os.path.exists(p) else None
+                   for p in (ledger_path(day, kind), ledger_journal_path(day, kind)))
+    if stamps == (None, None):
+        return None
+    cached = ledger_cache.get((kind, day))
+    if cached and cached[0] == stamps:
+        return cached[1]
+    columns = ledger_load_npz(day, kind)
+    rows = ledger_journal_rows(day, kind, columns)
+    if rows:
+        columns = ledger_encode((ledger_decode_rows(columns, kind) if columns else []) + rows, kind)
+    ledger_cache[(kind, day)] = (stamps, columns)
+    return columns
+
+def ledger_write(kind, row):
+    """Append one row to today's journal of a ledger table - O(1), safe on the order path"""
+    try:
+        line = json.dumps(row, separators=(',', ':'), default=float) + "\n"
+        with ledger_lock:
+            if not os.path.exists(LEDGER_DIR):
+                os.makedirs(LEDGER_DIR)
+            with open(ledger_journal_path(ledger_day(), kind), "a") as f:
+                f.write(line)
+    except Exception as e:
+        logger.error(f"❌ Ledger append failed ({kind}): {e}")
+
+def ledger_compact(day, kind='trades'):
+    """Fold a finished day's journal into its .npz, then drop the journal"""
+    journal = ledger_journal_path(day, kind)
+    if not os.path.exists(journal):
+        return
+    columns = ledger_load_npz(day, kind)
+    rows = ledger_journal_rows(day, kind, columns)
+    if rows:
+        encoded = ledger_encode((ledger_decode_rows(columns, kind) if columns else []) + rows, kind)
+        encoded[LEDGER_MARK] = np.int64(os.path.getsize(journal))
+        tmp_file = ledger_path(day, kind) + ".tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez_compressed(f, **encoded)
+        os.replace(tmp_file, ledger_path(day, kind))
+    os.remove(journal)
+    logger.info(f"🗜️ Ledger compacted: {kind} {day} (+{len(rows)} rows)")
+
+def ledger_compactor():
+    """Background thread - compacts journals of past IST days (at startup, then every interval)"""
+    while True:
+        try:
+            today = ledger_day()
+            if os.path.exists(LEDGER_DIR):
+                for name in sorted(os.listdir(LEDGER_DIR)):
+                    kind, _, rest = name.rpartition('_')
+                    day = rest[:-len(".jsonl")] if rest.endswith(".jsonl") else None
+                    if kind in LEDGER_SCHEMAS and day and day < today:
+                        ledger_compact(day, kind)
+        except Exception as e:
+            logger.error(f"❌ Ledger compaction failed: {e}")
+        time.sleep(LEDGER_COMPACT_INTERVAL)
+
+def ledger_append(symbol, pos, reason, pnl):
+    """Record one completed trade"""
+    signal_meta = pos.signal
+    row = {
+        'opened_at': pos.created_at,
+        'closed_at': time.time(),
+        'qty': pos.filled_qty,
+        'entry_price': pos.entry_price,
+        'pnl': pnl,
+        'rr': signal_meta.get('rr', 0.0),
+        'risk': signal_meta.get('risk', 0.0),
+        'confluence': signal_meta.get('confluence', 0.0),
+        'symbol': symbol,
+        'action': pos.action,
+        'regime': signal_meta.get('regime', 'N/A'),
+        'killzone': signal_meta.get('killzone', 'N/A'),
+        'reason': reason,
+        'account': current_account()['name'],
+        'position_id': pos.position_id or ''
+    }
+    ledger_write('trades', row)
+
+def ledger_position_ids(account_name, days):
+    """position_ids with a fill or a closed trade on an account over the given IST days"""
+    ids = set()
+    for day in days:
+        for kind in LEDGER_SCHEMAS:
+            columns = ledger_read(day, kind)
+            if columns is None:
+                continue
+            mine = columns['account__vocab'][columns['account']] == account_name
+            ids.update(columns['position_id__vocab'][columns['position_id'][mine]].tolist())
+    ids.discard('')
+    return ids
+
+def record_execution(symbol, leg_name, leg, fill_price, filled_qty=None, ref_price=None, received_at=0.0, filled_at=None,
+                     position_id=None):
+    """Record one filled order leg: timestamps + fill vs intended price (slippage > 0 = cost)"""
+    filled_at = filled_at or time.time()
+    qty = int(filled_qty or leg.quantity)
+    ref_price = leg.ref_price if ref_price is None else ref_price
+    slippage = np.nan
+    if ref_price and fill_price:
+        slippage = fill_price - ref_price if leg.transaction_type == "BUY" else ref_price - fill_price
+    filled = datetime.fromtimestamp(filled_at, IST)
+    ledger_write('executions', {
+        'received_at': received_at or 0.0,
+        'sent_at': leg.sent_at,
+        'acked_at': leg.acked_at,
+        'filled_at': filled_at,
+        'qty': qty,
+        'ref_price': ref_price or 0.0,
+        'fill_price': fill_price or 0.0,
+        'slippage': slippage,
+        'slippage_rs': slippage * qty,
+        'symbol': symbol,
+        'account': current_account()['name'],
+        'leg': leg_name,
+        'order_type': leg.order_type,
+        'side': leg.transaction_type,
+        'time_bucket': f"{filled.hour:02d}:{30 if filled.minute >= 30 else 0:02d}",
+        'position_id': position_id or (parse_order_tag(leg.tag) or ('', ''))[1]
+    })
+    if not np.isnan(slippage):
+        latency = f" | signal→fill {(filled_at - received_at) * 1000:.0f}ms" if received_at else ""
+        logger.info(f"📐 {leg_name} {symbol}: ₹{fill_price:.2f} vs ₹{ref_price:.2f} | "
+                    f"Slippage ₹{slippage * qty:.2f}{latency}")
+
+def record_exit_fill(symbol, leg_name, exit_order, result, ref_price=None):
+    """Wait for a placed market exit and record its fill → fill price (None if not confirmed)"""
+    is_filled, filled_qty, fill_price = verify_order_fill(result["order_id"])
+    if not is_filled:
+        return None
+    record_execution(symbol, leg_name, OrderLeg.from_payload(exit_order, result["order_id"], result),
+                     fill_price, filled_qty, ref_price=ref_price)
+    return fill_price
+
+def record_gtt_exit(symbol, pos, leg_name, group, gtt, strategy):
+    """Record the order a fired GTT exit rule placed → fill price (rule trigger if the fill isn't reported)"""
+    ref_price = group.rule_price(strategy)
+    order_id, qty, fill_price = None, group.quantity, 0.0
+    for rule in (gtt or {}).get('rules', []):
+        if (rule.get('strategy') or '').upper() == strategy and rule.get('order_id'):
+            order_id = rule['order_id']
+            row = get_order_details(order_id) or {}
+            if row.get('status') == "complete":
+                qty = int(row.get('filled_quantity') or qty)
+                fill_price = safe_float(row.get('average_price'))
+    leg = OrderLeg(order_id, qty, 0, ref_price, "GTT", pos.exit_action, group.instrument_token)
+    record_execution(symbol, leg_name, leg, fill_price, qty, ref_price=ref_price, position_id=pos.position_id)
+    return fill_price or ref_price
+
+def ledger_load(days, symbol=None, kind='trades'):
+    """Concatenate the last N days into one column set with global vocabularies"""
+    numeric, categorical = LEDGER_SCHEMAS[kind]
+    merged = {name: [] for name in numeric}
+    codes = {name: [] for name in categorical}
+    vocabs = {name: {} for name in categorical}
+
+    now = time.time()
+    for offset in range(days):
+        day = ledger_day(now - offset * 86400)
+        columns = ledger_read(day, kind)
+        if columns is None:
+            continue
+        for name in numeric:
+            merged[name].append(columns[name])
+        for name in categorical:
+            vocab = vocabs[name]
+            remap = np.array([vocab.setdefault(v, len(vocab)) for v in columns[f"{name}__vocab"].tolist()], dtype=np.int32)
+            codes[name].append(remap[columns[name]] if len(remap) else columns[name])
+
+    table = {name: (np.concatenate(parts) if parts else np.array([], dtype=numeric[name]))
+             for name, parts in merged.items()}
+    for name in categorical:
+        table[name] = np.concatenate(codes[name]) if codes[name] else np.array([], dtype=np.int32)
+        table[f"{name}__vocab"] = np.array(list(vocabs[name].keys()), dtype=str)
+
+    if symbol and len(table['symbol']):
+        vocab = list(vocabs['symbol'].keys())
+        mask = table['symbol'] == (vocab.index(symbol) if symbol in vocab else -1)
+        for name in list(numeric) + categorical:
+            table[name] = table[name][mask]
+    return table
+
+def ledger_aggregate(table, group_by):
+    """Vectorised group-by: trades, win rate, P&L, avg RR per group"""
+    pnl = table['pnl']
+    if not len(pnl):
+        return []
+    if group_by in LEDGER_CATEGORICAL:
+        keys, inverse = table[f"{group_by}__vocab"], table[group_by]
+        labels = keys
+    else:
+        labels, inverse = np.unique(table[group_by], return_inverse=True)
+    size = len(labels)
+    count = np.bincount(inverse, minlength=size)
+    wins = np.bincount(inverse, weights=(pnl > 0).astype(np.float64), minlength=size)
+    total = np.bincount(inverse, weights=pnl, minlength=size)
+    rr_sum = np.bincount(inverse, weights=table['rr'].astype(np.float64), minlength=size)
+
+    result = []
+    for i in np.flatnonzero(count):
+        result.append({
+            group_by: labels[i].item() if hasattr(labels[i], 'item') else labels[i],
+            'trades': int(count[i]),
+            'win_rate': round(float(wins[i] / count[i] * 100), 2),
+            'total_pnl': round(float(total[i]), 2),
+            'avg_pnl': round(float(total[i] / count[i]), 2),
+            'avg_rr': round(float(rr_sum[i] / count[i]), 2)
+        })
+    return sorted(result, key=lambda r: r['total_pnl'], reverse=True)
+
+def execution_latencies(table):
+    """Per-fill latencies in ms (NaN where a timestamp is missing)"""
+    def span(start, end):
+        start, end = table[start], table[end]
+        return np.where((start > 0) & (end > 0), (end - start) * 1000, np.nan)
+    return {
+        'signal_to_send': span('received_at', 'sent_at'),
+        'send_to_ack': span('sent_at', 'acked_at'),
+        'ack_to_fill': span('acked_at', 'filled_at'),
+        'signal_to_fill': span('received_at', 'filled_at')
+    }
+
+def latency_percentiles(values):
+    """p50/p90/p99/max of the known values (None if none)"""
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'p50': round(float(p50), 1), 'p90': round(float(p90), 1), 'p99': round(float(p99), 1),
+            'max': round(float(values.max()), 1)}
+
+def execution_report(table, group_by):
+    """Vectorised group-by over fills: slippage (₹, per share, bps) and latency percentiles"""
+    qty = table['qty'].astype(np.float64)
+    if not len(qty):
+        return []
+    labels, inverse = table[f"{group_by}__vocab"], table[group_by]
+    size = len(labels)
+    priced = ~np.isnan(table['slippage'])
+    count = np.bincount(inverse, minlength=size)
+    qty_total = np.bincount(inverse, weights=qty, minlength=size)
+    slip_total = np.bincount(inverse, weights=np.where(priced, table['slippage_rs'], 0.0), minlength=size)
+    priced_qty = np.bincount(inverse, weights=np.where(priced, qty, 0.0), minlength=size)
+    notional = np.bincount(inverse, weights=np.where(priced, table['ref_price'] * qty, 0.0), minlength=size)
+    latencies = execution_latencies(table)
+
+    # Rows of each group as one contiguous slice of a stable sort by group code
+    order = np.argsort(inverse, kind='stable')
+    ends = np.cumsum(count)
+    result = []
+    for i in np.flatnonzero(count):
+        rows = order[ends[i] - count[i]:ends[i]]
+        result.append({
+            group_by: labels[i].item(),
+            'fills': int(count[i]),
+            'qty': int(qty_total[i]),
+            'slippage_rs': round(float(slip_total[i]), 2),
+            'slippage_per_share': round(float(slip_total[i] / priced_qty[i]), 4) if priced_qty[i] else None,
+            'slippage_bps': round(float(slip_total[i] / notional[i] * 10000), 2) if notional[i] else None,
+            'latency_ms': {name: latency_percentiles(values[rows]) for name, values in latencies.items()}
+        })
+    return sorted(result, key=lambda r: r['slippage_rs'], reverse=True)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# INGEST SPOOL (CRASH-SAFE)
+# ═══════════════════════════════════════════════════════════════════════════════
+# Each accepted signal is appended to spool/segment_<first id>.log (JSON lines)
+# and on disk before any order is sent; every account's outcome is appended as
+# a 'done' record. Writers queued behind an fsync share the next one (group
+# commit). Work left pending - crash, restart, account still recovering - is
+# run by spool_worker once the account is ready, or expired past SPOOL_MAX_AGE.
+# Every new segment starts with a checkpoint of the accounts each live signal
+# still owes, so a closed segment is dropped once no live signal record is in it.
+spool_lock = Lock()
+spool_cond = Condition(spool_lock)
+spool_state = {
+    'file': None,         # open segment
+    'segment': None,      # path of the open segment
+    'segment_bytes': 0,
+    'next_id': 1,
+    'written': 0,         # records written (all segments)
+    'synced': 0,          # records known durable
+    'syncing': False,     # a group-commit leader is inside fsync
+    'pending': {},        # spool id → {'ts', 'data', 'position_id', 'accounts', 'claimed', 'segment', 'announced'}
+    'stats': {'appended': 0, 'fsyncs': 0, 'replayed': 0, 'expired': 0}
+}
+
+def _spool_open_segment(first_id):
+    """Close the open segment durably and start a new one (caller holds spool_lock).
+    The new segment opens with a checkpoint of every live signal's outstanding accounts,
+    so closed segments holding only 'done' records can be compacted away."""
+    if spool_state['file']:
+        spool_state['file'].flush()
+        os.fsync(spool_state['file'].fileno())
+        spool_state['file'].close()
+        spool_state['synced'] = spool_state['written']
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    spool_state['segment'] = os.path.join(SPOOL_DIR, f"segment_{first_id:012d}.log")
+    spool_state['file'] = open(spool_state['segment'], "a")
+    spool_state['segment_bytes'] = 0
+    if spool_state['pending']:
+        for spool_id, entry in sorted(spool_state['pending'].items()):
+            line = json.dumps({'op': 'checkpoint', 'id': spool_id, 'accounts': sorted(entry['accounts'])}) + "\n"
+            spool_state['file'].write(line)
+            spool_state['segment_bytes'] += len(line)
+            spool_state['written'] += 1
+        spool_state['file'].flush()
+        os.fsync(spool_state['file'].fileno())  # durable before _spool_compact drops older segments
+        spool_state['synced'] = spool_state['written']
+
+def _spool_compact():
+    """Delete closed segments no pending signal lives in (caller holds spool_lock)"""
+    live = {entry['segment'] for entry in spool_state['pending'].values()}
+    live.add(spool_state['segment'])
+    for name in os.listdir(SPOOL_DIR):
+        path = os.path.join(SPOOL_DIR, name)
+        if name.startswith('segment_') and path not in live:
+            os.remove(path)
+
+def _spool_write(record):
+    """Buffer one record in the open segment → its sequence number (caller holds spool_lock)"""
+    if spool_state['file'] is None:
+        _spool_open_segment(spool_state['next_id'])
+    elif spool_state['segment_bytes'] > SPOOL_SEGMENT_BYTES and not spool_state['syncing']:
+        _spool_open_segment(spool_state['next_id'])
+        _spool_compact()
+    line = json.dumps(record) + "\n"
+    spool_state['file'].write(line)
+    spool_state['segment_bytes'] += len(line)
+    spool_state['written'] += 1
+    return spool_state['written']
+
+def _spool_commit(seq):
+    """Block until record seq is on disk - one fsync covers every writer queued behind it"""
+    with spool_cond:
+        while spool_state['synced'] < seq:
+            if spool_state['syncing']:
+                spool_cond.wait()
+                continue
+            spool_state['syncing'] = True
+            target = spool_state['written']
+            spool_file = spool_state['file']
+            spool_file.flush()
+            spool_cond.release()
+            try:
+                os.fsync(spool_file.fileno())
+            finally:
+                spool_cond.acquire()
+                spool_state['syncing'] = False
+                spool_cond.notify_all()
+            spool_state['synced'] = max(spool_state['synced'], target)
+            spool_state['stats']['fsyncs'] += 1
+
+def spool_append(data, position_id, account_names):
+    """Durably record an accepted signal before execution → spool id"""
+    with spool_lock:
+        spool_id = spool_state['next_id']
+        spool_state['next_id'] += 1
+        record = {'op': 'signal', 'id': spool_id, 'ts': time.time(), 'position_id': position_id,
+                  'accounts': account_names, 'data': data}
+        seq = _spool_write(record)
+        spool_state['pending'][spool_id] = {
+            'ts': record['ts'], 'data': data, 'position_id': position_id,
+            'accounts': set(account_names), 'claimed': set(account_names),
+            'segment': spool_state['segment'], 'announced': False
+        }
+        spool_state['stats']['appended'] += 1
+    _spool_commit(seq)
+    return spool_id
+
+def spool_finish(spool_id, account_name, status):
+    """Record one account's outcome (503 = account not ready → left for spool_worker)"""
+    with spool_lock:
+        entry = spool_state['pending'].get(spool_id)
+        if entry is None:
+            return
+        entry['claimed'].discard(account_name)
+        if status == 503:
+            return
+        seq = _spool_write({'op': 'done', 'id': spool_id, 'account': account_name, 'status': status})
+        entry['announced'] = True
+        entry['accounts'].discard(account_name)
+        if not entry['accounts']:
+            del spool_state['pending'][spool_id]
+    _spool_commit(seq)
+
+def spool_load():
+    """Rebuild pending signals from the segments on disk (startup) - a torn last line is skipped"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    pending = {}
+    last_id = 0
+    for name in sorted(os.listdir(SPOOL_DIR)):
+        if not (name.startswith('segment_') and name.endswith('.log')):
+            continue
+        path = os.path.join(SPOOL_DIR, name)
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                last_id = max(last_id, record.get('id', 0))
+                if record.get('op') == 'signal':
+                    pending[record['id']] = {
+                        'ts': record['ts'], 'data': record['data'], 'position_id': record.get('position_id'),
+                        'accounts': set(record['accounts']), 'claimed': set(),
+                        'segment': path, 'announced': False
+                    }
+                elif record.get('op') == 'done' and record.get('id') in pending:
+                    pending[record['id']]['accounts'].discard(record.get('account'))
+                elif record.get('op') == 'checkpoint' and record.get('id') in pending:
+                    # 'done' records before it may live in segments already compacted away
+                    pending[record['id']]['accounts'] &= set(record['accounts'])
+
+    with spool_lock:
+        spool_state['pending'] = {sid: entry for sid, entry in pending.items() if entry['accounts']}
+        spool_state['next_id'] = last_id + 1
+        _spool_open_segment(spool_state['next_id'])
+        _spool_compact()
+    readiness['spool'] = True
+    if spool_state['pending']:
+        logger.info(f"♻️ Spool: {len(spool_state['pending'])} unfinished signals from last run")
+
+def spool_worker():
+    """Background thread - runs spooled signals on accounts that were not ready, expires stale ones"""
+    while True:
+        try:
+            with spool_lock:
+                work = [(sid, entry, entry['accounts'] - entry['claimed'])
+                        for sid, entry in sorted(spool_state['pending'].items())]
+                for sid, entry, names in work:
+                    entry['claimed'] |= names
+
+            for spool_id, entry, names in work:
+                if not names:
+                    continue
+                age = time.time() - entry['ts']
+                if age > SPOOL_MAX_AGE or not is_market_open():
+                    for name in names:
+                        spool_finish(spool_id, name, 'expired')
+                    with spool_lock:
+                        spool_state['stats']['expired'] += 1
+                    symbol = entry['data'].get('symbol', 'N/A')
+                    logger.warning(f"⌛ Spooled signal expired: #{spool_id} {symbol} ({age:.0f}s old) | Accounts: {sorted(names)}")
+                    send_telegram_message(f"⌛ <b>Signal expired (not executed)</b>\n\nSymbol: {symbol}\nAge: {age:.0f}s\nAccounts: {', '.join(sorted(names))}")
+                    continue
+
+                signal_data = parse_signal(entry['data'])
+                signal_data['received_at'] = entry['ts']
+                data, signal_data, reason = resolve_signal(entry['data'], signal_data)
+                if reason:
+                    for name in names:
+                        spool_finish(spool_id, name, 400)
+                    continue
+                for name in names:
+                    account = accounts.get(name)
+                    if account is None:
+                        spool_finish(spool_id, name, 'unknown_account')
+                        continue
+                    if any(p.position_id == entry['position_id'] for p in account['positions'].values()):
+                        # Executed before the crash - recovery already rebuilt it from the order tags
+                        spool_finish(spool_id, name, 'recovered')
+                        continue
+                    if entry['position_id'] in ledger_position_ids(name, {ledger_day(entry['ts']), ledger_day()}):
+                        # Executed (and possibly already closed) before the crash - never trade it twice
+                        spool_finish(spool_id, name, 'recorded')
+                        continue
+                    result, status = run_in_account(account, execute_signal, data, signal_data,
+                                                    not entry['announced'], entry['position_id'])
+                    if status != 503:
+                        with spool_lock:
+                            spool_state['stats']['replayed'] += 1
+                        logger.info(f"♻️ Spooled signal #{spool_id} executed on {name}: {status}")
+                    spool_finish(spool_id, name, status)
+
+            time.sleep(SPOOL_CHECK_INTERVAL)
+        except Exception as e:
+            logger.error(f"❌ Spool worker error: {e}")
+            time.sleep(SPOOL_CHECK_INTERVAL)
+
+def spool_stats():
+    """Spool counters for /stats"""
+    with spool_lock:
+        return dict(spool_state['stats'], pending=len(spool_state['pending']), segment=spool_state['segment'])
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ICT SIGNAL ENGINE (IN-PROCESS)
+# ═══════════════════════════════════════════════════════════════════════════════
+# Optional replacement for TradingView alerts. Ticks are folded into candles on
+# one shared bar clock and every candle lands in open/high/low/close ring
+# buffers of shape (symbols, SIGNAL_RING_SIZE). Each closed bar is evaluated
+# for all symbols at once - liquidity sweep → displacement (FVG + order block)
+# → retrace into the gap - and scored out of 15 with kill zone and regime.
+# Signals are webhook-shaped payloads executed through route_signal.
+KILLZONES = [
+    ("NSE Open", dt_time(9, 15), dt_time(10, 30)),
+    ("NSE Afternoon", dt_time(13, 30), dt_time(14, 45))
+]
+CONFLUENCE_WEIGHTS = {'fvg': 3, 'sweep': 4, 'order_block': 3, 'killzone': 2, 'regime': 3}  # max 15
+BAR_OPEN, BAR_HIGH, BAR_LOW, BAR_CLOSE = range(4)
+LTP_BATCH_SIZE = 500  # instrument keys per market-quote call
+ENGINE_FIELDS = [
+    'ema_fast', 'ema_slow', 'last_signal_bar',
+    'bull_sweep_price', 'bull_sweep_bar', 'bear_sweep_price', 'bear_sweep_bar',
+    'bull_fvg_top', 'bull_fvg_bottom', 'bull_fvg_bar', 'bear_fvg_top', 'bear_fvg_bottom', 'bear_fvg_bar',
+    'bull_ob_low', 'bull_ob_high', 'bear_ob_low', 'bear_ob_high'
+]
+
+engine_lock = Lock()
+engine_symbols = []     # row → symbol
+engine_key_rows = {}    # instrument_key → row
+engine_bars = np.zeros((4, 0, SIGNAL_RING_SIZE))  # column = bar number % SIGNAL_RING_SIZE
+engine_current = np.full((4, 0), np.nan)           # candle being built from ticks
+engine_features = {}    # field → per-row array, NaN = no live zone / never
+engine_state = {'bar_start': 0, 'bars': 0, 'last_bar': None, 'signals': 0, 'eval_us': 0.0}
+engine_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="engine")
+
+def killzone_name(ts):
+    """Kill zone (IST) a timestamp falls in, None outside all of them"""
+    now = datetime.fromtimestamp(ts, IST).time()
+    for name, start, end in KILLZONES:
+        if start <= now < end:
+            return name
+    return None
+
+def engine_init(symbols):
+    """Allocate ring buffers and feature arrays for a symbol universe"""
+    global engine_bars, engine_current
+    with engine_lock:
+        engine_symbols[:] = list(dict.fromkeys(s.upper() for s in symbols))
+        engine_key_rows.clear()
+        if SIGNAL_ENGINE_SOURCE == "UPSTOX":
+            for row, symbol in enumerate(engine_symbols):
+                key = get_instrument_key(symbol)
+                if key:
+                    engine_key_rows[key] = row
+        n = len(engine_symbols)
+        engine_bars = np.zeros((4, n, SIGNAL_RING_SIZE))
+        engine_current = np.full((4, n), np.nan)
+        for field in ENGINE_FIELDS:
+            engine_features[field] = np.full(n, np.nan)
+        engine_state.update(bar_start=0, bars=0, last_bar=None)
+    logger.info(f"🧠 Signal engine: {n} symbols ({SIGNAL_ENGINE_SOURCE}, {SIGNAL_TIMEFRAME}s candles)")
+
+def engine_on_ticks(rows, prices, ts):
+    """Fold a batch of ticks (row and price arrays) into the current candles → signals of any bar closed"""
+    bar_start = int(ts // SIGNAL_TIMEFRAME * SIGNAL_TIMEFRAME)
+    signals = []
+    with engine_lock:
+        if engine_state['bar_start'] and bar_start > engine_state['bar_start']:
+            signals = _engine_push_bar(engine_current.copy(), engine_state['bar_start'])
+            engine_current.fill(np.nan)
+        engine_state['bar_start'] = bar_start
+        if len(rows):
+            cur = engine_current
+            cur[BAR_OPEN, rows] = np.where(np.isnan(cur[BAR_OPEN, rows]), prices, cur[BAR_OPEN, rows])
+            cur[BAR_HIGH, rows] = np.fmax(cur[BAR_HIGH, rows], prices)
+            cur[BAR_LOW, rows] = np.fmin(cur[BAR_LOW, rows], prices)
+            cur[BAR_CLOSE, rows] = prices
+    return signals
+
+def engine_on_candles(bar_time, candles):
+    """Push one closed candle per symbol {symbol: (open, high, low, close)} → signals"""
+    bar = np.full((4, len(engine_symbols)), np.nan)
+    for row, symbol in enumerate(engine_symbols):
+        if symbol in candles:
+            bar[:, row] = candles[symbol]
+    with engine_lock:
+        return _engine_push_bar(bar, bar_time)
+
+def _engine_push_bar(bar, bar_time):
+    """Append a candle for every symbol (4 x symbols) and evaluate all of them in one vectorised pass"""
+    started = time.perf_counter()
+    f = engine_features
+    size = SIGNAL_RING_SIZE
+    count = engine_state['bars']
+
+    # Symbols without a print this bar get a flat candle at the last close
+    if count:
+        last_close = engine_bars[BAR_CLOSE, :, (count - 1) % size]
+        missing = np.isnan(bar[BAR_CLOSE])
+        bar[:, missing] = last_close[missing]
+
+    engine_bars[:, :, count % size] = bar
+    count += 1
+    engine_state['bars'] = count
+    engine_state['last_bar'] = bar_time
+    o, h, l, c = bar
+
+    # Regime: fast vs slow EMA of closes
+    for field, period in (('ema_fast', SIGNAL_EMA_FAST), ('ema_slow', SIGNAL_EMA_SLOW)):
+        ema = f[field]
+        f[field] = np.where(np.isnan(ema), c, ema + 2 / (period + 1) * (c - ema))
+    if count < 3:
+        return []
+    bullish = f['ema_fast'] > f['ema_slow']
+    bearish = f['ema_fast'] < f['ema_slow']
+
+    # 1. Liquidity sweep - wick through the prior pool's extreme, close back inside
+    cols = (count - 2 - np.arange(min(SIGNAL_SWEEP_LOOKBACK, count - 1))) % size
+    pool_low = engine_bars[BAR_LOW][:, cols].min(axis=1)
+    pool_high = engine_bars[BAR_HIGH][:, cols].max(axis=1)
+    swept_low = (l < pool_low) & (c > pool_low)
+    swept_high = (h > pool_high) & (c < pool_high)
+    f['bull_sweep_price'] = np.where(swept_low, l, f['bull_sweep_price'])
+    f['bull_sweep_bar'] = np.where(swept_low, count, f['bull_sweep_bar'])
+    f['bear_sweep_price'] = np.where(swept_high, h, f['bear_sweep_price'])
+    f['bear_sweep_bar'] = np.where(swept_high, count, f['bear_sweep_bar'])
+
+    # 2. Displacement - 3-candle fair value gap; the opposite candle that started it is the order block
+    first = (count - 3) % size
+    o1, h1, l1, c1 = engine_bars[:, :, first]
+    bull_fvg = l > h1
+    bear_fvg = h < l1
+    f['bull_fvg_top'] = np.where(bull_fvg, l, f['bull_fvg_top'])
+    f['bull_fvg_bottom'] = np.where(bull_fvg, h1, f['bull_fvg_bottom'])
+    f['bull_fvg_bar'] = np.where(bull_fvg, count, f['bull_fvg_bar'])
+    f['bear_fvg_top'] = np.where(bear_fvg, l1, f['bear_fvg_top'])
+    f['bear_fvg_bottom'] = np.where(bear_fvg, h, f['bear_fvg_bottom'])
+    f['bear_fvg_bar'] = np.where(bear_fvg, count, f['bear_fvg_bar'])
+    bull_ob = bull_fvg & (c1 < o1)
+    bear_ob = bear_fvg & (c1 > o1)
+    f['bull_ob_low'] = np.where(bull_ob, l1, f['bull_ob_low'])
+    f['bull_ob_high'] = np.where(bull_ob, h1, f['bull_ob_high'])
+    f['bear_ob_low'] = np.where(bear_ob, l1, f['bear_ob_low'])
+    f['bear_ob_high'] = np.where(bear_ob, h1, f['bear_ob_high'])
+
+    # 3. Invalidation - a close through the sweep extreme / zone kills it, so does age
+    def clear(mask, *fields):
+        for field in fields:
+            f[field] = np.where(mask, np.nan, f[field])
+    clear(c < f['bull_sweep_price'], 'bull_sweep_price', 'bull_sweep_bar')
+    clear(c > f['bear_sweep_price'], 'bear_sweep_price', 'bear_sweep_bar')
+    clear(c < f['bull_fvg_bottom'], 'bull_fvg_top', 'bull_fvg_bottom', 'bull_fvg_bar')
+    clear(c > f['bear_fvg_top'], 'bear_fvg_top', 'bear_fvg_bottom', 'bear_fvg_bar')
+    clear(c < f['bull_ob_low'], 'bull_ob_low', 'bull_ob_high')
+    clear(c > f['bear_ob_high'], 'bear_ob_low', 'bear_ob_high')
+    for side in ('bull', 'bear'):
+        clear(count - f[f'{side}_sweep_bar'] > SIGNAL_SETUP_BARS, f'{side}_sweep_price', f'{side}_sweep_bar')
+        clear(count - f[f'{side}_fvg_bar'] > SIGNAL_SETUP_BARS, f'{side}_fvg_top', f'{side}_fvg_bottom', f'{side}_fvg_bar',
+              f'{side}_ob_low', f'{side}_ob_high')
+
+    # 4. Entry - retrace into a gap left by an earlier candle, scored for confluence
+    killzone = killzone_name(bar_time)
+    w = CONFLUENCE_WEIGHTS
+    ready = ~(count - f['last_signal_bar'] <= SIGNAL_COOLDOWN_BARS)
+    long_tap = (f['bull_fvg_bar'] < count) & (l <= f['bull_fvg_top']) & (c >= f['bull_fvg_bottom'])
+    short_tap = (f['bear_fvg_bar'] < count) & (h >= f['bear_fvg_bottom']) & (c <= f['bear_fvg_top'])
+    kz_score = w['killzone'] if killzone else 0
+    long_score = (w['fvg'] + w['sweep'] * ~np.isnan(f['bull_sweep_price']) + w['order_block'] * ~np.isnan(f['bull_ob_low'])
+                  + w['regime'] * bullish + kz_score)
+    short_score = (w['fvg'] + w['sweep'] * ~np.isnan(f['bear_sweep_price']) + w['order_block'] * ~np.isnan(f['bear_ob_high'])
+                   + w['regime'] * bearish + kz_score)
+
+    # Stop beyond the swept liquidity, else the order block, else the gap
+    long_sl = np.where(np.isnan(f['bull_sweep_price']),
+                       np.fmin(f['bull_ob_low'], f['bull_fvg_bottom']), f['bull_sweep_price'])
+    short_sl = np.where(np.isnan(f['bear_sweep_price']),
+                        np.fmax(f['bear_ob_high'], f['bear_fvg_top']), f['bear_sweep_price'])
+    go_long = ready & long_tap & (long_score >= SIGNAL_MIN_CONFLUENCE) & (c > long_sl)
+    go_short = ready & short_tap & (short_score >= SIGNAL_MIN_CONFLUENCE) & (c < short_sl) & ~go_long
+
+    signals = []
+    for rows, action, score, stop in ((np.flatnonzero(go_long), "BUY", long_score, long_sl),
+                                      (np.flatnonzero(go_short), "SELL", short_score, short_sl)):
+        side = 'bull' if action == "BUY" else 'bear'
+        direction = 1 if action == "BUY" else -1
+        for row in rows:
+            price = float(c[row])
+            risk = abs(price - float(stop[row]))
+            regime = 'BULLISH' if bullish[row] else ('BEARISH' if bearish[row] else 'RANGING')
+            signals.append({
+                'action': action,
+                'symbol': engine_symbols[row],
+                'qty': SIGNAL_QTY,
+                'price': round(price, 2),
+                'sl': round(float(stop[row]), 2),
+                'tp': round(price + direction * SIGNAL_RR * risk, 2),
+                'partial_tp': round(price + direction * risk, 2),
+                'risk': round(risk * SIGNAL_QTY, 2),
+                'rr': SIGNAL_RR,
+                'confluence': int(score[row]),
+                'regime': regime,
+                'killzone': killzone or 'N/A',
+                'source': 'engine',
+                'bar_time': bar_time
+            })
+        # The gap is spent once traded
+        for field in (f'{side}_fvg_top', f'{side}_fvg_bottom', f'{side}_fvg_bar'):
+            f[field][rows] = np.nan
+        f['last_signal_bar'][rows] = count
+
+    engine_state['eval_us'] = round((time.perf_counter() - started) * 1e6, 1)
+    return signals
+
+def engine_dispatch(signals):
+    """Stream engine signals and hand them to the webhook execution path"""
+    for payload in signals:
+        engine_state['signals'] += 1
+        logger.info(f"🧠 Engine signal: {payload['action']} {payload['symbol']} @ ₹{payload['price']:.2f} | "
+                    f"SL ₹{payload['sl']:.2f} | TP ₹{payload['tp']:.2f} | "
+                    f"Confluence {payload['confluence']}/15 | {payload['killzone']}")
+        publish_event('engine_signal', payload['symbol'], signal=payload)
+        if not SIGNAL_DRY_RUN:
+            engine_pool.submit(engine_execute, payload)
+
+def engine_execute(payload):
+    """Run one engine signal through admission control + route_signal (same path as /webhook)"""
     try:
-        url = f"https://api.upstox.com/v2/order/cancel?order_id={order_id}"
-        headers = {'Authorization': f'Bearer {get_token()}'}
-        response = requests.delete(url, headers=headers, timeout=10)
-        if response.status_code == 200:
-            logger.info(f"✅ Cancelled order: {order_id}")
-            return True
-        return False
+        received_at = time.time()
+        priority = is_priority_signal(payload)
+        shed = admit_signal(priority)
+        if shed:
+            result, status, _ = shed
+            logger.warning(f"🚦 Engine signal shed ({status}): {payload['action']} {payload['symbol']} | {result['error']}")
+            return
+        try:
+            result, status = route_signal(payload, received_at)
+        finally:
+            release_signal(priority, time.time() - received_at)
+        logger.info(f"🧠 Engine signal {payload['action']} {payload['symbol']} → {status}")
     except Exception as e:
-        logger.error(f"❌ Cancel failed {order_id}: {e}")
-        return False
+        logger.error(f"❌ Engine signal error: {e}")
+        send_telegram_message(f"❌ <b>SIGNAL ENGINE ERROR</b>\n\n{payload['symbol']}: {str(e)}")
 
-def emergency_exit_position(symbol, quantity, action):
-    """Emergency market exit for unprotected positions"""
-    logger.critical(f"🚨 EMERGENCY EXIT: {symbol} | Qty: {quantity}")
-    
-    instrument_key = get_instrument_key(symbol)
-    if not instrument_key:
-        logger.error(f"❌ Emergency exit failed: Symbol not found")
-        return False
-    
-    exit_action = "SELL" if action == "BUY" else "BUY"
-    exit_order = {
-        "quantity": quantity,
-        "product": "I",
-        "validity": "DAY",
-        "price": 0,
-        "instrument_token": instrument_key,
-        "order_type": "MARKET",
-        "transaction_type": exit_action,
-        "disclosed_quantity": 0,
-        "trigger_price": 0,
-        "is_amo": False
+def replay_candles(path):
+    """Candle csv (timestamp,symbol,open,high,low,close; sorted by time) → [(bar_time, {symbol: ohlc})]"""
+    bars = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) < 6 or parts[0] == 'timestamp':
+                continue
+            try:
+                ts = float(parts[0])
+                ts = int(ts / 1000 if ts > 10**11 else ts)
+            except ValueError:
+                stamp = datetime.fromisoformat(parts[0])
+                ts = int((IST.localize(stamp) if stamp.tzinfo is None else stamp).timestamp())
+            if not bars or bars[-1][0] != ts:
+                bars.append((ts, {}))
+            symbol = parts[1].replace("-EQ", "").replace("NSE:", "").strip().upper()
+            bars[-1][1][symbol] = tuple(safe_float(v) for v in parts[2:6])
+    return bars
+
+def signal_engine():
+    """Background thread - feeds candles/ticks to the engine and dispatches its signals"""
+    if SIGNAL_ENGINE_SOURCE == "REPLAY":
+        try:
+            bars = replay_candles(SIGNAL_REPLAY_FILE)
+            engine_init(SIGNAL_WATCHLIST or sorted({s for _, candles in bars for s in candles}))
+            for bar_time, candles in bars:
+                engine_dispatch(engine_on_candles(bar_time, candles))
+            logger.info(f"✅ Signal engine replay finished: {len(bars)} bars, {engine_state['signals']} signals")
+        except Exception as e:
+            logger.error(f"❌ Signal engine replay failed: {e}")
+        return
+
+    engine_init(SIGNAL_WATCHLIST)
+    if SIGNAL_ENGINE_SOURCE == "UPSTOX" and len(engine_key_rows) < len(engine_symbols):
+        logger.warning(f"⚠️ Signal engine: {len(engine_symbols) - len(engine_key_rows)} watchlist symbols not found")
+    mock_prices = np.full(len(engine_symbols), 100.0)
+    while True:
+        try:
+            now = time.time()
+            if SIGNAL_ENGINE_SOURCE == "UPSTOX":
+                if not in_session(now):
+                    time.sleep(SIGNAL_POLL_INTERVAL * 30)
+                    continue
+                keys = list(engine_key_rows)
+                prices = {}
+                with account_context(market_data_account()):
+                    for i in range(0, len(keys), LTP_BATCH_SIZE):
+                        prices.update(fetch_ltp_batch(keys[i:i + LTP_BATCH_SIZE]))
+                rows = np.array([engine_key_rows[k] for k in prices], dtype=np.int64)
+                ticks = np.array(list(prices.values()), dtype=np.float64)
+
+            elif SIGNAL_ENGINE_SOURCE == "MOCK":
+                mock_prices = np.round(mock_prices * (1 + np.random.normal(0, 0.001, len(mock_prices))), 2)
+                rows, ticks = np.arange(len(mock_prices)), mock_prices
+
+            engine_dispatch(engine_on_ticks(rows, ticks, now))
+            time.sleep(SIGNAL_POLL_INTERVAL)
+        except Exception as e:
+            logger.error(f"❌ Signal engine error: {e}")
+            time.sleep(SIGNAL_POLL_INTERVAL)
+
+def engine_stats():
+    """Signal engine counters for /stats"""
+    last_bar = engine_state['last_bar']
+    return {
+        'source': SIGNAL_ENGINE_SOURCE,
+        'dry_run': SIGNAL_DRY_RUN,
+        'symbols': len(engine_symbols),
+        'bars': engine_state['bars'],
+        'signals': engine_state['signals'],
+        'last_bar': datetime.fromtimestamp(last_bar, IST).strftime('%Y-%m-%d %H:%M') if last_bar else None,
+        'eval_us': engine_state['eval_us']
     }
-    
-    result = place_order(exit_order, "EMERGENCY EXIT")
-    
-    if result["success"]:
-        send_telegram_message(f"🚨 <b>EMERGENCY EXIT EXECUTED</b>\n\nSymbol: {symbol}\nQuantity: {quantity}\nReason: SL placement failed")
-        return True
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ADMISSION CONTROL (/webhook load shedding)
+# ═══════════════════════════════════════════════════════════════════════════════
+admission = {
+    'cond': Condition(),
+    'inflight': 0,           # entry signals executing
+    'queued': 0,             # entry signals waiting for a slot
+    'priority_inflight': 0,  # exits / reversals - never queued or shed
+    'admitted': 0,
+    'priority': 0,
+    'shed_queue_full': 0,    # → 429
+    'shed_timeout': 0,       # → 503
+    'avg_seconds': 1.0       # EWMA of one signal's execution time (sizes Retry-After)
+}
+
+def is_priority_signal(data):
+    """Exit / reversal: a signal on a symbol (or routed underlying) some account holds"""
+    symbol = parse_signal(data)['symbol']
+    for account in list(accounts.values()):
+        positions = account['positions']
+        if symbol in positions or any(p.signal.get('underlying') == symbol for p in list(positions.values())):
+            return True
     return False
 
+def retry_after_seconds():
+    """Estimated wait for a slot to free up (caller holds the lock)"""
+    backlog = admission['queued'] + 1
+    return max(1, int(round(admission['avg_seconds'] * backlog / max(WEBHOOK_MAX_INFLIGHT, 1))))
+
+def admit_signal(priority):
+    """Take an execution slot → None, or (response, status, retry_after) to shed the signal with"""
+    cond = admission['cond']
+    with cond:
+        if priority:
+            admission['priority_inflight'] += 1
+            admission['priority'] += 1
+            return None
+
+        if admission['inflight'] >= WEBHOOK_MAX_INFLIGHT or admission['queued']:
+            if admission['queued'] >= WEBHOOK_MAX_QUEUE:
+                admission['shed_queue_full'] += 1
+                return {'error': 'Overloaded - signal queue full'}, 429, retry_after_seconds()
+            admission['queued'] += 1
+            deadline = time.monotonic() + WEBHOOK_QUEUE_TIMEOUT
+            while admission['inflight'] >= WEBHOOK_MAX_INFLIGHT:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                cond.wait(remaining)
+            admission['queued'] -= 1
+            if admission['inflight'] >= WEBHOOK_MAX_INFLIGHT:
+                admission['shed_timeout'] += 1
+                return {'error': 'Overloaded - no execution slot'}, 503, retry_after_seconds()
+
+        admission['inflight'] += 1
+        admission['admitted'] += 1
+        return None
+
+def release_signal(priority, seconds):
+    """Return the slot taken by admit_signal"""
+    cond = admission['cond']
+    with cond:
+        if priority:
+            admission['priority_inflight'] -= 1
+            return
+        admission['inflight'] -= 1
+        admission['avg_seconds'] += 0.2 * (seconds - admission['avg_seconds'])
+        cond.notify()
+
+def admission_stats():
+    """Queue depth + shed counters for /stats"""
+    with admission['cond']:
+        return {key: (round(value, 3) if isinstance(value, float) else value)
+                for key, value in admission.items() if key != 'cond'}
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # WEBHOOK HANDLER - PRODUCTION GRADE
 # ═══════════════════════════════════════════════════════════════════════════════
-@app.route('/webhook', methods=['POST'])
+@bp.route('/webhook', methods=['POST'])
 def webhook():
-    global active_positions
-    
+    """TradingView alert → route_signal"""
+    received_at = time.time()
     try:
         # ✅ 1. Parse webhook data
         data = request.get_json(force=True)
         if not data:
             return jsonify({'error': 'No data'}), 400
 
-        action = data.get('action', '').upper()
-        symbol_raw = data.get('symbol', '')
-        symbol = symbol_raw.replace("-EQ", "").replace("NSE:", "").strip().upper()
-        qty_requested = max(1, int(round(safe_float(data.get('qty', 1)))))
-        sl_price = safe_float(data.get('sl'))
-        tp_price = safe_float(data.get('tp'))
-        partial_tp_price = safe_float(data.get('partial_tp'))
+        # ✅ 1b. Admission control - exits / reversals bypass the entry budget
+        priority = is_priority_signal(data)
+        shed = admit_signal(priority)
+        if shed:
+            result, status, retry_after = shed
+            logger.warning(f"🚦 Signal shed ({status}): {data.get('action')} {data.get('symbol')} | {result['error']}")
+            return jsonify(result), status, {'Retry-After': str(retry_after)}
+
+        try:
+            result, status = route_signal(data, received_at)
+        finally:
+            release_signal(priority, time.time() - received_at)
+        return jsonify(result), status
+
+    except Exception as e:
+        logger.error(f"❌ Webhook error: {str(e)}")
+        send_telegram_message(f"❌ <b>WEBHOOK ERROR</b>\n\n{str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def route_signal(data, received_at=None):
+    """Validate a signal once, then execute it on every account in parallel → (response dict, status)"""
+    signal_data = parse_signal(data)
+    signal_data['received_at'] = received_at or time.time()
+    action = signal_data['action']
+    symbol = signal_data['symbol']
+
+    # ✅ 2. Validate action
+    if action not in ["BUY", "SELL"]:
+        return {'error': 'Invalid action'}, 400
+
+    # ✅ 3. Market hours check
+    if not is_market_open():
+        logger.warning(f"⚠️ Order rejected: Market closed")
+        send_telegram_message(f"⚠️ <b>Order Rejected</b>\n\nMarket is closed. Signal: {action} {symbol}")
+        return {'error': 'Market closed'}, 400
+
+    # ✅ 4. Spool the raw payload first - a crash, restart or slow contract lookup from here on cannot lose the signal
+    targets = list(accounts.values())
+    position_id = new_position_id()
+    spool_id = spool_append(data, position_id, [a['name'] for a in targets])
+
+    # ✅ 4b. Option routing - the underlying's signal trades a CE/PE contract instead
+    data, signal_data, reason = resolve_signal(data, signal_data)
+    if reason:
+        for account in targets:
+            spool_finish(spool_id, account['name'], 400)
+        return {'error': reason, 'spool_id': spool_id}, 400
+    action = signal_data['action']
+    symbol = signal_data['symbol']
+
+    # ✅ 5. Fan out - one worker per account, total latency ≈ the slowest account
+    if len(targets) == 1:
+        result, status = run_in_account(targets[0], execute_signal, data, signal_data, True, position_id)
+        spool_finish(spool_id, targets[0]['name'], status)
+        if status == 503:
+            # Account still recovering - spool_worker executes it once ready (or expires it)
+            return {'status': 'queued', 'spool_id': spool_id, 'reason': result['error']}, 202
+        return result, status
+
+    announcer = next((a['name'] for a in targets if a['recovery_ready'].is_set()), None)
+    futures = {account['name']: fanout_pool.submit(run_in_account, account, execute_signal, data, signal_data,
+                                                   account['name'] == announcer, position_id)
+               for account in targets}
+    results = {name: future.result() for name, future in futures.items()}
+    for name, (result, status) in results.items():
+        spool_finish(spool_id, name, status)
+        if status == 503:
+            results[name] = ({'status': 'queued', 'reason': result['error']}, 202)
+    statuses = {status for _, status in results.values()}
+    succeeded = [name for name, (_, status) in results.items() if status == 200]
+    status = 200 if succeeded else (statuses.pop() if len(statuses) == 1 else 500)
+    logger.info(f"✅ Signal fan-out: {action} {symbol} | OK: {succeeded} / {len(targets)} accounts")
+    return {
+        "status": "success" if len(succeeded) == len(targets) else ("partial" if succeeded else "error"),
+        "symbol": symbol,
+        "action": action,
+        "spool_id": spool_id,
+        "accounts": {name: result for name, (result, _) in results.items()}
+    }, status
 
-        # ✅ 2. Validate action
-        if action not in ["BUY", "SELL"]:
-            return jsonify({'error': 'Invalid action'}), 400
+fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
 
-        # ✅ 3. Market hours check
-        if not is_market_open():
-            logger.warning(f"⚠️ Order rejected: Market closed")
-            send_telegram_message(f"⚠️ <b>Order Rejected</b>\n\nMarket is closed. Signal: {action} {symbol}")
-            return jsonify({'error': 'Market closed'}), 400
+def execute_signal(data, signal_data, announce=True, position_id=None):
+    """Execute a validated signal on the current account → (response dict, status)"""
+    try:
+        # ✅ 0. Startup recovery must re-protect restored positions first
+        if not current_account()['recovery_ready'].is_set():
+            reason = 'Recovering position state' if get_token() else 'Recovery pending - login required'
+            return {'error': reason}, 503
+
+        position_id = position_id or new_position_id()
+        action = signal_data['action']
+        symbol = signal_data['symbol']
+        qty_requested = max(1, int(round(signal_data['qty'] * current_account()['qty_multiplier'])))
+        sl_price = signal_data['sl']
+        tp_price = signal_data['tp']
+        partial_tp_price = signal_data['partial_tp']
 
         # ✅ 4. Get instrument key
         instrument_key = get_instrument_key(symbol)
         if not instrument_key:
-            return jsonify({'error': f'Symbol {symbol} not found in NSE_EQ'}), 400
+            return {'error': f'Symbol {symbol} not found in NSE_EQ / NSE_FO'}, 400
 
         opposite_action = "SELL" if action == "BUY" else "BUY"
+        signal_price = signal_data['price'] or book_last_price(symbol)
+
+        # ✅ 4b. Margin sizing (cached funds snapshot + local ledger) - scale down or reject locally
+        sized_qty, margin_reason = size_for_margin(symbol, qty_requested, signal_price)
+        if not sized_qty:
+            logger.warning(f"⚠️ Order rejected: insufficient margin: {symbol} | {margin_reason}")
+            send_telegram_message(f"⚠️ <b>Insufficient Margin</b>\n\nSignal: {action} {symbol}\n{margin_reason}")
+            return {'error': f'Insufficient margin - {margin_reason}'}, 400
+        if sized_qty < qty_requested:
+            logger.warning(f"⚠️ Qty scaled to margin: {symbol} {qty_requested} → {sized_qty} | {margin_reason}")
+            send_telegram_message(f"⚠️ <b>Qty Scaled Down</b>\n\nSignal: {action} {symbol}\nQty: {qty_requested} → {sized_qty}\n{margin_reason}")
+            qty_requested = sized_qty
+
+        # ✅ 4c. Risk limits (O(1) against live P&L book) - before any order is sent
+        risk_ok, risk_reason = check_risk_limits(symbol, qty_requested, signal_price)
+        if not risk_ok:
+            logger.warning(f"⚠️ Order rejected by risk check: {symbol} | {risk_reason}")
+            send_telegram_message(f"⚠️ <b>Risk Limit</b>\n\nSignal: {action} {symbol}\n{risk_reason}")
+            return {'error': risk_reason}, 400
 
-        # ✅ 5. Handle reversal (square off existing position)
-        if symbol in active_positions:
-            logger.info(f"🔁 REVERSAL: Squaring off {symbol}")
-            pos = active_positions[symbol]
+        # ✅ 5. Handle reversal (square off existing position - and other contracts on a routed underlying)
+        underlying = data.get('underlying')
+        held = [held_symbol for held_symbol, held_pos in active_positions.items()
+                if held_symbol == symbol or (underlying and held_pos.signal.get('underlying') == underlying)]
+        for held_symbol in held:
+            logger.info(f"🔁 REVERSAL: Squaring off {held_symbol}")
+            pos = active_positions[held_symbol]
             
             # Cancel all pending orders
-            for oid in [pos.get('sl_order_id'), pos.get('tp_order_id'), pos.get('partial_order_id')]:
-                if oid:
-                    cancel_order(oid)
+            cancel_position_orders(pos)
             
             # Market exit
             exit_order = {
-                "quantity": pos['filled_qty'],
+                "quantity": pos.remaining_qty,
                 "product": "I",
                 "validity": "DAY",
                 "price": 0,
-                "instrument_token": instrument_key,
+                "instrument_token": pos.instrument_key,
                 "order_type": "MARKET",
-                "transaction_type": opposite_action,
+                "transaction_type": pos.exit_action,
                 "disclosed_quantity": 0,
                 "trigger_price": 0,
-                "is_amo": False
+                "is_amo": False,
+                "tag": order_tag("X", pos.position_id)
             }
-            place_order(exit_order, "REVERSAL EXIT")
-            del active_positions[symbol]
+            ref_price = book_last_price(held_symbol)
+            exit_res = place_order(exit_order, "REVERSAL EXIT")
+            if not exit_res["success"]:
+                # Legs are already cancelled - never stack the new entry on an unprotected, still-open position
+                logger.critical(f"🚨 Reversal exit failed: {held_symbol} | {pos.remaining_qty} held without protection")
+                send_telegram_message(f"🚨 <b>REVERSAL EXIT FAILED</b>\n\nSymbol: {held_symbol}\nQty: {pos.remaining_qty}\nProtective orders cancelled - exit manually!\nSignal: {action} {symbol} not executed")
+                return {'error': f'Reversal exit failed for {held_symbol}'}, 500
+            exit_price = record_exit_fill(held_symbol, "REVERSAL", exit_order, exit_res, ref_price)
+            close_position_state(held_symbol, "REVERSAL", exit_price)
+
+        # ✅ 6. Send entry alert to Telegram (once per signal, not per account)
+        if announce:
+            if action == "BUY":
+                message = format_buy_alert(data)
+            else:
+                message = format_sell_alert(data)
+            send_telegram_message(message)
+
+        # Hold the margin now so concurrent signals see it; book_open replaces it with the filled amount
+        margin_set(symbol, margin_required(qty_requested, signal_price, symbol), pending=True)
+
+        # ✅ 6b. Broker-native bracket: entry + OCO exits as GTT groups
+        if BRACKET_MODE == "GTT":
+            position = open_gtt_bracket(symbol, instrument_key, action, qty_requested, tp_price, sl_price,
+                                        partial_tp_price, signal_price, position_id, signal_data.get('received_at', 0.0))
+            if not position:
+                margin_set(symbol, 0)
+                send_telegram_message(f"❌ <b>GTT BRACKET FAILED</b>\n\nSymbol: {symbol}\nAction: {action}")
+                return {'error': 'GTT bracket failed'}, 500
+
+            position.signal = signal_metadata(data)
+            active_positions[symbol] = position
             save_positions()
+            book_open(symbol, instrument_key, action, position.filled_qty, position.entry_price or signal_price)
+            publish_event('position_opened', symbol, position=position_summary(symbol, position))
+            logger.info(f"✅ GTT position opened: {symbol} | Qty: {position.filled_qty}")
+            send_telegram_message(f"✅ <b>POSITION OPENED (GTT)</b>\n\nSymbol: {symbol}\nAction: {action}\nQty: {position.filled_qty}\nBroker-side OCO: ✅")
 
-        # ✅ 6. Send entry alert to Telegram
-        if action == "BUY":
-            message = format_buy_alert(data)
-        else:
-            message = format_sell_alert(data)
-        send_telegram_message(message)
+            return {
+                "status": "success",
+                "symbol": symbol,
+                "action": action,
+                "bracket_mode": "GTT",
+                "filled_qty": position.filled_qty,
+                "gtt_orders": {
+                    "main": position.leg_id('entry'),
+                    "partial_tp": position.leg_id('partial')
+                }
+            }, 200
 
         # ✅ 7. Place ENTRY order
         entry_order_data = {
@@ -580,44 +3483,45 @@ def webhook():
             "transaction_type": action,
             "disclosed_quantity": 0,
             "trigger_price": 0,
-            "is_amo": False
+            "is_amo": False,
+            "tag": order_tag("E", position_id)
         }
         
         entry_res = place_order(entry_order_data, "ENTRY ORDER")
         if not entry_res["success"]:
+            margin_set(symbol, 0)
             send_telegram_message(f"❌ <b>ENTRY FAILED</b>\n\nSymbol: {symbol}\nAction: {action}")
-            return jsonify({'error': 'Entry order failed'}), 500
+            return {'error': 'Entry order failed'}, 500
 
         # ✅ 8. Verify entry fill
-        is_filled, filled_qty = verify_order_fill(entry_res["order_id"])
+        is_filled, filled_qty, fill_price = verify_order_fill(entry_res["order_id"])
+        filled_at = time.time()
         if not is_filled or filled_qty == 0:
             logger.error(f"❌ Entry not filled: {symbol}")
+            margin_set(symbol, 0)
             send_telegram_message(f"❌ <b>ENTRY NOT FILLED</b>\n\nSymbol: {symbol}\nOrder ID: {entry_res['order_id']}")
-            return jsonify({'error': 'Entry not filled'}), 500
+            return {'error': 'Entry not filled'}, 500
 
-        logger.info(f"✅ Entry filled: {symbol} | Qty: {filled_qty}")
+        entry_price = fill_price or signal_price
+        logger.info(f"✅ Entry filled: {symbol} | Qty: {filled_qty} @ ₹{entry_price:.2f}")
 
         # ✅ 9. Initialize position state
-        position_state = {
-            "symbol": symbol,
-            "action": action,
-            "qty_requested": qty_requested,
-            "filled_qty": filled_qty,
-            "entry_order_id": entry_res["order_id"],
-            "entry_order_data": entry_order_data,
-            "sl_order_id": None,
-            "tp_order_id": None,
-            "partial_order_id": None,
-            "sl_order_data": None,
-            "tp_order_data": None,
-            "partial_order_data": None,
-            "partial_filled": False,
-            "created_at": time.time()
-        }
+        position = Position(
+            symbol, action,
+            position_id=position_id,
+            qty_requested=qty_requested,
+            filled_qty=filled_qty,
+            entry_price=entry_price,
+            entry=OrderLeg.from_payload(entry_order_data, entry_res["order_id"], entry_res),
+            trail_points=safe_float(data.get('trail')),
+            signal=signal_metadata(data)
+        )
+        record_execution(symbol, "ENTRY", position.entry, fill_price, filled_qty, ref_price=signal_price,
+                         received_at=signal_data.get('received_at', 0.0), filled_at=filled_at)
 
         # ✅ 10. Place PARTIAL TP (50% at RR 1:2)
-        if partial_tp_price and filled_qty >= 2:
-            partial_qty = filled_qty // 2
+        partial_qty = partial_quantity(filled_qty, partial_tp_price, lot_size=lot_size(symbol))
+        if partial_qty:
             partial_order_data = {
                 "quantity": partial_qty,
                 "product": "I",
@@ -628,16 +3532,16 @@ def webhook():
                 "transaction_type": opposite_action,
                 "disclosed_quantity": 0,
                 "trigger_price": 0,
-                "is_amo": False
+                "is_amo": False,
+                "tag": order_tag("P", position_id)
             }
             partial_res = place_order(partial_order_data, "PARTIAL TP (50%)")
             if partial_res["success"]:
-                position_state["partial_order_id"] = partial_res["order_id"]
-                position_state["partial_order_data"] = partial_order_data
+                position.partial = OrderLeg.from_payload(partial_order_data, partial_res["order_id"], partial_res)
 
         # ✅ 11. Place FULL TP (remaining qty)
         if tp_price:
-            remaining_qty = filled_qty - (filled_qty // 2 if partial_tp_price and filled_qty >= 2 else 0)
+            remaining_qty = filled_qty - partial_qty
             if remaining_qty > 0:
                 tp_order_data = {
                     "quantity": remaining_qty,
@@ -649,12 +3553,12 @@ def webhook():
                     "transaction_type": opposite_action,
                     "disclosed_quantity": 0,
                     "trigger_price": 0,
-                    "is_amo": False
+                    "is_amo": False,
+                    "tag": order_tag("T", position_id)
                 }
                 tp_res = place_order(tp_order_data, "FULL TP")
                 if tp_res["success"]:
-                    position_state["tp_order_id"] = tp_res["order_id"]
-                    position_state["tp_order_data"] = tp_order_data
+                    position.tp = OrderLeg.from_payload(tp_order_data, tp_res["order_id"], tp_res)
 
         # ✅ 12. Place STOP LOSS (CRITICAL - Full qty initially)
         if sl_price:
@@ -668,23 +3572,26 @@ def webhook():
                 "transaction_type": opposite_action,
                 "disclosed_quantity": 0,
                 "trigger_price": round(sl_price, 2),
-                "is_amo": False
+                "is_amo": False,
+                "tag": order_tag("S", position_id)
             }
             sl_res = place_order(sl_order_data, "STOP LOSS")
             
             if sl_res["success"]:
-                position_state["sl_order_id"] = sl_res["order_id"]
-                position_state["sl_order_data"] = sl_order_data
+                position.sl = OrderLeg.from_payload(sl_order_data, sl_res["order_id"], sl_res)
             else:
                 # 🚨 CRITICAL: SL placement failed - Emergency exit
                 logger.critical(f"🚨 SL PLACEMENT FAILED: {symbol}")
-                emergency_exit_position(symbol, filled_qty, action)
+                emergency_exit_position(symbol, filled_qty, action, position_id, instrument_key)
+                margin_set(symbol, 0)
                 send_telegram_message(f"🚨 <b>CRITICAL ERROR</b>\n\nSL placement failed for {symbol}\nEmergency market exit executed!")
-                return jsonify({'error': 'SL placement failed - emergency exit'}), 500
+                return {'error': 'SL placement failed - emergency exit'}, 500
 
         # ✅ 13. Save position
-        active_positions[symbol] = position_state
+        active_positions[symbol] = position
         save_positions()
+        book_open(symbol, instrument_key, action, filled_qty, entry_price)
+        publish_event('position_opened', symbol, position=position_summary(symbol, position))
         
         logger.info(f"✅ Position opened: {symbol} | Filled: {filled_qty}/{qty_requested}")
         
@@ -695,81 +3602,115 @@ def webhook():
 📊 Symbol: {symbol}
 🎯 Action: {action}
 📈 Filled Qty: {filled_qty}
-🔻 SL Order: {'✅ Placed' if position_state['sl_order_id'] else '❌ Failed'}
-🔺 TP Order: {'✅ Placed' if position_state['tp_order_id'] else '⚠️ Not Placed'}
-🎯 Partial TP: {'✅ Placed' if position_state['partial_order_id'] else '⚠️ Not Placed'}
+🔻 SL Order: {'✅ Placed' if position.leg_id('sl') else '❌ Failed'}
+🔺 TP Order: {'✅ Placed' if position.leg_id('tp') else '⚠️ Not Placed'}
+🎯 Partial TP: {'✅ Placed' if position.leg_id('partial') else '⚠️ Not Placed'}
 
 ⏰ {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}
 ━━━━━━━━━━━━━━━━━━━━━
 """
         send_telegram_message(success_msg)
 
-        return jsonify({
+        return {
             "status": "success",
             "symbol": symbol,
             "action": action,
             "filled_qty": filled_qty,
+            "fill_price": round(entry_price, 2),
             "orders_placed": {
                 "entry": entry_res["order_id"],
-                "sl": position_state["sl_order_id"],
-                "tp": position_state["tp_order_id"],
-                "partial_tp": position_state["partial_order_id"]
+                "sl": position.leg_id('sl'),
+                "tp": position.leg_id('tp'),
+                "partial_tp": position.leg_id('partial')
             }
-        }), 200
+        }, 200
 
     except Exception as e:
-        logger.error(f"❌ Webhook error: {str(e)}")
+        logger.error(f"❌ Signal execution error: {str(e)}")
+        if signal_data['symbol'] not in active_positions:
+            margin_set(signal_data['symbol'], 0)
         send_telegram_message(f"❌ <b>WEBHOOK ERROR</b>\n\n{str(e)}")
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # POSITION MONITORING & PARTIAL FILL HANDLING
 # ═══════════════════════════════════════════════════════════════════════════════
+def check_gtt_position(symbol, pos, gtt_orders):
+    """Lightweight confirmation for a GTT position - no sibling cancels, just state updates"""
+    partial_open = pos.leg_id('partial') and not pos.partial_filled
+    if partial_open:
+        outcome = gtt_exit_strategy(gtt_orders.get(pos.partial.order_id))
+        if outcome == "TARGET":
+            pos.partial_filled = True
+            partial_open = False
+            save_positions()
+            fill_price = record_gtt_exit(symbol, pos, "PARTIAL", pos.partial, gtt_orders.get(pos.partial.order_id), "TARGET")
+            pos.realized_pnl += book_reduce(symbol, pos.partial.quantity, fill_price)
+            publish_event('partial_filled', symbol, qty=pos.partial.quantity)
+            logger.info(f"✅ Partial TP filled (GTT): {symbol}")
+            send_telegram_message(f"✅ <b>PARTIAL PROFIT TAKEN (GTT)</b>\n\nSymbol: {symbol}\nQty Exited: {pos.partial.quantity}")
+
+    main_outcome = gtt_exit_strategy(gtt_orders.get(pos.leg_id('entry')))
+    if not main_outcome:
+        return
+
+    if main_outcome == "STOPLOSS" and partial_open:
+        # Same trigger on both groups - wait for the partial group's SL to confirm too
+        if not gtt_exit_strategy(gtt_orders.get(pos.partial.order_id)):
+            return
+
+    exit_price = None
+    if main_outcome in ["TARGET", "STOPLOSS"]:
+        leg_name = "TP" if main_outcome == "TARGET" else "SL"
+        exit_price = record_gtt_exit(symbol, pos, leg_name, pos.entry, gtt_orders.get(pos.leg_id('entry')), main_outcome)
+    close_position_state(symbol, main_outcome, exit_price)
+
+    if main_outcome == "TARGET":
+        logger.info(f"✅ Full TP hit (GTT): {symbol}")
+        send_telegram_message(f"🎯 <b>TAKE PROFIT HIT (GTT)</b>\n\nSymbol: {symbol}\n✅ Position fully closed")
+    elif main_outcome == "STOPLOSS":
+        logger.info(f"🛑 Stop Loss hit (GTT): {symbol}")
+        send_telegram_message(f"🛑 <b>STOP LOSS HIT (GTT)</b>\n\nSymbol: {symbol}\n❌ Position closed at loss")
+    else:
+        logger.warning(f"⚠️ GTT group died: {symbol}")
+        send_telegram_message(f"⚠️ <b>GTT GROUP INACTIVE</b>\n\nSymbol: {symbol}\nEntry was not executed by broker.")
+
 def monitor_partial_fills():
     """Background thread to monitor partial TP fills and adjust SL quantity"""
     while True:
         try:
-            for symbol, pos in list(active_positions.items()):
-                # Check if partial TP order exists and is not yet marked as filled
-                if pos.get('partial_order_id') and not pos.get('partial_filled'):
-                    status = get_order_status(pos['partial_order_id'])
+            for account in each_account():
+                # GTT positions: one list call confirms every group, broker already did the OCO cancel
+                gtt_orders = None
+                if any(p.bracket_mode == "GTT" for p in active_positions.values()):
+                    gtt_orders = get_gtt_orders()
+
+                for symbol, pos in list(active_positions.items()):
+                    if pos.bracket_mode == "GTT":
+                        if gtt_orders is not None:
+                            check_gtt_position(symbol, pos, gtt_orders)
+                        continue
+
+                    # Check if partial TP order exists and is not yet marked as filled
+                    if pos.leg_id('partial') and not pos.partial_filled:
+                        row = get_order_details(pos.partial.order_id) or {}
                     
-                    if status == "complete":
-                        logger.info(f"✅ Partial TP filled: {symbol}")
-                        pos['partial_filled'] = True
+                        if row.get('status') == "complete":
+                            logger.info(f"✅ Partial TP filled: {symbol}")
+                            pos.partial_filled = True
                         
-                        # ✅ CRITICAL: Adjust SL quantity
-                        partial_qty = pos['partial_order_data']['quantity']
-                        remaining_qty = pos['filled_qty'] - partial_qty
+                            # ✅ CRITICAL: Adjust SL quantity
+                            partial_qty = pos.partial.quantity
+                            remaining_qty = pos.remaining_qty
+                            fill_price = safe_float(row.get('average_price'))
+                            record_execution(symbol, "PARTIAL", pos.partial, fill_price, row.get('filled_quantity'))
+                            pos.realized_pnl += book_reduce(symbol, partial_qty, fill_price or pos.partial.price)
                         
-                        # Cancel old SL and place new SL with reduced quantity
-                        if pos.get('sl_order_id'):
-                            cancel_order(pos['sl_order_id'])
-                            
-                            # Get instrument key
-                            instrument_key = get_instrument_key(symbol)
-                            if instrument_key:
-                                opposite_action = "SELL" if pos['action'] == "BUY" else "BUY"
-                                
-                                new_sl_order = {
-                                    "quantity": remaining_qty,  # ✅ Adjusted quantity
-                                    "product": "I",
-                                    "validity": "DAY",
-                                    "price": 0,
-                                    "instrument_token": instrument_key,
-                                    "order_type": "SL-M",
-                                    "transaction_type": opposite_action,
-                                    "disclosed_quantity": 0,
-                                    "trigger_price": pos['sl_order_data']['trigger_price'],
-                                    "is_amo": False
-                                }
-                                
-                                sl_res = place_order(new_sl_order, "ADJUSTED SL")
-                                if sl_res["success"]:
-                                    pos['sl_order_id'] = sl_res["order_id"]
-                                    pos['sl_order_data'] = new_sl_order
+                            # Resize SL in place (one call, never unprotected)
+                            if pos.leg_id('sl'):
+                                if adjust_sl_order(symbol, pos, quantity=remaining_qty):
                                     logger.info(f"✅ SL adjusted: {symbol} | New qty: {remaining_qty}")
-                                    
+                                
                                     send_telegram_message(f"""
 ✅ <b>PARTIAL PROFIT TAKEN</b>
 ━━━━━━━━━━━━━━━━━━━━━
@@ -782,23 +3723,25 @@ def monitor_partial_fills():
 ━━━━━━━━━━━━━━━━━━━━━
 """)
                                 else:
+                                    # adjust_sl_order already emergency-exited / alerted where needed
                                     logger.critical(f"🚨 SL adjustment failed: {symbol}")
-                                    emergency_exit_position(symbol, remaining_qty, pos['action'])
                         
-                        save_positions()
+                            save_positions()
+                            publish_event('partial_filled', symbol, qty=partial_qty, sl_qty=pos.sl.quantity if pos.sl else 0)
                 
-                # Check if full TP is hit
-                if pos.get('tp_order_id'):
-                    status = get_order_status(pos['tp_order_id'])
-                    if status == "complete":
-                        logger.info(f"✅ Full TP hit: {symbol}")
-                        # Position should be fully closed now
-                        if pos.get('sl_order_id'):
-                            cancel_order(pos['sl_order_id'])
-                        del active_positions[symbol]
-                        save_positions()
+                    # Check if full TP is hit
+                    if pos.leg_id('tp'):
+                        row = get_order_details(pos.tp.order_id) or {}
+                        if row.get('status') == "complete":
+                            logger.info(f"✅ Full TP hit: {symbol}")
+                            # Position should be fully closed now
+                            if pos.leg_id('sl'):
+                                cancel_order(pos.sl.order_id)
+                            fill_price = safe_float(row.get('average_price'))
+                            record_execution(symbol, "TP", pos.tp, fill_price, row.get('filled_quantity'))
+                            close_position_state(symbol, "TARGET", fill_price or pos.tp.price)
                         
-                        send_telegram_message(f"""
+                            send_telegram_message(f"""
 🎯 <b>TAKE PROFIT HIT</b>
 ━━━━━━━━━━━━━━━━━━━━━
 📊 Symbol: {symbol}
@@ -809,20 +3752,21 @@ def monitor_partial_fills():
 ━━━━━━━━━━━━━━━━━━━━━
 """)
                 
-                # Check if SL is hit
-                if pos.get('sl_order_id'):
-                    status = get_order_status(pos['sl_order_id'])
-                    if status == "complete":
-                        logger.info(f"🛑 Stop Loss hit: {symbol}")
-                        # Cancel any remaining orders
-                        if pos.get('tp_order_id'):
-                            cancel_order(pos['tp_order_id'])
-                        if pos.get('partial_order_id'):
-                            cancel_order(pos['partial_order_id'])
-                        del active_positions[symbol]
-                        save_positions()
+                    # Check if SL is hit
+                    if pos.leg_id('sl'):
+                        row = get_order_details(pos.sl.order_id) or {}
+                        if row.get('status') == "complete":
+                            logger.info(f"🛑 Stop Loss hit: {symbol}")
+                            # Cancel any remaining orders
+                            if pos.leg_id('tp'):
+                                cancel_order(pos.tp.order_id)
+                            if pos.leg_id('partial'):
+                                cancel_order(pos.partial.order_id)
+                            fill_price = safe_float(row.get('average_price'))
+                            record_execution(symbol, "SL", pos.sl, fill_price, row.get('filled_quantity'))
+                            close_position_state(symbol, "STOPLOSS", fill_price or None)
                         
-                        send_telegram_message(f"""
+                            send_telegram_message(f"""
 🛑 <b>STOP LOSS HIT</b>
 ━━━━━━━━━━━━━━━━━━━━━
 📊 Symbol: {symbol}
@@ -839,67 +3783,459 @@ def monitor_partial_fills():
             logger.error(f"❌ Monitor error: {e}")
             time.sleep(10)
 
-# Start position monitor thread
-Thread(target=monitor_partial_fills, daemon=True).start()
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# TRAILING STOP ENGINE
+# ═══════════════════════════════════════════════════════════════════════════════
+def trail_distance(pos, ltp):
+    """Trail distance in ₹ for a position (signal points, else % of LTP, else 0)"""
+    if pos.trail_points:
+        return pos.trail_points
+    if TRAILING_STOP_PCT:
+        return ltp * TRAILING_STOP_PCT / 100
+    return 0
+
+def trailing_stop_engine():
+    """Background thread - ratchets SL triggers from live prices via modify_order"""
+    while True:
+        try:
+            for account in each_account():
+                for symbol, pos in list(active_positions.items()):
+                    if pos.bracket_mode == "GTT" or not pos.leg_id('sl'):
+                        continue
+                    ltp = book_last_price(symbol)
+                    distance = trail_distance(pos, ltp)
+                    if not ltp or not distance:
+                        continue
+
+                    current = pos.sl.trigger_price
+                    if pos.action == "BUY":
+                        candidate = round(ltp - distance, 2)
+                        improves = candidate - current >= TRAIL_MIN_STEP
+                    else:
+                        candidate = round(ltp + distance, 2)
+                        improves = current - candidate >= TRAIL_MIN_STEP
+
+                    if improves and adjust_sl_order(symbol, pos, trigger_price=candidate):
+                        save_positions()
+                        publish_event('sl_modified', symbol, trigger_price=candidate, ltp=ltp)
+                        logger.info(f"🔒 Trailing SL: {symbol} | {current} → {candidate} (LTP {ltp})")
+
+            time.sleep(TRAIL_CHECK_INTERVAL)
+        except Exception as e:
+            logger.error(f"❌ Trailing stop error: {e}")
+            time.sleep(TRAIL_CHECK_INTERVAL)
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # POSITION RECONCILIATION (Safety Check)
 # ═══════════════════════════════════════════════════════════════════════════════
+ORDER_FINAL_STATES = ["complete", "rejected", "cancelled"]
+
+def fetch_broker_positions():
+    """Net intraday qty per symbol (signed) - one call"""
+    url = "https://api.upstox.com/v2/portfolio/short-term-positions"
+    headers = {'Authorization': f'Bearer {get_token()}', 'Accept': 'application/json'}
+    response = broker_request('GET', url, headers=headers, timeout=10)
+    if response.status_code != 200:
+        return None
+    actual_positions = {}
+    for pos in response.json().get('data') or []:
+        symbol = pos.get('trading_symbol', '').replace('-EQ', '').upper()
+        qty = int(pos.get('quantity', 0))
+        if qty != 0:
+            actual_positions[symbol] = qty
+    return actual_positions
+
+def fetch_order_book():
+    """Today's orders keyed by order_id - one call"""
+    url = "https://api.upstox.com/v2/order/retrieve-all"
+    headers = {'Authorization': f'Bearer {get_token()}', 'Accept': 'application/json'}
+    response = broker_request('GET', url, headers=headers, timeout=10)
+    if response.status_code != 200:
+        return None
+    return {o['order_id']: o for o in response.json().get('data') or [] if o.get('order_id')}
+
+def order_pending_qty(order):
+    """Unfilled qty of a live order (0 if final)"""
+    if not order or order.get('status') in ORDER_FINAL_STATES:
+        return 0
+    return int(order.get('quantity', 0)) - int(order.get('filled_quantity', 0))
+
+def expected_net_qty(pos, orders):
+    """Signed qty we should hold: entry fill minus whatever the exit legs filled"""
+    qty = pos.filled_qty
+    for leg in pos.open_legs:
+        order = orders.get(leg.order_id)
+        if order:
+            qty -= int(order.get('filled_quantity', 0))
+    return qty if pos.action == "BUY" else -qty
+
+def resize_exit_legs(symbol, pos, orders, held_qty):
+    """Fit SL / TP / partial legs to the qty actually held"""
+    if pos.leg_id('sl') and order_pending_qty(orders.get(pos.sl.order_id)) not in [0, held_qty]:
+        if not adjust_sl_order(symbol, pos, quantity=held_qty):
+            logger.critical(f"🚨 Reconcile SL resize failed: {symbol}")
+
+    # Limit legs may not exceed what is held - trim full TP first, then partial
+    room = held_qty
+    for name in ['partial', 'tp']:
+        leg = getattr(pos, name)
+        pending = order_pending_qty(orders.get(leg.order_id)) if leg and leg.order_id else 0
+        if not pending:
+            continue
+        if pending <= room:
+            room -= pending
+            continue
+        if room <= 0:
+            cancel_order(leg.order_id)
+            leg.order_id = None
+            continue
+        resized = leg.with_changes(quantity=room)
+        if modify_order(leg.order_id, resized.payload(), f"RECONCILE {name.upper()}"):
+            setattr(pos, name, resized)
+        room = 0
+
+def gtt_flat_is_ghost(pos, gtt_orders):
+    """A flat GTT position is a ghost only if its entry executed and no group has fired or died since"""
+    if gtt_orders is None:
+        return False  # no GTT view this pass - never guess
+    for leg in pos.open_legs:
+        if leg is pos.partial and pos.partial_filled:
+            continue
+        gtt = gtt_orders.get(leg.order_id)
+        if gtt is None:
+            continue  # aged out of the GTT list - no outcome left to wait for
+        if gtt_exit_strategy(gtt) or gtt_entry_status(gtt) not in GTT_EXIT_STATES:
+            return False  # exit fired (check_gtt_position books it) / entry never executed
+    return True
+
+def reconcile_once():
+    """One batched pass (2 API calls): diff tracked vs broker by symbol, side, net qty; repair drift"""
+    actual_positions = fetch_broker_positions()
+    orders = fetch_order_book()
+    if actual_positions is None or orders is None:
+        return None
+
+    # Last pass snapshot of this account - only deltas against it are examined
+    reconcile_state = current_account()['reconcile']
+    order_marks = {oid: (o.get('status'), o.get('filled_quantity')) for oid, o in orders.items()}
+    unchanged = (actual_positions == reconcile_state['positions']
+                 and order_marks == reconcile_state['orders']
+                 and state_version == reconcile_state['version'])
+    reconcile_state['positions'] = actual_positions
+    reconcile_state['orders'] = order_marks
+    reconcile_state['version'] = state_version
+    if unchanged and not reconcile_state['suspects']:
+        return {'changed': False}
+
+    repairs = []
+    suspects = {}
+    gtt_orders = None
+    for symbol, pos in list(active_positions.items()):
+        held = actual_positions.get(symbol, 0)
+        if pos.bracket_mode == "GTT":
+            # GTT legs are not in the order book by id → only detect vanished positions
+            expected = held if held else (pos.filled_qty if pos.action == "BUY" else -pos.filled_qty)
+            if not held:
+                gtt_orders = get_gtt_orders() if gtt_orders is None else gtt_orders
+                if not gtt_flat_is_ghost(pos, gtt_orders):
+                    continue
+        else:
+            expected = expected_net_qty(pos, orders)
+        # Net qty can agree while the SL-M covers a different qty (e.g. partial TP filled, SL never resized)
+        sl_pending = order_pending_qty(orders.get(pos.sl.order_id)) if pos.bracket_mode != "GTT" and pos.leg_id('sl') else 0
+        if held == expected and (not held or sl_pending in [0, abs(held)]):
+            continue  # flat with a live SL = exit just filled, the monitor cancels the sibling
+
+        # Debounce: broker position book can lag a fresh fill by a few seconds
+        signature = (held, expected, sl_pending)
+        seen = reconcile_state['suspects'].get(symbol)
+        passes = seen[1] + 1 if seen and seen[0] == signature else 1
+        if passes < RECONCILE_CONFIRM_PASSES:
+            suspects[symbol] = (signature, passes)
+            continue
+
+        if held == expected:
+            logger.warning(f"⚠️ SL size drift: {symbol} | SL {sl_pending} vs held {abs(held)}")
+            resize_exit_legs(symbol, pos, orders, abs(held))
+            save_positions()
+            repairs.append({'symbol': symbol, 'repair': 'sl_resized', 'sl_qty': sl_pending, 'held': held})
+            send_telegram_message(f"🔄 <b>SL resized</b>\n\nSymbol: {symbol}\nSL Qty: {sl_pending} → {abs(held)}\nBroker position: {held}")
+        elif held == 0:
+            logger.warning(f"⚠️ Ghost position: {symbol} (expected {expected})")
+            cancel_position_orders(pos)
+            close_position_state(symbol, "GHOST")
+            repairs.append({'symbol': symbol, 'repair': 'ghost_removed', 'expected': expected})
+            send_telegram_message(f"⚠️ <b>Ghost position removed</b>\n\nSymbol: {symbol}\nReason: Not found in actual positions\nLive SL/TP orders cancelled")
+        elif (held > 0) != (expected > 0):
+            key = ('side', symbol, held)
+            if key not in reconcile_state['alerted']:
+                reconcile_state['alerted'].add(key)
+                logger.critical(f"🚨 Side mismatch: {symbol} | Broker {held} vs Tracked {expected}")
+                send_telegram_message(f"🚨 <b>Side mismatch</b>\n\nSymbol: {symbol}\nBroker: {held}\nTracked: {expected}\nManual check required!")
+            repairs.append({'symbol': symbol, 'repair': 'side_mismatch_alerted', 'held': held, 'expected': expected})
+        else:
+            # Same side, different size (manual adjust / missed fill) → resize legs to broker qty
+            pos.filled_qty += abs(held) - abs(expected)
+            if pos.bracket_mode != "GTT":
+                resize_exit_legs(symbol, pos, orders, abs(held))
+            save_positions()
+            if abs(held) < abs(expected):
+                pos.realized_pnl += book_reduce(symbol, abs(expected) - abs(held))
+            publish_event('position_resized', symbol, held=held, expected=expected)
+            repairs.append({'symbol': symbol, 'repair': 'resized', 'held': held, 'expected': expected})
+            send_telegram_message(f"🔄 <b>Position resized</b>\n\nSymbol: {symbol}\nTracked: {expected} → Broker: {held}\nSL/TP legs adjusted")
+
+    reconcile_state['suspects'] = suspects
+
+    # Untracked broker positions - report each new one once
+    for symbol in set(actual_positions) - set(active_positions):
+        key = ('untracked', symbol, actual_positions[symbol])
+        if key not in reconcile_state['alerted']:
+            reconcile_state['alerted'].add(key)
+            logger.warning(f"⚠️ Untracked position: {symbol} ({actual_positions[symbol]})")
+            send_telegram_message(f"⚠️ <b>Untracked position detected</b>\n\nSymbol: {symbol}\nQty: {actual_positions[symbol]}\n\nThis may be a manual trade.")
+
+    # Orphaned bot orders: still live at broker, no longer referenced by any position
+    referenced = set()
+    for pos in active_positions.values():
+        referenced.update(leg.order_id for leg in pos.open_legs)
+    now = time.time()
+    bot_order_ids = current_account()['order_ids']
+    for oid, placed_at in list(bot_order_ids.items()):
+        order = orders.get(oid)
+        if order and order.get('status') in ORDER_FINAL_STATES:
+            del bot_order_ids[oid]
+            continue
+        if oid in referenced or now - placed_at < ORPHAN_ORDER_GRACE:
+            continue
+        if order_pending_qty(order) > 0:
+            if cancel_order(oid):
+                repairs.append({'order_id': oid, 'repair': 'orphan_cancelled'})
+
+    return {'changed': True, 'repairs': repairs, 'suspects': list(suspects)}
+
 def reconcile_positions():
-    """Periodically check actual positions vs tracked positions"""
+    """Background thread - quantity-aware reconcile every few seconds"""
     while True:
         try:
             time.sleep(POSITION_RECONCILE_INTERVAL)
             
-            if not get_token():
-                continue
-            
-            # Get actual positions from Upstox
-            url = "https://api.upstox.com/v2/portfolio/short-term-positions"
-            headers = {'Authorization': f'Bearer {get_token()}'}
-            response = requests.get(url, headers=headers, timeout=10)
-            
-            if response.status_code != 200:
-                continue
-            
-            data = response.json()
-            actual_positions = {}
-            
-            for pos in data.get('data', []):
-                symbol = pos.get('trading_symbol', '').replace('-EQ', '').upper()
-                qty = int(pos.get('quantity', 0))
-                if qty != 0:
-                    actual_positions[symbol] = qty
-            
-            # Compare with tracked positions
-            tracked_symbols = set(active_positions.keys())
-            actual_symbols = set(actual_positions.keys())
-            
-            # Positions that exist in tracking but not in actual
-            ghost_positions = tracked_symbols - actual_symbols
-            if ghost_positions:
-                logger.warning(f"⚠️ Ghost positions detected: {ghost_positions}")
-                for symbol in ghost_positions:
-                    del active_positions[symbol]
-                    send_telegram_message(f"⚠️ <b>Ghost position removed</b>\n\nSymbol: {symbol}\nReason: Not found in actual positions")
-                save_positions()
-            
-            # Positions that exist in actual but not in tracking
-            untracked_positions = actual_symbols - tracked_symbols
-            if untracked_positions:
-                logger.warning(f"⚠️ Untracked positions: {untracked_positions}")
-                send_telegram_message(f"⚠️ <b>Untracked positions detected</b>\n\nSymbols: {', '.join(untracked_positions)}\n\nThese may be manual trades.")
+            for account in each_account():
+                if not get_token():
+                    continue
+                
+                result = reconcile_once()
+                if result and result.get('repairs'):
+                    logger.info(f"🔄 Reconcile repairs ({account['name']}): {result['repairs']}")
             
         except Exception as e:
             logger.error(f"❌ Reconciliation error: {e}")
 
-# Start reconciliation thread
-Thread(target=reconcile_positions, daemon=True).start()
+# ═══════════════════════════════════════════════════════════════════════════════
+# STARTUP CRASH RECOVERY
+# ═══════════════════════════════════════════════════════════════════════════════
+def fetch_trades_for_day():
+    """Today's fills → {order_id: (qty, vwap)} - one call"""
+    url = "https://api.upstox.com/v2/order/trades/get-trades-for-day"
+    headers = {'Authorization': f'Bearer {get_token()}', 'Accept': 'application/json'}
+    response = broker_request('GET', url, headers=headers, timeout=10)
+    if response.status_code != 200:
+        return None
+    totals = {}
+    for trade in response.json().get('data') or []:
+        qty = int(trade.get('quantity', 0))
+        price = safe_float(trade.get('average_price', trade.get('price')))
+        q, notional = totals.get(trade.get('order_id'), (0, 0.0))
+        totals[trade.get('order_id')] = (q + qty, notional + qty * price)
+    return {oid: (q, notional / q if q else 0.0) for oid, (q, notional) in totals.items()}
+
+def order_leg(order, order_id):
+    """Order-book row → the OrderLeg the bot stores in position state (None if no row)"""
+    if not order:
+        return None
+    return OrderLeg(order_id, int(order.get('quantity', 0)), safe_float(order.get('price')),
+                    safe_float(order.get('trigger_price')), order.get('order_type'),
+                    order.get('transaction_type'), order.get('instrument_token'), order.get('tag'))
+
+def pick_leg(leg_orders):
+    """Live order of a leg if any, else the most recent one"""
+    if not leg_orders:
+        return None
+    live = [o for o in leg_orders if o.get('status') not in ORDER_FINAL_STATES]
+    return (live or leg_orders)[-1]
+
+def rebuild_positions(orders, trades, broker_positions):
+    """Group tagged orders by position id and rebuild each still-open position"""
+    groups = {}
+    for order in sorted(orders.values(), key=lambda o: o.get('order_timestamp') or ''):
+        parsed = parse_order_tag(order.get('tag'))
+        if parsed:
+            leg, pid = parsed
+            groups.setdefault(pid, {}).setdefault(leg, []).append(order)
+
+    rebuilt = {}
+    for pid in sorted(groups, key=lambda p: int(p, 16)):  # later positions win (reversals)
+        legs = groups[pid]
+        entries = [o for o in legs.get('E', []) if int(o.get('filled_quantity') or 0) > 0]
+        if not entries:
+            continue
+        entry = entries[-1]
+        symbol = entry.get('trading_symbol', '').replace('-EQ', '').upper()
+        entry_filled = sum(int(o.get('filled_quantity') or 0) for o in entries)
+        exited = sum(int(o.get('filled_quantity') or 0) for leg in ['P', 'T', 'S', 'X'] for o in legs.get(leg, []))
+        remaining = entry_filled - exited
+        if remaining <= 0 or not broker_positions.get(symbol):
+            rebuilt.pop(symbol, None)
+            continue
+
+        partial = pick_leg(legs.get('P'))
+        tp = pick_leg(legs.get('T'))
+        sl = pick_leg(legs.get('S'))
+        partial_filled = bool(partial and partial.get('status') == 'complete')
+        entry_price = (trades.get(entry['order_id']) or (0, 0.0))[1] or safe_float(entry.get('average_price'))
+
+        def live_id(order):
+            return order['order_id'] if order and order.get('status') not in ORDER_FINAL_STATES else None
+
+        rebuilt[symbol] = Position(
+            symbol, entry.get('transaction_type'),
+            position_id=pid,
+            qty_requested=int(entry.get('quantity', entry_filled)),
+            filled_qty=remaining + (int(partial.get('filled_quantity') or 0) if partial_filled else 0),
+            entry_price=entry_price,
+            entry=order_leg(entry, entry['order_id']),
+            sl=order_leg(sl, live_id(sl)),
+            tp=order_leg(tp, live_id(tp)),
+            partial=order_leg(partial, partial['order_id'] if partial_filled else live_id(partial)),
+            partial_filled=partial_filled,
+            created_at=int(pid, 16) / 1000
+        )
+    return rebuilt
+
+def reprotect_position(symbol, pos, disk_pos):
+    """Make sure a recovered position has a live SL-M for its remaining qty"""
+    remaining = pos.remaining_qty
+    if pos.leg_id('sl'):
+        if pos.sl.quantity == remaining or adjust_sl_order(symbol, pos, quantity=remaining):
+            return True
+        if active_positions.get(symbol) is not pos:
+            return False  # adjust_sl_order already flattened it
+        # SL neither resized nor re-placed - an oversized SL-M can flip the account, a dead one leaves it bare
+        logger.critical(f"🚨 Recovery: SL resize to {remaining} failed for {symbol} - emergency exit")
+        cancel_position_orders(pos)
+        if emergency_exit_position(symbol, remaining, pos.action, pos.position_id, pos.instrument_key):
+            close_position_state(symbol, "EMERGENCY")
+        else:
+            send_telegram_message(f"🚨 <b>UNPROTECTED POSITION</b>\n\nSymbol: {symbol}\nQty: {remaining}\nRecovery SL resize and emergency exit both failed - exit manually!")
+        return False
+
+    # No live SL → re-place at the last known trigger, else RECOVERY_SL_PCT from entry
+    trigger = (pos.sl.trigger_price if pos.sl else 0) \
+        or (disk_pos.sl.trigger_price if disk_pos and disk_pos.sl else 0)
+    if not trigger and pos.entry_price:
+        offset = pos.entry_price * RECOVERY_SL_PCT / 100
+        trigger = pos.entry_price - offset if pos.action == "BUY" else pos.entry_price + offset
+    if not trigger:
+        logger.critical(f"🚨 Recovery: no SL price for {symbol} - emergency exit")
+        emergency_exit_position(symbol, remaining, pos.action, pos.position_id, pos.instrument_key)
+        return False
+
+    sl_order_data = {
+        "quantity": remaining,
+        "product": "I",
+        "validity": "DAY",
+        "price": 0,
+        "instrument_token": pos.instrument_key,
+        "order_type": "SL-M",
+        "transaction_type": pos.exit_action,
+        "disclosed_quantity": 0,
+        "trigger_price": round(trigger, 2),
+        "is_amo": False,
+        "tag": order_tag("S", pos.position_id)
+    }
+    sl_res = place_order(sl_order_data, "RECOVERY SL")
+    if sl_res["success"]:
+        pos.sl = OrderLeg.from_payload(sl_order_data, sl_res["order_id"], sl_res)
+        send_telegram_message(f"🛡️ <b>Recovery: SL re-placed</b>\n\nSymbol: {symbol}\nQty: {remaining}\nTrigger: ₹{trigger:.2f}")
+        return True
+
+    logger.critical(f"🚨 Recovery SL failed: {symbol} - emergency exit")
+    emergency_exit_position(symbol, remaining, pos.action, pos.position_id, pos.instrument_key)
+    return False
+
+def run_recovery():
+    """Warm-start: rebuild positions from broker order book / trades / positions, re-protect, then open webhooks"""
+    account = current_account()
+    recovery_ready = account['recovery_ready']
+    if recovery_ready.is_set():
+        return True
+    if not get_token():
+        logger.warning(f"⚠️ Recovery deferred until login ({account['name']})")
+        return False
+
+    try:
+        orders = fetch_order_book()
+        trades = fetch_trades_for_day()
+        broker_positions = fetch_broker_positions()
+        if orders is None or trades is None or broker_positions is None:
+            raise RuntimeError("broker snapshot unavailable")
+
+        disk_positions = account['positions']
+        rebuilt = rebuild_positions(orders, trades, broker_positions)
+
+        recovered = {}
+        for symbol, pos in rebuilt.items():
+            disk_pos = disk_positions.get(symbol)
+            if disk_pos and disk_pos.position_id == pos.position_id:
+                # Keep what only the bot knew (trail, requested qty, signal price)
+                for field in ['trail_points', 'qty_requested', 'created_at', 'signal', 'realized_pnl']:
+                    setattr(pos, field, getattr(disk_pos, field))
+                pos.entry_price = pos.entry_price or disk_pos.entry_price
+            recovered[symbol] = pos
+
+        # GTT positions live broker-side; keep them while the broker still holds qty
+        for symbol, disk_pos in disk_positions.items():
+            if disk_pos.bracket_mode == "GTT" and broker_positions.get(symbol) and symbol not in recovered:
+                recovered[symbol] = disk_pos
+
+        # Disk positions the broker no longer holds: pull any leftover legs
+        for symbol, disk_pos in disk_positions.items():
+            if symbol not in recovered:
+                cancel_position_orders(disk_pos)
+
+        # Live tagged orders of positions that no longer exist are orphans
+        live_pids = {p.position_id for p in recovered.values()}
+        for order in orders.values():
+            parsed = parse_order_tag(order.get('tag'))
+            if parsed and parsed[1] not in live_pids and order.get('status') not in ORDER_FINAL_STATES:
+                cancel_order(order['order_id'])
+
+        for symbol in list(disk_positions):
+            book_close(symbol)
+        # Install before re-protecting - SL adjusts only act on the position the account holds
+        account['positions'] = recovered
+        for symbol, pos in rebuilt.items():
+            reprotect_position(symbol, pos, disk_positions.get(symbol))
+        save_positions()
+        book_seed_from_positions()
+        for symbol, pos in recovered.items():
+            publish_event('position_recovered', symbol, position=position_summary(symbol, pos))
+
+        logger.info(f"✅ Recovery complete: {list(recovered.keys())} (disk had {list(disk_positions.keys())})")
+        send_telegram_message(f"♻️ <b>Recovery complete</b>\n\nPositions: {', '.join(recovered) or 'None'}")
+    except Exception as e:
+        # Broker unreachable → fall back to the disk snapshot rather than blocking trading
+        logger.error(f"❌ Recovery failed, trusting {account['positions_file']}: {e}")
+
+    recovery_ready.set()
+    readiness['recovery'] = all(a['recovery_ready'].is_set() for a in accounts.values())
+    return True
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # ROUTES - AUTH, TEST, STATS
 # ═══════════════════════════════════════════════════════════════════════════════
-@app.route('/')
+@bp.route('/')
 def home():
     """Home endpoint with bot status"""
     token_status = "✅ Active" if is_token_valid() else "❌ Expired/Missing"
@@ -912,38 +4248,45 @@ def home():
         'market_status': market_status,
         'active_positions': len(active_positions),
         'positions': list(active_positions.keys()),
-        'login_url': f"{request.url_root}login",
+        'accounts': account_summaries(),
+        'login_url': login_url(request.url_root),
         'webhook_url': f"{request.url_root}webhook"
     })
 
-@app.route('/login')
+@bp.route('/login')
 def login():
-    """Initiate Upstox OAuth login"""
-    if not UPSTOX_API_KEY or not UPSTOX_API_SECRET:
+    """Initiate Upstox OAuth login (?account=<name> for a non-primary account)"""
+    account = current_account()
+    if not account['api_key'] or not account['api_secret']:
         return "<h2 style='color:red;'>❌ Error: Upstox credentials missing in environment variables!</h2>", 500
     
+    # OAuth state carries the account name back to /callback
     auth_url = (
         "https://api.upstox.com/v2/login/authorization/dialog"
-        f"?response_type=code&client_id={UPSTOX_API_KEY}&redirect_uri={UPSTOX_REDIRECT_URI}"
+        f"?response_type=code&client_id={account['api_key']}&redirect_uri={UPSTOX_REDIRECT_URI}"
+        f"&state={account['name']}"
     )
     return redirect(auth_url)
 
-@app.route('/callback')
+@bp.route('/callback')
 def callback():
     """Handle Upstox OAuth callback"""
     code = request.args.get('code')
     if not code:
         return "<h2 style='color:red;'>❌ Error: No authorization code received</h2>", 400
+    account = accounts.get(request.args.get('state')) or accounts[PRIMARY_ACCOUNT]
     
-    if generate_access_token(code):
+    if run_in_account(account, generate_access_token, code):
+        if not account['recovery_ready'].is_set():
+            Thread(target=run_in_account, args=(account, run_recovery), daemon=True, name=f"recovery-{account['name']}").start()
         return f"""
         <html>
         <head><title>Success</title></head>
         <body style="font-family: Arial; text-align: center; padding: 50px;">
             <h1 style="color:green;">✅ SUCCESS!</h1>
-            <h2>Upstox Token Generated Successfully!</h2>
+            <h2>Upstox Token Generated Successfully! ({account['name']})</h2>
             <p style="font-size: 18px;">Bot is now ready for live trading</p>
-            <p style="font-size: 16px; color: #666;">Token valid for 20 hours</p>
+            <p style="font-size: 16px; color: #666;">Token saved to encrypted vault - restarts won't need login</p>
             <p><a href="/" style="color: blue; text-decoration: none;">← Back to Dashboard</a></p>
         </body>
         </html>
@@ -951,7 +4294,7 @@ def callback():
     else:
         return "<h2 style='color:red;'>❌ Token Generation Failed</h2><p>Check logs for details</p>", 500
 
-@app.route('/test', methods=['GET'])
+@bp.route('/test', methods=['GET'])
 def test_alert():
     """Test webhook with sample data"""
     test_data = {
@@ -977,21 +4320,20 @@ def test_alert():
         'data': test_data
     })
 
-@app.route('/stats', methods=['GET'])
+@bp.route('/stats', methods=['GET'])
 def get_stats():
     """Get bot statistics"""
-    token_hours_left = 0
-    if token_generated_at:
-        token_hours_left = max(0, 20 - ((datetime.now() - token_generated_at).total_seconds() / 3600))
+    token_hours_left = token_seconds_left() / 3600
     
     positions_detail = []
     for symbol, pos in active_positions.items():
         positions_detail.append({
             'symbol': symbol,
-            'action': pos['action'],
-            'filled_qty': pos['filled_qty'],
-            'partial_filled': pos.get('partial_filled', False),
-            'created_at': datetime.fromtimestamp(pos['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+            'action': pos.action,
+            'filled_qty': pos.filled_qty,
+            'remaining_qty': pos.remaining_qty,
+            'partial_filled': pos.partial_filled,
+            'created_at': datetime.fromtimestamp(pos.created_at).strftime('%Y-%m-%d %H:%M:%S')
         })
     
     return jsonify({
@@ -1002,6 +4344,12 @@ def get_stats():
         'market_open': is_market_open(),
         'active_positions_count': len(active_positions),
         'positions': positions_detail,
+        'accounts': account_summaries(),
+        'spool': spool_stats(),
+        'admission': admission_stats(),
+        'signal_engine': engine_stats(),
+        'premarket_warmup': warmup_state['last'],
+        'pnl': {k: v for k, v in book_snapshot().items() if k != 'positions'},
         'features': {
             'order_fill_verification': True,
             'market_hours_check': True,
@@ -1009,19 +4357,129 @@ def get_stats():
             'sl_adjustment': True,
             'position_reconciliation': True,
             'emergency_exit': True,
-            'token_expiry_monitor': True
+            'token_expiry_monitor': True,
+            'bracket_mode': BRACKET_MODE,
+            'in_place_sl_modify': True,
+            'multi_account_fanout': len(accounts),
+            'trailing_stop_pct': TRAILING_STOP_PCT,
+            'signal_engine': SIGNAL_ENGINE_SOURCE,
+            'option_routing': f"{OPTION_ROUTING} ({OPTION_EXPIRY}, offset {OPTION_STRIKE_OFFSET:+d}, {len(option_chains)} underlyings)"
         }
     })
 
-@app.route('/positions', methods=['GET'])
-def get_positions():
-    """Get detailed position information"""
+@bp.route('/pnl', methods=['GET'])
+def get_pnl():
+    """Live portfolio MTM, exposure and daily drawdown"""
+    snapshot = book_snapshot()
+    snapshot['limits'] = {'max_daily_loss': MAX_DAILY_LOSS, 'max_exposure': MAX_EXPOSURE}
+    snapshot['market_data_source'] = MARKET_DATA_SOURCE
+    return jsonify(snapshot)
+
+@bp.route('/analytics', methods=['GET'])
+def get_analytics():
+    """Closed-trade stats from the columnar ledger: ?days=180&group_by=killzone&symbol=RELIANCE"""
+    started = time.time()
+    days = min(int(request.args.get('days', 30)), 3660)
+    group_by = request.args.get('group_by', 'killzone')
+    if group_by not in LEDGER_GROUPS:
+        return jsonify({'error': f'group_by must be one of {LEDGER_GROUPS}'}), 400
+    symbol = request.args.get('symbol', '').upper().replace('-EQ', '') or None
+
+    table = ledger_load(days, symbol)
+    pnl = table['pnl']
     return jsonify({
-        'active_positions': active_positions,
-        'count': len(active_positions)
+        'days': days,
+        'group_by': group_by,
+        'trades': int(len(pnl)),
+        'win_rate': round(float((pnl > 0).mean() * 100), 2) if len(pnl) else 0.0,
+        'total_pnl': round(float(pnl.sum()), 2),
+        'groups': ledger_aggregate(table, group_by),
+        'query_ms': round((time.time() - started) * 1000, 2)
     })
 
-@app.route('/close/<symbol>', methods=['POST'])
+@bp.route('/executions', methods=['GET'])
+def get_executions():
+    """Execution quality from the fills ledger: ?days=30&group_by=order_type&symbol=RELIANCE"""
+    started = time.time()
+    days = min(int(request.args.get('days', 30)), 3660)
+    group_by = request.args.get('group_by', 'leg')
+    if group_by not in EXECUTION_GROUPS:
+        return jsonify({'error': f'group_by must be one of {EXECUTION_GROUPS}'}), 400
+    symbol = request.args.get('symbol', '').upper().replace('-EQ', '') or None
+
+    table = ledger_load(days, symbol, kind='executions')
+    slippage_rs = table['slippage_rs']
+    legs = table['leg__vocab'].tolist()
+    entries = table['leg'] == (legs.index("ENTRY") if "ENTRY" in legs else -1)
+    return jsonify({
+        'days': days,
+        'group_by': group_by,
+        'fills': int(len(slippage_rs)),
+        'slippage_rs': round(float(np.nansum(slippage_rs)), 2),
+        'entry_slippage_rs': round(float(np.nansum(slippage_rs[entries])), 2),  # signal price → fill: the cost of latency
+        'latency_ms': {name: latency_percentiles(values) for name, values in execution_latencies(table).items()},
+        'groups': execution_report(table, group_by),
+        'query_ms': round((time.time() - started) * 1000, 2)
+    })
+
+@bp.route('/positions', methods=['GET'])
+def get_positions():
+    """Get detailed position information (ETag = state version → 304 when unchanged)"""
+    etag = f'"{state_epoch}-v{state_version}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers={'ETag': etag})
+
+    response = jsonify({
+        'account': current_account()['name'],
+        'active_positions': {symbol: pos.to_dict() for symbol, pos in list(active_positions.items())},
+        'count': len(active_positions),
+        'version': state_version
+    })
+    response.headers['ETag'] = etag
+    return response
+
+@bp.route('/events', methods=['GET'])
+def stream_events():
+    """Server-Sent Events: incremental position/order changes (resumes from Last-Event-ID).
+    Each response is bounded to EVENT_STREAM_SECONDS so a dashboard tab never pins a worker thread."""
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    start_version = int(last_id) if last_id and str(last_id).isdigit() else state_version
+
+    def generate():
+        version = start_version
+        backlog = events_since(version) if version <= state_version else None
+        if backlog is None:
+            # Behind the replay buffer (or id from a previous process) → full snapshot first
+            snapshot = {'version': state_version, 'type': 'snapshot',
+                        'positions': [position_summary(s, p) for _ in each_account() for s, p in list(active_positions.items())]}
+            version = state_version
+            yield f"id: {version}\nevent: snapshot\ndata: {json.dumps(snapshot)}\n\n"
+            backlog = []
+        for event in backlog:
+            version = event['version']
+            yield f"id: {version}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+        deadline = time.monotonic() + EVENT_STREAM_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            with state_cond:
+                state_cond.wait_for(lambda: state_version > version, timeout=min(EVENT_HEARTBEAT, remaining))
+            pending = events_since(version) or []
+            if not pending:
+                yield ": heartbeat\n\n"
+                continue
+            for event in pending:
+                version = event['version']
+                yield f"id: {version}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@bp.route('/close/<symbol>', methods=['POST'])
 def manual_close(symbol):
     """Manually close a position"""
     symbol = symbol.upper().replace('-EQ', '')
@@ -1032,17 +4490,15 @@ def manual_close(symbol):
     pos = active_positions[symbol]
     
     # Cancel all orders
-    for oid in [pos.get('sl_order_id'), pos.get('tp_order_id'), pos.get('partial_order_id')]:
-        if oid:
-            cancel_order(oid)
+    cancel_position_orders(pos)
     
     # Market exit
     instrument_key = get_instrument_key(symbol)
     if not instrument_key:
         return jsonify({'error': 'Instrument key not found'}), 400
     
-    opposite_action = "SELL" if pos['action'] == "BUY" else "BUY"
-    remaining_qty = pos['filled_qty'] - (pos['partial_order_data']['quantity'] if pos.get('partial_filled') else 0)
+    opposite_action = pos.exit_action
+    remaining_qty = pos.remaining_qty
     
     exit_order = {
         "quantity": remaining_qty,
@@ -1054,36 +4510,56 @@ def manual_close(symbol):
         "transaction_type": opposite_action,
         "disclosed_quantity": 0,
         "trigger_price": 0,
-        "is_amo": False
+        "is_amo": False,
+        "tag": order_tag("X", pos.position_id)
     }
     
+    ref_price = book_last_price(symbol)
     result = place_order(exit_order, "MANUAL EXIT")
     
     if result["success"]:
-        del active_positions[symbol]
-        save_positions()
+        close_position_state(symbol, "MANUAL", record_exit_fill(symbol, "MANUAL", exit_order, result, ref_price))
         send_telegram_message(f"✅ <b>Manual Exit</b>\n\nSymbol: {symbol}\nQty: {remaining_qty}")
         return jsonify({'success': True, 'message': f'Position {symbol} closed'})
     else:
         return jsonify({'error': 'Exit order failed'}), 500
 
-@app.route('/close_all', methods=['POST'])
+@bp.route('/close_all', methods=['POST'])
 def close_all_positions():
-    """Emergency close all positions"""
+    """Emergency close all positions (every account unless ?account= is given)"""
+    closed = []
+    failed = []
+    targets = [current_account()] if request.args.get('account') else list(accounts.values())
+    
+    for account in targets:
+        with account_context(account):
+            closed_here, failed_here = close_account_positions()
+        closed.extend(closed_here)
+        failed.extend(failed_here)
+    
+    send_telegram_message(f"🚨 <b>Emergency Close All</b>\n\nClosed: {', '.join(closed)}\nFailed: {', '.join(failed)}")
+    
+    return jsonify({
+        'closed': closed,
+        'failed': failed,
+        'remaining_positions': sum(len(a['positions']) for a in targets)
+    })
+
+def close_account_positions():
+    """Cancel legs and market-exit every position of the current account → (closed, failed)"""
     closed = []
     failed = []
+    prefix = f"{account_label()}:" if account_label() else ""
     
     for symbol, pos in list(active_positions.items()):
         # Cancel all orders
-        for oid in [pos.get('sl_order_id'), pos.get('tp_order_id'), pos.get('partial_order_id')]:
-            if oid:
-                cancel_order(oid)
+        cancel_position_orders(pos)
         
         # Market exit
         instrument_key = get_instrument_key(symbol)
         if instrument_key:
-            opposite_action = "SELL" if pos['action'] == "BUY" else "BUY"
-            remaining_qty = pos['filled_qty'] - (pos['partial_order_data']['quantity'] if pos.get('partial_filled') else 0)
+            opposite_action = pos.exit_action
+            remaining_qty = pos.remaining_qty
             
             exit_order = {
                 "quantity": remaining_qty,
@@ -1095,24 +4571,20 @@ def close_all_positions():
                 "transaction_type": opposite_action,
                 "disclosed_quantity": 0,
                 "trigger_price": 0,
-                "is_amo": False
+                "is_amo": False,
+                "tag": order_tag("X", pos.position_id)
             }
             
+            ref_price = book_last_price(symbol)
             result = place_order(exit_order, f"EMERGENCY EXIT {symbol}")
             if result["success"]:
-                closed.append(symbol)
-                del active_positions[symbol]
+                closed.append(prefix + symbol)
+                close_position_state(symbol, "CLOSE_ALL", record_exit_fill(symbol, "CLOSE_ALL", exit_order, result, ref_price))
             else:
-                failed.append(symbol)
+                failed.append(prefix + symbol)
     
     save_positions()
-    send_telegram_message(f"🚨 <b>Emergency Close All</b>\n\nClosed: {', '.join(closed)}\nFailed: {', '.join(failed)}")
-    
-    return jsonify({
-        'closed': closed,
-        'failed': failed,
-        'remaining_positions': len(active_positions)
-    })
+    return closed, failed
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # GRACEFUL SHUTDOWN
@@ -1121,21 +4593,126 @@ def graceful_shutdown(signum, frame):
     """Handle shutdown gracefully - cancel all pending orders"""
     logger.info("🛑 Shutting down... Cancelling all pending orders")
     
-    for symbol, pos in active_positions.items():
-        for oid in [pos.get('sl_order_id'), pos.get('tp_order_id'), pos.get('partial_order_id')]:
-            if oid:
-                cancel_order(oid)
+    for account in each_account():
+        for symbol, pos in active_positions.items():
+            cancel_position_orders(pos)
     
     send_telegram_message("🛑 <b>Bot Shutting Down</b>\n\nAll pending orders cancelled.\nPositions remain open.")
     sys.exit(0)
 
-signal.signal(signal.SIGINT, graceful_shutdown)
-signal.signal(signal.SIGTERM, graceful_shutdown)
+# ═══════════════════════════════════════════════════════════════════════════════
+# APPLICATION FACTORY & LIFECYCLE
+# ═══════════════════════════════════════════════════════════════════════════════
+@bp.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe - 200 once every subsystem is warm, 503 otherwise"""
+    is_ready = all(readiness.values())
+    return jsonify({
+        'ready': is_ready,
+        'subsystems': readiness,
+        'token_valid': is_token_valid(),
+        'accounts': {a['name']: a['recovery_ready'].is_set() for a in accounts.values()}
+    }), 200 if is_ready else 503
+
+def init_state():
+    """Local-disk state only (accounts, positions, token vaults) - fast, no network"""
+    load_accounts()
+    for account in each_account():
+        load_positions()
+        book_seed_from_positions()
+        load_token_vault()
+    readiness['positions'] = True
+    readiness['token_vault'] = True
+    spool_load()
+
+def bootstrap_services():
+    """Background warm-up: instruments download, crash recovery (every account), then the monitor threads"""
+    # Instruments first - recovery emergency exits resolve symbols they could not match by order tag
+    load_instruments()
+    for account in each_account():
+        run_recovery()
+
+    Thread(target=token_expiry_monitor, daemon=True, name="token-monitor").start()
+    readiness['token_monitor'] = True
+    Thread(target=monitor_partial_fills, daemon=True, name="position-monitor").start()
+    readiness['position_monitor'] = True
+    Thread(target=reconcile_positions, daemon=True, name="reconciler").start()
+    readiness['reconciler'] = True
+    Thread(target=ledger_compactor, daemon=True, name="ledger-compactor").start()
+    if MARKET_DATA_SOURCE != "OFF":
+        Thread(target=market_data_feed, daemon=True, name="market-data").start()
+    readiness['market_data'] = True
+    Thread(target=trailing_stop_engine, daemon=True, name="trailing-stop").start()
+    readiness['trailing_stop'] = True
+    if MARGIN_SIZING != "OFF":
+        Thread(target=funds_monitor, daemon=True, name="funds").start()
+    readiness['funds'] = True
+    Thread(target=premarket_scheduler, daemon=True, name="premarket").start()
+    readiness['premarket'] = True
+    Thread(target=spool_worker, daemon=True, name="spool").start()
+    if SIGNAL_ENGINE_SOURCE in ("UPSTOX", "REPLAY", "MOCK"):
+        Thread(target=signal_engine, daemon=True, name="signal-engine").start()
+    readiness['signal_engine'] = True
+
+def start_background_services():
+    """Start network I/O + daemon threads once per process (safe after gunicorn fork)"""
+    global services_started
+    with services_lock:
+        if services_started:
+            return
+        services_started = True
+    instruments_loading.set()  # bootstrap downloads them first - early signals wait instead of failing
+    Thread(target=bootstrap_services, daemon=True, name="bootstrap").start()
+
+def register_signal_handlers():
+    """Graceful shutdown hooks (only possible from the main thread)"""
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGINT, graceful_shutdown)
+        signal.signal(signal.SIGTERM, graceful_shutdown)
+
+def validate_config():
+    """Check env settings that are only parsed later, so a bad value shows up in the startup log"""
+    warmup_clock()
+
+def create_app(start_services=True):
+    """
+    Build the Flask app.
+    Importing this module does no I/O; services start on the first request
+    (i.e. after the port is bound, inside the worker process) or explicitly
+    via start_background_services(). Under gunicorn, gunicorn.conf.py starts
+    them from post_worker_init so monitoring runs before any request arrives.
+    """
+    setup_logging()
+    validate_config()
+    flask_app = Flask(__name__)
+    flask_app.config['SECRET_KEY'] = 'ict-pro-bot-v7-4-production'
+    flask_app.register_blueprint(bp)
+
+    init_state()
+    register_signal_handlers()
+
+    if start_services:
+        flask_app.before_request(start_background_services)
+    return flask_app
+
+_app = None
+
+def __getattr__(name):
+    """Keep `gunicorn app:app` working - build the app on first access"""
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # START APPLICATION
 # ═══════════════════════════════════════════════════════════════════════════════
 if __name__ == '__main__':
+    app = create_app()
+    start_background_services()
+
     startup_msg = f"""
 🤖 <b>ICT PRO BOT V7.4 STARTED</b> 🤖
 ━━━━━━━━━━━━━━━━━━━━━
@@ -1143,7 +4720,8 @@ if __name__ == '__main__':
 📅 {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}
 🔑 Token: {'✅ Valid' if is_token_valid() else '❌ Login Required'}
 📈 Market: {'✅ Open' if is_market_open() else '❌ Closed'}
-🎯 Active Positions: {len(active_positions)}
+🎯 Active Positions: {sum(len(a['positions']) for a in accounts.values())}
+👥 Accounts: {len(accounts)}
 
 <b>Features Enabled:</b>
 ✅ Order Fill Verification
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+ICT PRO BOT - OFFLINE BACKTEST ENGINE
+Replays recorded webhook signals over OHLCV candles with the bot's own bracket:
+MARKET entry → PARTIAL TP (LIMIT) + FULL TP (LIMIT) + SL-M, SL resized after partial,
+reversal = square off on the next signal for the same symbol, intraday square-off.
+
+Usage:
+  python backtest.py --candles data/ --signals signals.jsonl --partial 0.5 0.3 --rr 2 3
+
+Candles: one <SYMBOL>.csv per symbol (timestamp,open,high,low,close[,volume]),
+timestamp as ISO-8601 (no offset = IST) or epoch seconds. Parsed files are cached as <SYMBOL>.npz.
+Signals: JSON lines of webhook payloads plus 'time'/'timestamp' (ISO or epoch s/ms).
+All times are held as IST wall-clock datetime64[s], so days and the square-off are NSE days.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+import numpy as np
+
+from app import IST, parse_signal, partial_quantity
+
+EXIT_END = 0   # reversal / intraday square-off / data end
+EXIT_SL = 1
+EXIT_TP = 2
+
+CANDLE_CACHE_VERSION = 2  # bump when parsing changes - older .npz caches are re-parsed
+IST_OFFSET = np.timedelta64(5 * 3600 + 30 * 60, "s")  # epoch (UTC) → IST wall clock
+EPOCH_TEXT = re.compile(r"\d+(\.\d*)?")
+ISO_ZONE = re.compile(r"(Z|[+-]\d\d:?\d\d)$")
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# DATA LOADING
+# ═══════════════════════════════════════════════════════════════════════════════
+def parse_stamp(value):
+    """One ISO-8601 string or epoch s/ms → IST wall-clock datetime64[s] (offsets converted)"""
+    text = str(value).strip()
+    if EPOCH_TEXT.fullmatch(text):
+        return to_datetime64(np.array([float(text)]))[0]
+    stamp = datetime.fromisoformat(text)
+    if stamp.tzinfo is not None:
+        stamp = stamp.astimezone(IST).replace(tzinfo=None)
+    return np.datetime64(stamp, "s")
+
+def to_datetime64(values):
+    """ISO strings or epoch seconds/ms → IST wall-clock datetime64[s] array"""
+    values = np.asarray(values)
+    if values.dtype.kind in "iuf":
+        seconds = values.astype(np.int64)
+        seconds = np.where(seconds > 10**11, seconds // 1000, seconds)  # ms → s
+        return seconds.astype("datetime64[s]") + IST_OFFSET
+    text = values.astype(str)
+    if not any(ISO_ZONE.search(v) or EPOCH_TEXT.fullmatch(v) for v in text):
+        try:
+            return text.astype("datetime64[s]")  # naive ISO - already IST
+        except ValueError:
+            pass
+    return np.array([parse_stamp(v) for v in text], dtype="datetime64[s]")
+
+def load_candles(path):
+    """Load one symbol's candles → dict of arrays (cached next to the csv as .npz)"""
+    cache = os.path.splitext(path)[0] + ".npz"
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        with np.load(cache) as data:
+            if "version" in data.files and int(data["version"]) == CANDLE_CACHE_VERSION:
+                return {k: data[k] for k in data.files if k != "version"}
+
+    raw = np.genfromtxt(path, delimiter=",", names=True, dtype=None, encoding="utf-8")
+    ts_col = raw.dtype.names[0]
+    candles = {
+        "ts": to_datetime64(raw[ts_col]),
+        "open": raw["open"].astype(np.float64),
+        "high": raw["high"].astype(np.float64),
+        "low": raw["low"].astype(np.float64),
+        "close": raw["close"].astype(np.float64)
+    }
+    order = np.argsort(candles["ts"], kind="stable")
+    candles = {k: v[order] for k, v in candles.items()}
+    np.savez_compressed(cache, version=CANDLE_CACHE_VERSION, **candles)
+    return candles
+
+def load_candle_dir(directory):
+    """{SYMBOL: candles} for every csv in a directory"""
+    book = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(".csv"):
+            symbol = os.path.splitext(name)[0].replace("-EQ", "").upper()
+            book[symbol] = load_candles(os.path.join(directory, name))
+    return book
+
+def load_signals(path):
+    """Recorded webhook payloads → {SYMBOL: [signal, ...]} sorted by time"""
+    by_symbol = {}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            sig = parse_signal(data)
+            if sig["action"] not in ["BUY", "SELL"]:
+                continue
+            stamp = data.get("time", data.get("timestamp"))
+            if stamp is None:
+                continue
+            sig["ts"] = to_datetime64([stamp])[0]
+            by_symbol.setdefault(sig["symbol"], []).append(sig)
+    for signals in by_symbol.values():
+        signals.sort(key=lambda s: s["ts"])
+    return by_symbol
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BRACKET SIMULATION (vectorised over bars × parameter sets)
+# ═══════════════════════════════════════════════════════════════════════════════
+def first_hit(mask, n):
+    """Index of first True along the last axis, n if never"""
+    return np.where(mask.any(axis=-1), mask.argmax(axis=-1), n)
+
+def session_end_index(ts, i, squareoff_seconds):
+    """First bar index ≥ intraday square-off time (or next day) for a trade entered at bar i - ts is IST wall clock"""
+    day = ts[i].astype("datetime64[D]")
+    next_day = np.searchsorted(ts, (day + np.timedelta64(1, "D")).astype("datetime64[s]"), "left")
+    cutoff = np.searchsorted(ts, day.astype("datetime64[s]") + np.timedelta64(squareoff_seconds, "s"), "left")
+    return min(next_day, cutoff), cutoff < next_day
+
+def simulate_trade(candles, i, end, end_price, sig, params):
+    """
+    One entry at bar i, horizon [i, end). Returns (pnl, r_multiple, exit_reason) arrays over params.
+    Conservative fills: SL wins any bar where SL and a TP both trade; gaps fill at the open.
+    """
+    o = candles["open"][i:end]
+    h = candles["high"][i:end]
+    l = candles["low"][i:end]
+    n = end - i
+    entry = o[0]
+    d = 1.0 if sig["action"] == "BUY" else -1.0
+    qty = sig["qty"]
+    sl = sig["sl"]
+    risk = abs(entry - sl) if sl else 0.0
+
+    fraction = params["partial"]
+    tp = np.where(np.isnan(params["rr"]), sig["tp"], entry + d * params["rr"] * risk)
+    ptp = np.where(np.isnan(params["partial_rr"]), sig["partial_tp"], entry + d * params["partial_rr"] * risk)
+    pqty = np.array([partial_quantity(qty, p, f) for p, f in zip(ptp, fraction)], dtype=np.float64)
+
+    if d > 0:
+        i_sl = first_hit(l <= sl, n) if sl else n
+        i_tp = np.where(tp > 0, first_hit(h[None, :] >= tp[:, None], n), n)
+        i_p = np.where(pqty > 0, first_hit(h[None, :] >= ptp[:, None], n), n)
+    else:
+        i_sl = first_hit(h >= sl, n) if sl else n
+        i_tp = np.where(tp > 0, first_hit(l[None, :] <= tp[:, None], n), n)
+        i_p = np.where(pqty > 0, first_hit(l[None, :] <= ptp[:, None], n), n)
+
+    o_pad = np.append(o, end_price)
+
+    def limit_fill(level, idx):
+        gap = o_pad[idx]
+        return np.maximum(gap, level) if d > 0 else np.minimum(gap, level)
+
+    def stop_fill(idx):
+        gap = o_pad[idx]
+        return np.minimum(gap, sl) if d > 0 else np.maximum(gap, sl)
+
+    # Partial TP fills only if it trades strictly before the SL
+    part_filled = (pqty > 0) & (i_p < i_sl) & (i_p < n)
+    part_pnl = np.where(part_filled, pqty * d * (limit_fill(ptp, np.minimum(i_p, n)) - entry), 0.0)
+    rem_qty = qty - np.where(part_filled, pqty, 0.0)
+
+    # Remaining qty: TP vs (resized) SL, SL on ties, else horizon end
+    tp_first = i_tp < i_sl
+    exit_idx = np.where(tp_first, i_tp, i_sl)
+    exit_price = np.where(
+        exit_idx >= n, end_price,
+        np.where(tp_first, limit_fill(tp, np.minimum(exit_idx, n)), stop_fill(np.minimum(exit_idx, n)))
+    )
+    reason = np.where(exit_idx >= n, EXIT_END, np.where(tp_first, EXIT_TP, EXIT_SL))
+
+    pnl = part_pnl + rem_qty * d * (exit_price - entry)
+    r_mult = pnl / (qty * risk) if risk else np.zeros_like(pnl)
+    return pnl, r_mult, reason
+
+def run_backtest(candle_book, signal_book, params, squareoff="15:20"):
+    """
+    Simulate every signal for every parameter set.
+    Returns (entry_ts, symbol, pnl[P, T], r[P, T], reason[P, T]).
+    """
+    hh, mm = [int(x) for x in squareoff.split(":")]
+    squareoff_seconds = hh * 3600 + mm * 60
+    entries, symbols, pnls, rs, reasons = [], [], [], [], []
+
+    for symbol, signals in signal_book.items():
+        candles = candle_book.get(symbol)
+        if candles is None or not len(candles["ts"]):
+            continue
+        ts = candles["ts"]
+        entry_idx = np.searchsorted(ts, np.array([s["ts"] for s in signals]), "left")
+
+        for k, sig in enumerate(signals):
+            i = entry_idx[k]
+            if i >= len(ts):
+                continue
+            end, at_cutoff = session_end_index(ts, i, squareoff_seconds)
+            end_price = candles["open"][end] if at_cutoff else candles["close"][end - 1]
+
+            # Reversal: the next signal for this symbol squares off at its entry bar
+            if k + 1 < len(signals) and entry_idx[k + 1] < end:
+                end = entry_idx[k + 1]
+                end_price = candles["open"][end]
+            if end <= i:
+                continue
+
+            pnl, r_mult, reason = simulate_trade(candles, i, end, end_price, sig, params)
+            entries.append(ts[i])
+            symbols.append(symbol)
+            pnls.append(pnl)
+            rs.append(r_mult)
+            reasons.append(reason)
+
+    if not entries:
+        empty = np.zeros((len(params["partial"]), 0))
+        return np.array([], dtype="datetime64[s]"), [], empty, empty, empty.astype(int)
+
+    order = np.argsort(np.array(entries), kind="stable")
+    return (
+        np.array(entries)[order],
+        [symbols[j] for j in order],
+        np.stack(pnls, axis=1)[:, order],
+        np.stack(rs, axis=1)[:, order],
+        np.stack(reasons, axis=1)[:, order]
+    )
+
+def build_params(partials, rrs, partial_rrs):
+    """Cartesian grid → dict of equal-length arrays (nan = use signal's own level)"""
+    grid = list(itertools.product(partials, rrs or [None], partial_rrs or [None]))
+    return {
+        "partial": np.array([g[0] for g in grid], dtype=np.float64),
+        "rr": np.array([np.nan if g[1] is None else g[1] for g in grid], dtype=np.float64),
+        "partial_rr": np.array([np.nan if g[2] is None else g[2] for g in grid], dtype=np.float64)
+    }
+
+def summarize(params, pnl, r_mult, reason):
+    """Per-parameter-set stats"""
+    rows = []
+    equity = np.cumsum(pnl, axis=1)
+    drawdown = (np.maximum.accumulate(equity, axis=1) - equity).max(axis=1) if pnl.shape[1] else np.zeros(len(pnl))
+    trades = pnl.shape[1]
+    for p in range(len(params["partial"])):
+        rows.append({
+            "partial": float(params["partial"][p]),
+            "rr": None if np.isnan(params["rr"][p]) else float(params["rr"][p]),
+            "partial_rr": None if np.isnan(params["partial_rr"][p]) else float(params["partial_rr"][p]),
+            "trades": trades,
+            "win_rate": round(float((pnl[p] > 0).mean() * 100), 2) if trades else 0.0,
+            "total_pnl": round(float(pnl[p].sum()), 2),
+            "avg_r": round(float(r_mult[p].mean()), 3) if trades else 0.0,
+            "max_drawdown": round(float(drawdown[p]), 2),
+            "tp_exits": int((reason[p] == EXIT_TP).sum()),
+            "sl_exits": int((reason[p] == EXIT_SL).sum()),
+            "end_exits": int((reason[p] == EXIT_END).sum())
+        })
+    return rows
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CLI
+# ═══════════════════════════════════════════════════════════════════════════════
+def main():
+    parser = argparse.ArgumentParser(description="Backtest the bot's bracket logic over candles")
+    parser.add_argument("--candles", required=True, help="directory of <SYMBOL>.csv candle files")
+    parser.add_argument("--signals", required=True, help="JSON lines of recorded webhook payloads")
+    parser.add_argument("--partial", type=float, nargs="+", default=[0.5], help="partial TP fractions")
+    parser.add_argument("--rr", type=float, nargs="*", help="full TP at RR multiple (default: signal tp)")
+    parser.add_argument("--partial-rr", type=float, nargs="*", help="partial TP at RR multiple (default: signal partial_tp)")
+    parser.add_argument("--squareoff", default="15:20", help="intraday square-off time HH:MM")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    started = time.time()
+    candle_book = load_candle_dir(args.candles)
+    signal_book = load_signals(args.signals)
+    loaded = time.time()
+
+    params = build_params(args.partial, args.rr, args.partial_rr)
+    _, _, pnl, r_mult, reason = run_backtest(candle_book, signal_book, params, args.squareoff)
+    rows = summarize(params, pnl, r_mult, reason)
+    finished = time.time()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'partial':>8} {'rr':>6} {'p_rr':>6} {'trades':>7} {'win%':>7} {'pnl':>12} {'avgR':>7} {'maxDD':>10}")
+        for row in rows:
+            rr = "sig" if row["rr"] is None else f"{row['rr']:.2f}"
+            prr = "sig" if row["partial_rr"] is None else f"{row['partial_rr']:.2f}"
+            print(f"{row['partial']:>8.2f} {rr:>6} {prr:>6} {row['trades']:>7} {row['win_rate']:>7.2f} "
+                  f"{row['total_pnl']:>12.2f} {row['avg_r']:>7.3f} {row['max_drawdown']:>10.2f}")
+        print(f"\n⏱ load {loaded - started:.2f}s | simulate {finished - loaded:.2f}s | "
+              f"{len(candle_book)} symbols | {len(params['partial'])} parameter sets")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+ICT PRO BOT - MICROBENCHMARKS
+Times the pure hot-path functions of app.py - no network, no broker:
+safe_float, format_buy_alert / format_sell_alert, get_instrument_key (and option strike
+selection) on a full-size instrument index, save_positions / load_positions with
+10/100/1000 positions, is_market_open and webhook payload parsing.
+
+Usage:
+  python bench.py --save                  # run + store the results as this machine's baseline
+  python bench.py                         # run + compare against bench_baseline.json
+  python bench.py --filter positions --threshold 15
+
+Each benchmark reports the best of --repeat runs in µs per call plus its spread
+(median - best), the jitter across its repeats. Compare mode flags (and exits 1 on) every
+benchmark slower than its baseline by more than --threshold % and by more than
+--noise × the larger spread of the two runs (never less than --min-delta µs), and still
+is after --recheck fresh measurements - a busy host slows whole runs, not single calls.
+Baselines are machine-specific and not committed - save one before changing code.
+Log records are formatted to os.devnull, so logging cost stays in the numbers.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+import timeit
+from datetime import datetime
+
+import numpy as np
+
+import app
+from app import (Position, OrderLeg, safe_float, format_buy_alert, format_sell_alert, get_instrument_key,
+                 select_option, save_positions, load_positions, is_market_open, parse_signal)
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+POSITION_COUNTS = (10, 100, 1000)
+EQUITY_COUNT = 9000        # NSE equity rows in the instrument master (≈ full size)
+OPTION_UNDERLYINGS = 200   # F&O underlyings
+OPTION_EXPIRIES = 4
+OPTION_STRIKES = 40        # per expiry and side → 64k contracts
+
+SAMPLE_SIGNAL = {
+    'action': 'BUY',
+    'symbol': 'RELIANCE-EQ',
+    'price': 2980.50,
+    'sl': 2950.00,
+    'tp': 3100.00,
+    'partial_tp': 3040.25,
+    'qty': 10,
+    'risk': 305.00,
+    'rr': 3.93,
+    'regime': 'TRENDING',
+    'confluence': 12,
+    'killzone': 'NSE/BSE Session'
+}
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# FIXTURES
+# ═══════════════════════════════════════════════════════════════════════════════
+def quiet_logging():
+    """Keep formatting + emitting log records, but into os.devnull"""
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    app.logger.handlers = [handler]
+    app.logger.setLevel(logging.INFO)
+    app.logger.propagate = False
+
+def build_instrument_index():
+    """Synthetic instrument master of production size → equity + option chain indexes"""
+    loaded = {}
+    for i in range(EQUITY_COUNT):
+        symbol = "RELIANCE" if i == 0 else f"SYM{i:05d}"
+        loaded[f"{symbol}-EQ"] = f"NSE_EQ|INE{i:09d}"
+        loaded[symbol] = f"NSE_EQ|INE{i:09d}"
+    app.instruments_dict = loaded
+
+    today = np.datetime64(datetime.now(app.IST).date(), 'D')
+    options = []
+    for u in range(OPTION_UNDERLYINGS):
+        underlying = "NIFTY" if u == 0 else f"SYM{u:05d}"
+        for e in range(OPTION_EXPIRIES):
+            expiry = str(today + 7 * e + 1)
+            for k in range(OPTION_STRIKES):
+                strike = 24000 + 50 * k if u == 0 else 100 + 10 * k
+                for option_type in ('CE', 'PE'):
+                    key = f"NSE_FO|{u}{e}{k}{option_type}"
+                    options.append((key, {
+                        'segment': 'NSE_FO', 'instrument_type': option_type, 'underlying_symbol': underlying,
+                        'expiry': expiry, 'strike_price': strike, 'lot_size': 75,
+                        'trading_symbol': f"{underlying} {strike} {option_type} {expiry}"
+                    }))
+    app.build_option_chains(options)
+    app.instruments_ready.set()
+
+def make_positions(count):
+    """count open LEGS-mode positions with every leg populated"""
+    positions = {}
+    for i in range(count):
+        symbol = f"SYM{i:05d}"
+        token = f"NSE_EQ|INE{i:09d}"
+        leg = lambda order_type, side, qty, price=0.0, trigger=0.0, tag="E": OrderLeg(
+            f"2501{i:08d}{tag}", qty, price, trigger, order_type, side, token, f"ict-{tag}-{i}",
+            sent_at=time.time(), acked_at=time.time())
+        positions[symbol] = Position(
+            symbol, "BUY", position_id=f"p{i:06d}", qty_requested=10, filled_qty=10, entry_price=2980.5,
+            entry=leg("MARKET", "BUY", 10), sl=leg("SL-M", "SELL", 10, trigger=2950.0, tag="S"),
+            tp=leg("LIMIT", "SELL", 5, price=3100.0, tag="T"), partial=leg("LIMIT", "SELL", 5, price=3040.25, tag="P"),
+            signal=app.signal_metadata(SAMPLE_SIGNAL))
+    return positions
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BENCHMARKS
+# ═══════════════════════════════════════════════════════════════════════════════
+def build_benchmarks(workdir):
+    """name → zero-arg callable"""
+    account = app.current_account()
+    account['positions_file'] = os.path.join(workdir, "positions.json")
+    sell_signal = dict(SAMPLE_SIGNAL, action='SELL', sl=3010.0, tp=2860.0, partial_tp=2920.25)
+    raw_payload = json.dumps(SAMPLE_SIGNAL).encode()
+    option_symbol = f"NIFTY 24500 CE {np.datetime64(datetime.now(app.IST).date(), 'D') + 1}"
+
+    benchmarks = {
+        'safe_float[float]': lambda: safe_float(2980.5),
+        'safe_float[str]': lambda: safe_float("2980.50"),
+        'safe_float[bad]': lambda: safe_float("N/A"),
+        'safe_float[None]': lambda: safe_float(None),
+        'format_buy_alert': lambda: format_buy_alert(SAMPLE_SIGNAL),
+        'format_sell_alert': lambda: format_sell_alert(sell_signal),
+        'get_instrument_key[exact]': lambda: get_instrument_key("RELIANCE"),
+        'get_instrument_key[nse_prefix]': lambda: get_instrument_key("nse:sym04500-eq"),
+        'get_instrument_key[option]': lambda: get_instrument_key(option_symbol),
+        'get_instrument_key[miss]': lambda: get_instrument_key("NOSUCHSYMBOL"),
+        'select_option[atm]': lambda: select_option("NIFTY", "BUY", 24512.0),
+        'select_option[otm2]': lambda: select_option("NIFTY", "SELL", 24512.0, 2),
+        'is_market_open': is_market_open,
+        'webhook_parse': lambda: parse_signal(json.loads(raw_payload)),
+    }
+
+    for count in POSITION_COUNTS:
+        positions = make_positions(count)
+
+        def save(positions=positions):
+            account['positions'] = positions
+            save_positions()
+
+        benchmarks[f'save_positions[{count}]'] = save
+        benchmarks[f'load_positions[{count}]'] = load_positions
+    return benchmarks
+
+def measure(func, repeat):
+    """Repeat runs → (best µs per call, spread = median - best) - autorange picks the calls per run"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = np.array(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+    best = float(runs.min())
+    return best, float(np.median(runs)) - best
+
+def measure_named(benchmarks, name, repeat):
+    """measure() one benchmark by name"""
+    if name.startswith('load_positions'):
+        # load reads the file its save twin wrote - rewrite it first so sizes match the name
+        save_twin = benchmarks[name.replace('load', 'save')]
+        save_twin()
+    return measure(benchmarks[name], repeat)
+
+def run(benchmarks, repeat, name_filter=None):
+    """name → (µs per call, spread µs)"""
+    return {name: measure_named(benchmarks, name, repeat)
+            for name in benchmarks if not name_filter or name_filter in name}
+
+def recheck(benchmarks, results, baseline, args):
+    """Re-measure flagged benchmarks, keeping the best run - a slowdown must survive every recheck.
+    Noisy hosts slow a whole process down for seconds, which no in-run spread can see."""
+    for _ in range(args.recheck):
+        flagged = [row[0] for row in compare(results, baseline, args.threshold, args.noise, args.min_delta) if row[4]]
+        if not flagged:
+            break
+        for name in flagged:
+            results[name] = min(results[name], measure_named(benchmarks, name, args.repeat))
+    return results
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BASELINE
+# ═══════════════════════════════════════════════════════════════════════════════
+def load_baseline(path):
+    """Stored baseline document or None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_baseline(path, results):
+    """Store results with enough context to know when they no longer apply"""
+    doc = {
+        'saved_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': f"{platform.system()} {platform.machine()}",
+        'results': {name: round(us, 4) for name, (us, _) in results.items()},
+        'spread': {name: round(spread, 4) for name, (_, spread) in results.items()}
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2)
+        f.write("\n")
+
+def compare(results, baseline, threshold, noise=2.0, min_delta=0.0):
+    """Rows of (name, µs, baseline µs or None, delta % or None, regressed)"""
+    rows = []
+    stored = (baseline or {}).get('results', {})
+    stored_spread = (baseline or {}).get('spread', {})
+    for name, (us, spread) in results.items():
+        base = stored.get(name)
+        delta = (us / base - 1) * 100 if base else None
+        # A slowdown inside the jitter either run measured is noise, not a regression
+        tolerance = max(min_delta, noise * max(spread, stored_spread.get(name, 0.0)))
+        regressed = delta is not None and delta > threshold and us - base > tolerance
+        rows.append((name, us, base, delta, regressed))
+    return rows
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CLI
+# ═══════════════════════════════════════════════════════════════════════════════
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for app.py hot paths")
+    parser.add_argument("--save", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=20.0, help="regression threshold in %% over baseline")
+    parser.add_argument("--noise", type=float, default=2.0, help="ignore slowdowns within this many spreads (median - best)")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="ignore slowdowns smaller than this many µs")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark (best is kept)")
+    parser.add_argument("--recheck", type=int, default=3, help="re-measure flagged benchmarks up to this many times")
+    parser.add_argument("--filter", help="only benchmarks whose name contains this")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    quiet_logging()
+    build_instrument_index()
+    baseline = load_baseline(args.baseline)
+    with tempfile.TemporaryDirectory() as workdir:
+        benchmarks = build_benchmarks(workdir)
+        results = run(benchmarks, args.repeat, args.filter)
+        if baseline and not args.save:
+            results = recheck(benchmarks, results, baseline, args)
+
+    rows = compare(results, baseline, args.threshold, args.noise, args.min_delta)
+    regressions = [row[0] for row in rows if row[4]]
+
+    if args.json:
+        print(json.dumps({'results': {name: us for name, (us, _) in results.items()},
+                          'spread': {name: spread for name, (_, spread) in results.items()}, 'regressions': regressions,
+                          'baseline': baseline and {k: v for k, v in baseline.items() if k not in ('results', 'spread')}}, indent=2))
+    else:
+        print(f"{'benchmark':<32} {'µs/call':>12} {'spread':>9} {'baseline':>12} {'delta':>9}")
+        for name, us, base, delta, regressed in rows:
+            base_text = f"{base:>12.3f}" if base else f"{'-':>12}"
+            delta_text = f"{delta:>+8.1f}%" if delta is not None else f"{'-':>9}"
+            print(f"{name:<32} {us:>12.3f} {results[name][1]:>9.3f} {base_text} {delta_text}"
+                  f"{'  ⚠️ REGRESSION' if regressed else ''}")
+        if baseline:
+            print(f"\n📏 baseline {baseline.get('saved_at')} | Python {baseline.get('python')} | "
+                  f"{baseline.get('machine')} | threshold {args.threshold:.0f}% + {args.noise:g}× spread")
+        else:
+            print(f"\n📏 no baseline at {args.baseline} - run with --save to store one")
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f"💾 baseline saved: {args.baseline}")
+    elif regressions:
+        print(f"❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+# Picked up automatically by `gunicorn app:app` (run from the repo root)
+
+# One process: positions, spool and monitors are in-process state - a second worker would trade twice.
+workers = 1
+# Threads, not the default sync worker: /events streams and webhooks must not queue behind each other,
+# and a long request must not trip the sync worker timeout (which kills the monitor threads with it).
+worker_class = "gthread"
+threads = 16
+
+def post_worker_init(worker):
+    """Start monitors, reconciler and recovery in each worker right after fork - not on its first request"""
+    import app
+    app.start_background_services()
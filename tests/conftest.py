@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def account(tmp_path, monkeypatch):
+    """Primary account with empty state, every file under tmp_path, Telegram captured"""
+    monkeypatch.chdir(tmp_path)
+    acc = app.accounts[app.PRIMARY_ACCOUNT]
+    monkeypatch.setitem(acc, 'positions', {})
+    monkeypatch.setitem(acc, 'positions_file', str(tmp_path / "positions.json"))
+    monkeypatch.setattr(app, 'ledger_cache', {})
+    sent = []
+    monkeypatch.setattr(app, 'send_telegram_message', lambda message, *args, **kwargs: sent.append(message) or True)
+    acc['telegram'] = sent
+    yield acc
+    acc.pop('telegram', None)
+
+
+def make_position(symbol="ABC", qty=10, action="BUY", sl_order="S1", sl_trigger=95.0):
+    """Open LEGS-mode position with an entry and a live SL-M"""
+    exit_side = "SELL" if action == "BUY" else "BUY"
+    entry = app.OrderLeg("E1", qty, 0, 0, "MARKET", action, "NSE_EQ|ABC", "E-p1")
+    sl = app.OrderLeg(sl_order, qty, 0, sl_trigger, "SL-M", exit_side, "NSE_EQ|ABC", "S-p1")
+    return app.Position(symbol, action, position_id="p1", qty_requested=qty, filled_qty=qty,
+                        entry_price=100.0, entry=entry, sl=sl)
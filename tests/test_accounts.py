@@ -0,0 +1,50 @@
+import json
+
+import pytest
+from flask import Flask
+
+import app
+from conftest import make_position
+
+
+@pytest.fixture
+def second(monkeypatch):
+    acc = app.new_account("second", "key", "secret")
+    monkeypatch.setitem(app.accounts, "second", acc)
+    return acc
+
+
+def test_each_account_restores_context_after_leaving_early(account, second):
+    for acc in app.each_account():
+        if acc is second:
+            assert app.current_account() is second
+            break
+    assert app.current_account() is account
+
+
+def test_market_data_account_does_not_leak_context(account, second, monkeypatch):
+    monkeypatch.setattr(app, 'is_token_valid', lambda: app.current_account() is second)
+    assert app.market_data_account() is second
+    assert app.current_account() is account
+
+
+def test_request_account_is_unbound_after_the_request(account, second):
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(app.bp)
+    with flask_app.test_client() as client:
+        response = client.get('/positions?account=second')
+        assert response.get_json()['account'] == "second"
+        assert app.account_local.account is None
+        assert client.get('/positions?account=nobody').status_code == 404
+        assert client.get('/positions').get_json()['account'] == account['name']
+
+
+def test_failed_save_keeps_the_previous_file(account):
+    account['positions']['ABC'] = make_position()
+    app.save_positions()
+    account['positions']['XYZ'] = make_position("XYZ")
+    account['positions']['XYZ'].signal = {'bad': object()}  # not JSON-serialisable
+    app.save_positions()
+
+    with open(account['positions_file']) as f:
+        assert list(json.load(f)['positions']) == ['ABC']
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+import app
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    """Fresh admission state: one execution slot, one queue place, short queue wait"""
+    state = {'cond': threading.Condition(), 'inflight': 0, 'queued': 0, 'priority_inflight': 0, 'admitted': 0,
+             'priority': 0, 'shed_queue_full': 0, 'shed_timeout': 0, 'avg_seconds': 1.0}
+    monkeypatch.setattr(app, 'admission', state)
+    monkeypatch.setattr(app, 'WEBHOOK_MAX_INFLIGHT', 1)
+    monkeypatch.setattr(app, 'WEBHOOK_MAX_QUEUE', 1)
+    monkeypatch.setattr(app, 'WEBHOOK_QUEUE_TIMEOUT', 0.05)
+    return state
+
+
+def test_waiting_entry_is_shed_with_503_after_the_queue_timeout(admission):
+    assert app.admit_signal(False) is None
+    result, status, retry_after = app.admit_signal(False)
+    assert status == 503 and retry_after >= 1
+    assert admission['shed_timeout'] == 1 and admission['queued'] == 0
+
+
+def test_full_queue_sheds_with_429(admission):
+    admission['inflight'] = 1
+    admission['queued'] = 1
+    result, status, _ = app.admit_signal(False)
+    assert status == 429 and admission['shed_queue_full'] == 1
+
+
+def test_priority_signals_bypass_a_full_budget(admission):
+    admission['inflight'] = 1
+    admission['queued'] = 1
+    assert app.admit_signal(True) is None
+    app.release_signal(True, 0.1)
+    assert admission['priority'] == 1 and admission['priority_inflight'] == 0
+
+
+def test_released_slot_admits_the_queued_entry(admission, monkeypatch):
+    monkeypatch.setattr(app, 'WEBHOOK_QUEUE_TIMEOUT', 5)
+    assert app.admit_signal(False) is None
+    outcome = []
+    waiter = threading.Thread(target=lambda: outcome.append(app.admit_signal(False)))
+    waiter.start()
+    while not admission['queued']:
+        time.sleep(0.001)
+    app.release_signal(False, 2.0)
+    waiter.join(2)
+    assert outcome == [None] and admission['inflight'] == 1 and admission['admitted'] == 2
+    assert admission['avg_seconds'] == pytest.approx(1.2)
+
+
+def test_retry_after_scales_with_backlog(admission, monkeypatch):
+    monkeypatch.setattr(app, 'WEBHOOK_MAX_INFLIGHT', 2)
+    admission['avg_seconds'] = 4.0
+    admission['queued'] = 3
+    assert app.retry_after_seconds() == 8
+
+
+def test_webhook_sheds_with_retry_after_header(account, admission):
+    admission['inflight'] = 1
+    admission['queued'] = 1
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(app.bp)
+    response = flask_app.test_client().post('/webhook', json={'action': 'BUY', 'symbol': 'ABC', 'price': 100})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_rate_budget_sleeps_once_the_bucket_is_empty(account, monkeypatch):
+    slept = []
+    monkeypatch.setattr(app.time, 'sleep', slept.append)
+    monkeypatch.setitem(account, 'rate', {'tokens': 1.0, 'updated': time.monotonic(), 'lock': threading.Lock()})
+    monkeypatch.setattr(account['session'], 'request', lambda method, url, **kwargs: "ok")
+
+    assert app.broker_request("GET", "https://example.invalid") == "ok"
+    assert slept == []
+    app.broker_request("GET", "https://example.invalid")
+    assert len(slept) == 1 and 0 < slept[0] <= 1 / app.ACCOUNT_RATE_LIMIT
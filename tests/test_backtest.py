@@ -0,0 +1,72 @@
+import numpy as np
+
+import app
+import backtest
+
+OPEN = np.datetime64("2024-01-02T09:15:00", "s")  # IST
+OPEN_EPOCH = 1704167100                             # same instant
+
+
+def bars(rows, start=OPEN):
+    """One-minute candles from (open, high, low, close) rows"""
+    o, h, l, c = (np.array(col, dtype=np.float64) for col in zip(*rows))
+    return {"ts": start + np.arange(len(rows)) * np.timedelta64(60, "s"), "open": o, "high": h, "low": l, "close": c}
+
+
+def signal(ts=OPEN, action="BUY", sl=95.0, tp=110.0, partial_tp=105.0, qty=10):
+    sig = app.parse_signal({'action': action, 'symbol': 'ABC', 'price': 100, 'sl': sl, 'tp': tp,
+                            'partial_tp': partial_tp, 'qty': qty})
+    sig["ts"] = ts
+    return sig
+
+
+def run(candles, signals, squareoff="15:20"):
+    params = backtest.build_params([0.5], None, None)
+    _, _, pnl, _, reason = backtest.run_backtest({"ABC": candles}, {"ABC": signals}, params, squareoff)
+    return pnl[0].tolist(), reason[0].tolist()
+
+
+def test_partial_then_full_tp():
+    candles = bars([(100, 101, 99, 100), (100, 106, 100, 105), (105, 111, 104, 110)])
+    assert run(candles, [signal()]) == ([5 * 5 + 5 * 10], [backtest.EXIT_TP])
+
+
+def test_sl_wins_a_bar_that_also_trades_the_tp():
+    candles = bars([(100, 101, 99, 100), (100, 111, 94, 100)])
+    assert run(candles, [signal()]) == ([10 * -5], [backtest.EXIT_SL])
+
+
+def test_gap_through_the_sl_fills_at_the_open():
+    candles = bars([(100, 101, 99, 100), (90, 92, 88, 91)])
+    assert run(candles, [signal()]) == ([10 * -10], [backtest.EXIT_SL])
+
+
+def test_partial_then_sl_and_sell_side():
+    candles = bars([(100, 101, 95, 96), (96, 106, 95, 104)])
+    pnl, reason = run(candles, [signal(action="SELL", sl=105.0, tp=90.0, partial_tp=95.0)])
+    assert pnl == [5 * 5 + 5 * -5] and reason == [backtest.EXIT_SL]
+
+
+def test_reversal_squares_off_at_the_next_signal():
+    candles = bars([(100, 101, 99, 100), (102, 103, 101, 102), (102, 103, 101, 102)])
+    pnl, reason = run(candles, [signal(), signal(ts=OPEN + np.timedelta64(60, "s"), action="SELL", sl=0, tp=0)])
+    assert pnl[0] == 10 * 2 and reason[0] == backtest.EXIT_END
+
+
+def test_epoch_candles_square_off_on_ist_time():
+    # 15:18 .. 15:22 IST given as epoch seconds - the 15:20 square-off must land on the third bar
+    start = OPEN_EPOCH + (6 * 3600 + 3 * 60)
+    raw = np.arange(5) * 60 + start
+    candles = bars([(100, 101, 99, 100), (100, 101, 99, 100), (103, 104, 102, 103), (50, 50, 50, 50), (50, 50, 50, 50)])
+    candles["ts"] = backtest.to_datetime64(raw)
+    assert str(candles["ts"][0]) == "2024-01-02T15:18:00"
+    pnl, reason = run(candles, [signal(ts=backtest.to_datetime64([start * 1000])[0], sl=0, tp=0)])
+    assert pnl == [10 * 3] and reason == [backtest.EXIT_END]
+
+
+def test_iso_offsets_are_converted_to_ist():
+    stamps = backtest.to_datetime64(["2024-01-02T09:15:00+05:30", "2024-01-02T03:45:00Z", "2024-01-02T03:45:00+0000",
+                                     "2024-01-02 09:15:00", str(OPEN_EPOCH)])
+    assert set(stamps.tolist()) == {OPEN.item()}
+    # UTC evening is already the next IST day
+    assert str(backtest.to_datetime64(["2024-01-01T20:00:00Z"])[0]) == "2024-01-02T01:30:00"
@@ -0,0 +1,22 @@
+import bench
+
+BASELINE = {'results': {'fast': 0.10, 'slow': 100.0}, 'spread': {'fast': 0.01, 'slow': 2.0}}
+
+
+def flagged(results, **kwargs):
+    return [row[0] for row in bench.compare(results, BASELINE, 20.0, **kwargs) if row[4]]
+
+
+def test_slowdown_inside_the_measured_spread_is_noise():
+    assert flagged({'fast': (0.13, 0.02), 'slow': (103.0, 1.0)}) == []
+    assert flagged({'fast': (0.13, 0.001), 'slow': (130.0, 20.0)}) == ['fast']
+
+
+def test_real_slowdowns_are_flagged():
+    assert flagged({'fast': (0.25, 0.02), 'slow': (150.0, 3.0)}) == ['fast', 'slow']
+    assert flagged({'fast': (0.25, 0.02)}, min_delta=0.5) == []
+
+
+def test_benchmarks_missing_from_the_baseline_are_not_flagged():
+    rows = bench.compare({'new': (1.0, 0.1)}, BASELINE, 20.0)
+    assert rows == [('new', 1.0, None, None, False)]
@@ -0,0 +1,55 @@
+from collections import deque
+
+import pytest
+from flask import Flask
+
+import app
+from conftest import make_position
+
+
+@pytest.fixture
+def client(account):
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(app.bp)
+    return flask_app.test_client()
+
+
+def test_events_since_returns_only_newer_events(monkeypatch):
+    monkeypatch.setattr(app, 'state_events', deque(maxlen=3))
+    start = app.state_version
+    for symbol in ("A", "B"):
+        app.publish_event('position_opened', symbol)
+    assert [e['symbol'] for e in app.events_since(start)] == ["A", "B"]
+    assert [e['symbol'] for e in app.events_since(start + 1)] == ["B"]
+    assert app.events_since(app.state_version) == []
+
+
+def test_events_since_reports_a_gap_past_the_buffer(monkeypatch):
+    monkeypatch.setattr(app, 'state_events', deque(maxlen=2))
+    start = app.state_version
+    for symbol in ("A", "B", "C"):
+        app.publish_event('position_opened', symbol)
+    assert app.events_since(start) is None  # A fell out - caller needs a snapshot
+    assert [e['symbol'] for e in app.events_since(start + 1)] == ["B", "C"]
+
+
+def test_positions_etag_answers_304_until_state_changes(account, client):
+    account['positions']['ABC'] = make_position()
+    first = client.get('/positions')
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and 'ABC' in first.get_json()['active_positions']
+    assert client.get('/positions', headers={'If-None-Match': etag}).status_code == 304
+
+    app.publish_event('position_closed', "ABC")
+    changed = client.get('/positions', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_event_stream_replays_backlog_and_ends(account, client, monkeypatch):
+    monkeypatch.setattr(app, 'EVENT_STREAM_SECONDS', 0.05)
+    monkeypatch.setattr(app, 'EVENT_HEARTBEAT', 0.01)
+    start = app.state_version
+    app.publish_event('position_opened', "ABC")
+    body = client.get(f'/events?since={start}').get_data(as_text=True)
+    assert f"id: {start + 1}\nevent: position_opened\n" in body
+    assert ": heartbeat" in body
@@ -0,0 +1,116 @@
+import threading
+
+import pytest
+from flask import Flask
+
+import app
+from conftest import make_position
+
+
+def report(group_by='leg'):
+    table = app.ledger_load(1, kind='executions')
+    return {row[group_by]: row for row in app.execution_report(table, group_by)}
+
+
+@pytest.fixture
+def broker(account, monkeypatch):
+    """Held ABC (10 @ 100, LTP 100); market exits fill at 99.5, new entries are rejected"""
+    placed = []
+
+    def place_order(data, label="", retry_count=0):
+        placed.append(data)
+        if app.parse_order_tag(data['tag'])[0] != "X":
+            return {"success": False, "error": "rejected"}
+        return {"success": True, "order_id": f"X{len(placed)}", "sent_at": 1.0, "acked_at": 1.2}
+
+    monkeypatch.setitem(account, 'recovery_ready', threading.Event())
+    account['recovery_ready'].set()
+    monkeypatch.setattr(app, 'get_instrument_key', lambda symbol: f"NSE_EQ|{symbol}")
+    monkeypatch.setattr(app, 'cancel_order', lambda order_id: True)
+    monkeypatch.setattr(app, 'place_order', place_order)
+    monkeypatch.setattr(app, 'wait_for_fill', lambda order_id, timeout: {
+        'status': 'complete', 'filled_quantity': 10, 'average_price': 99.5})
+    account['positions']['ABC'] = make_position()
+    app.book_open("ABC", "NSE_EQ|ABC", "BUY", 10, 100.0)
+    yield placed
+    app.book_close("ABC")
+
+
+def test_manual_and_close_all_exits_are_recorded(account, broker):
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(app.bp)
+    assert flask_app.test_client().post('/close/ABC').status_code == 200
+    account['positions']['XYZ'] = make_position("XYZ")
+    app.close_account_positions()
+
+    legs = report()
+    assert legs['MANUAL']['fills'] == 1 and legs['MANUAL']['qty'] == 10
+    assert legs['MANUAL']['slippage_rs'] == 5.0  # sold 10 at 99.5 against a 100 LTP
+    assert legs['CLOSE_ALL']['slippage_per_share'] is None  # XYZ never priced in the book
+    assert app.ledger_read(app.ledger_day())['pnl'].tolist()[0] == -5.0  # closed at the fill, not the LTP
+
+
+def test_reversal_exit_is_recorded(account, broker, monkeypatch):
+    monkeypatch.setattr(app, 'size_for_margin', lambda symbol, qty, price: (qty, None))
+    monkeypatch.setattr(app, 'check_risk_limits', lambda symbol, qty, price: (True, None))
+    signal = app.parse_signal({'action': 'SELL', 'symbol': 'ABC', 'price': 100, 'qty': 10})
+    app.execute_signal({'action': 'SELL', 'symbol': 'ABC'}, signal, announce=False, position_id="p2")
+
+    assert "ABC" not in account['positions']
+    row = report()['REVERSAL']
+    assert row['fills'] == 1 and row['slippage_rs'] == 5.0
+    assert row['latency_ms']['send_to_ack']['p50'] == 200.0
+    assert report('position_id')['p1']['fills'] == 1
+
+
+def test_failed_reversal_exit_keeps_the_position_and_skips_the_entry(account, broker, monkeypatch):
+    monkeypatch.setattr(app, 'size_for_margin', lambda symbol, qty, price: (qty, None))
+    monkeypatch.setattr(app, 'check_risk_limits', lambda symbol, qty, price: (True, None))
+    monkeypatch.setattr(app, 'place_order', lambda data, label="", retry_count=0: broker.append(data) or
+                        {"success": False, "error": "rejected"})
+    signal = app.parse_signal({'action': 'SELL', 'symbol': 'ABC', 'price': 100, 'qty': 10})
+    result, status = app.execute_signal({'action': 'SELL', 'symbol': 'ABC'}, signal, announce=False)
+
+    assert status == 500 and "ABC" in account['positions']
+    assert len(broker) == 1  # only the exit was tried
+    assert "REVERSAL EXIT FAILED" in account['telegram'][-1]
+
+
+def test_gtt_exits_are_recorded_at_the_order_the_rule_placed(account, monkeypatch):
+    def group(order_id, qty, target):
+        return app.OrderLeg(order_id, qty, 0, 0, "MARKET", "BUY", "NSE_EQ|ABC", rules=[
+            {"strategy": "ENTRY"}, {"strategy": "TARGET", "trigger_price": target},
+            {"strategy": "STOPLOSS", "trigger_price": 95.0}])
+
+    def fired(strategy, order_id):
+        rules = [{'strategy': 'ENTRY', 'status': 'TRIGGERED'},
+                 {'strategy': strategy, 'status': 'TRIGGERED', 'order_id': order_id}]
+        return {'rules': rules}
+
+    monkeypatch.setattr(app, 'get_order_details', lambda order_id: {
+        'O-P': {'status': 'complete', 'filled_quantity': 5, 'average_price': 104.8}}.get(order_id))
+    pos = app.Position("ABC", "BUY", position_id="p1", bracket_mode="GTT", filled_qty=10, entry_price=100.0,
+                       entry=group("G1", 5, 110.0), partial=group("G2", 5, 105.0))
+    account['positions']['ABC'] = pos
+    app.book_open("ABC", "NSE_EQ|ABC", "BUY", 10, 100.0)
+
+    app.check_gtt_position("ABC", pos, {'G2': fired('TARGET', 'O-P'), 'G1': fired('STOPLOSS', 'O-S')})
+
+    legs = report()
+    assert legs['PARTIAL']['slippage_rs'] == pytest.approx(1.0)  # 5 sold at 104.8 vs a 105 target
+    assert legs['SL']['qty'] == 5 and legs['SL']['slippage_per_share'] is None  # SL fill not reported
+    assert report('position_id').keys() == {"p1"}
+    assert "ABC" not in account['positions']
+
+
+def test_gtt_entries_are_recorded_per_confirmed_group(account, monkeypatch):
+    from test_gtt import fake_gtt_broker, gtt
+    fake_gtt_broker(monkeypatch, {'G1': gtt('TRIGGERED', 'O1'), 'G2': gtt('TRIGGERED', 'O2')}, {
+        'O1': {'status': 'complete', 'filled_quantity': 5, 'average_price': 101.0},
+        'O2': {'status': 'complete', 'filled_quantity': 5, 'average_price': 103.0}})
+    app.open_gtt_bracket("ABC", "NSE_EQ|ABC", "BUY", 10, 110.0, 95.0, 105.0, 100.0, "p1", received_at=1.0)
+
+    row = report()['ENTRY']
+    assert row['fills'] == 2 and row['qty'] == 10
+    assert row['slippage_rs'] == 20.0  # 5 × 1 + 5 × 3 over the 100 signal price
+    assert report('position_id').keys() == {"p1"}
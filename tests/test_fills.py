@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def row(status, filled=0, price=0.0):
+    return {'status': status, 'filled_quantity': filled, 'average_price': price}
+
+
+@pytest.fixture
+def broker(account, monkeypatch):
+    """Fresh fill-wait state; fetch_order_statuses answers from 'rows' and records each batch"""
+    state = {'rows': {}, 'batches': []}
+    monkeypatch.setitem(account, 'fill_waiters', {})
+    monkeypatch.setitem(account, 'fill_wake', threading.Event())
+    monkeypatch.setitem(account, 'fill_poller', None)
+    monkeypatch.setattr(app, 'FILL_POLL_SCHEDULE', [0.01, 0.02])
+    monkeypatch.setattr(app, 'get_token', lambda: "token")
+
+    def fetch(order_ids):
+        state['batches'].append(sorted(order_ids))
+        return {oid: state['rows'][oid] for oid in order_ids if oid in state['rows']}
+    monkeypatch.setattr(app, 'fetch_order_statuses', fetch)
+    return state
+
+
+def test_complete_order_returns_its_fill(broker):
+    broker['rows']['O1'] = row("complete", 10, 101.5)
+    assert app.verify_order_fill("O1", timeout=2) == (True, 10, 101.5)
+
+
+def test_rejected_order_is_not_a_fill(broker):
+    broker['rows']['O1'] = row("rejected")
+    assert app.verify_order_fill("O1", timeout=2) == (False, 0, 0.0)
+
+
+def test_timeout_gives_up_and_the_poller_goes_idle(account, broker):
+    broker['rows']['O1'] = row("open")  # never final
+    started = time.monotonic()
+    assert app.verify_order_fill("O1", timeout=0.1) == (False, 0, 0.0)
+    assert time.monotonic() - started < 1
+    assert len(broker['batches']) > 1  # kept probing until the deadline
+    assert account['fill_waiters'] == {}
+
+    poller = account['fill_poller']
+    if poller is not None:
+        account['fill_wake'].set()
+        poller.join(1)
+    assert account['fill_poller'] is None
+
+
+def test_one_poll_resolves_every_waiting_order(account, broker):
+    account['fill_poller'] = "busy"  # hold the poller off until every waiter is registered
+    results = {}
+    waiters = [threading.Thread(target=lambda oid=oid: results.update(
+        {oid: app.run_in_account(account, app.wait_for_fill, oid, 2)})) for oid in ("O1", "O2", "O3")]
+    for waiter in waiters:
+        waiter.start()
+    while len(account['fill_waiters']) < 3:
+        time.sleep(0.001)
+    for waiter in account['fill_waiters'].values():
+        waiter['due'] = 0.0
+    broker['rows'] = {"O1": row("complete", 1, 10.0), "O2": row("complete", 2, 20.0), "O3": row("cancelled")}
+
+    app.fill_poller()
+    for waiter in waiters:
+        waiter.join(2)
+    assert broker['batches'] == [["O1", "O2", "O3"]]
+    assert {oid: r['status'] for oid, r in results.items()} == {"O1": "complete", "O2": "complete", "O3": "cancelled"}
+    assert account['fill_poller'] is None
@@ -0,0 +1,54 @@
+import app
+
+
+def gtt(entry_status, order_id=None, exit_rule=None):
+    rules = [{'strategy': 'ENTRY', 'status': entry_status, 'order_id': order_id},
+             {'strategy': 'TARGET', 'status': 'PENDING'}, {'strategy': 'STOPLOSS', 'status': 'PENDING'}]
+    if exit_rule:
+        rules[1 if exit_rule == 'TARGET' else 2]['status'] = 'TRIGGERED'
+    return {'rules': rules}
+
+
+def fake_gtt_broker(monkeypatch, groups, orders):
+    """groups: GTT list returned in order of placement (G1 main, G2 partial)"""
+    cancelled = []
+    placed = iter(["G1", "G2"])
+    monkeypatch.setattr(app, 'place_gtt_order', lambda data, label="GTT": {"success": True, "gtt_order_id": next(placed)})
+    monkeypatch.setattr(app, 'get_gtt_orders', lambda: groups)
+    monkeypatch.setattr(app, 'get_order_details', lambda order_id: orders.get(order_id))
+    monkeypatch.setattr(app, 'cancel_gtt_order', lambda gtt_id: cancelled.append(gtt_id) or True)
+    monkeypatch.setattr(app, 'ORDER_FILL_TIMEOUT', 0.05)
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: None)
+    return cancelled
+
+
+def test_bracket_counts_confirmed_fills(account, monkeypatch):
+    fake_gtt_broker(monkeypatch, {'G1': gtt('TRIGGERED', 'O1'), 'G2': gtt('TRIGGERED', 'O2')}, {
+        'O1': {'status': 'complete', 'filled_quantity': 5, 'average_price': 101.0},
+        'O2': {'status': 'complete', 'filled_quantity': 5, 'average_price': 103.0}})
+    pos = app.open_gtt_bracket("ABC", "NSE_EQ|ABC", "BUY", 10, 110.0, 95.0, 105.0, 100.0, "p1")
+    assert pos.filled_qty == 10
+    assert pos.entry_price == 102.0
+    assert pos.leg_id('entry') == "G1" and pos.leg_id('partial') == "G2"
+
+
+def test_untriggered_entry_is_cancelled(account, monkeypatch):
+    cancelled = fake_gtt_broker(monkeypatch, {'G1': gtt('PENDING')}, {})
+    assert app.open_gtt_bracket("ABC", "NSE_EQ|ABC", "BUY", 1, 110.0, 95.0, 0, 100.0, "p1") is None
+    assert cancelled == ["G1"]
+
+
+def test_rejected_partial_entry_is_not_counted(account, monkeypatch):
+    fake_gtt_broker(monkeypatch, {'G1': gtt('TRIGGERED', 'O1'), 'G2': gtt('FAILED')}, {
+        'O1': {'status': 'complete', 'filled_quantity': 5, 'average_price': 101.0}})
+    pos = app.open_gtt_bracket("ABC", "NSE_EQ|ABC", "BUY", 10, 110.0, 95.0, 105.0, 100.0, "p1")
+    assert pos.filled_qty == 5 and pos.partial is None
+
+
+def test_flat_gtt_position_ghost_rules():
+    pos = app.Position("ABC", "BUY", bracket_mode="GTT", filled_qty=10,
+                       entry=app.OrderLeg("G1", 10, rules=[]))
+    assert not app.gtt_flat_is_ghost(pos, None)                              # no GTT view
+    assert not app.gtt_flat_is_ghost(pos, {'G1': gtt('TRIGGERED', exit_rule='STOPLOSS')})  # SL fired
+    assert not app.gtt_flat_is_ghost(pos, {'G1': gtt('PENDING')})            # entry not executed
+    assert app.gtt_flat_is_ghost(pos, {'G1': gtt('TRIGGERED')})              # exits live, broker flat
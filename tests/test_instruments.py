@@ -0,0 +1,44 @@
+import threading
+import time
+
+import app
+
+
+def fresh_index(monkeypatch, loading):
+    monkeypatch.setattr(app, 'instruments_ready', threading.Event())
+    monkeypatch.setattr(app, 'instruments_loading', threading.Event())
+    monkeypatch.setattr(app, 'instruments_dict', {})
+    if loading:
+        app.instruments_loading.set()
+
+
+def test_lookup_fails_fast_when_no_load_in_flight(monkeypatch):
+    fresh_index(monkeypatch, loading=False)
+    started = time.monotonic()
+    assert app.get_instrument_key("RELIANCE") is None
+    assert time.monotonic() - started < 0.5
+
+
+def test_lookup_waits_for_load_in_flight(monkeypatch):
+    fresh_index(monkeypatch, loading=True)
+
+    def finish():
+        time.sleep(0.2)
+        app.instruments_dict = {'RELIANCE-EQ': 'NSE_EQ|INE002A01018'}
+        app.instruments_ready.set()
+        app.instruments_loading.clear()
+
+    threading.Thread(target=finish).start()
+    assert app.get_instrument_key("nse:reliance") == 'NSE_EQ|INE002A01018'
+
+
+def test_failed_load_releases_waiters(monkeypatch):
+    fresh_index(monkeypatch, loading=False)
+
+    def broken(*args, **kwargs):
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr(app.requests, 'get', broken)
+    app.load_instruments()
+    assert not app.instruments_loading.is_set()
+    assert not app.wait_for_instruments(timeout=5)
@@ -0,0 +1,88 @@
+import math
+import os
+import time
+
+import numpy as np
+
+import app
+
+
+def trade(symbol="ABC", pnl=10.0, regime="TRENDING", closed_at=None):
+    return {'opened_at': 1.0, 'closed_at': closed_at or time.time(), 'qty': 10, 'entry_price': 100.0,
+            'pnl': pnl, 'rr': 2.0, 'risk': 50.0, 'confluence': 12.0, 'symbol': symbol,
+            'action': 'BUY', 'regime': regime, 'killzone': 'NSE Open', 'reason': 'TP',
+            'account': 'primary', 'position_id': 'p1'}
+
+
+def test_encode_decode_round_trip():
+    rows = [trade("ABC", 10.0), trade("XYZ", -5.0, "RANGING"), trade("ABC", 2.5)]
+    columns = app.ledger_encode(rows)
+    assert columns['symbol'].dtype == np.int32
+    assert list(columns['symbol__vocab'][columns['symbol']]) == ["ABC", "XYZ", "ABC"]
+    assert app.ledger_decode_rows(columns) == rows
+
+
+def test_write_appends_journal_and_reads_back(account):
+    for pnl in (10.0, -4.0):
+        app.ledger_write('trades', trade(pnl=pnl))
+    day = app.ledger_day()
+    assert os.path.exists(app.ledger_journal_path(day))
+    assert not os.path.exists(app.ledger_path(day))  # no .npz rewrite on the order path
+    columns = app.ledger_read(day)
+    assert columns['pnl'].tolist() == [10.0, -4.0]
+
+    app.ledger_write('trades', trade(pnl=1.0))
+    assert app.ledger_read(day)['pnl'].tolist() == [10.0, -4.0, 1.0]  # cache invalidated by file stamp
+
+
+def test_nan_slippage_survives_journal(account):
+    row = {name: 0.0 for name in app.EXECUTION_NUMERIC}
+    row.update({name: "x" for name in app.EXECUTION_CATEGORICAL}, qty=1, slippage=float('nan'))
+    app.ledger_write('executions', row)
+    assert math.isnan(app.ledger_read(app.ledger_day(), 'executions')['slippage'][0])
+
+
+def test_compact_folds_journal_once(account):
+    day = "20240102"
+    os.makedirs(app.LEDGER_DIR, exist_ok=True)
+    journal = app.ledger_journal_path(day)
+    with open(journal, "w") as f:
+        f.write('{"bad json\n')  # torn line is skipped
+    for pnl in (1.0, 2.0):
+        with open(journal, "a") as f:
+            f.write(app.json.dumps(trade(pnl=pnl)) + "\n")
+    app.ledger_compact(day)
+    assert not os.path.exists(journal)
+    assert app.ledger_read(day)['pnl'].tolist() == [1.0, 2.0]
+
+
+def test_compacted_journal_left_behind_is_not_double_counted(account):
+    day = "20240103"
+    os.makedirs(app.LEDGER_DIR, exist_ok=True)
+    journal = app.ledger_journal_path(day)
+    with open(journal, "w") as f:
+        f.write(app.json.dumps(trade(pnl=3.0)) + "\n")
+    backup = open(journal).read()
+    app.ledger_compact(day)
+    with open(journal, "w") as f:  # crash between .npz replace and journal unlink
+        f.write(backup)
+    assert app.ledger_read(day)['pnl'].tolist() == [3.0]
+    app.ledger_compact(day)
+    assert app.ledger_read(day)['pnl'].tolist() == [3.0]
+
+
+def test_files_from_before_the_account_columns_still_load(account):
+    day = "20240104"
+    os.makedirs(app.LEDGER_DIR, exist_ok=True)
+    old = {k: v for k, v in app.ledger_encode([trade()]).items() if not k.startswith(('account', 'position_id'))}
+    np.savez_compressed(app.ledger_path(day), **old)
+    with open(app.ledger_journal_path(day), "w") as f:
+        f.write(app.json.dumps(trade(pnl=4.0)) + "\n")
+    columns = app.ledger_read(day)
+    assert columns['position_id__vocab'][columns['position_id']].tolist() == ['', 'p1']
+    assert app.ledger_position_ids('primary', {day}) == {'p1'}
+
+
+def test_day_key_is_ist():
+    # 2024-01-01 20:00 UTC is already 2 Jan in India
+    assert app.ledger_day(1704139200) == "20240102"
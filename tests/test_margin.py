@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+import app
+from conftest import make_position
+
+
+@pytest.fixture
+def funds(account, monkeypatch):
+    """₹10,000 free at the last snapshot, 5x leverage, no buffer"""
+    state = {'available': None, 'used': 0.0, 'fetched_at': 0.0, 'ledger': {}, 'ledger_total': 0.0,
+             'ledger_at_fetch': 0.0, 'pending': set(), 'scaled': 0, 'rejected': 0, 'lock': threading.Lock()}
+    monkeypatch.setitem(account, 'funds', state)
+    monkeypatch.setattr(app, 'MARGIN_SIZING', "SCALE")
+    monkeypatch.setattr(app, 'MARGIN_LEVERAGE', 5.0)
+    monkeypatch.setattr(app, 'MARGIN_BUFFER_PCT', 0.0)
+    monkeypatch.setattr(app, 'fetch_funds', lambda: (10000.0, 0.0))
+    assert app.refresh_funds()
+    return state
+
+
+def test_qty_is_clamped_to_free_margin(funds):
+    assert app.size_for_margin("ABC", 400, 100.0) == (400, None)  # ₹8,000 fits
+    qty, reason = app.size_for_margin("ABC", 800, 100.0)
+    assert qty == 500 and "₹16000.00 needed" in reason
+    assert funds['scaled'] == 1
+
+
+def test_pending_entries_count_until_the_broker_blocks_them(funds):
+    app.margin_set("ABC", 6000.0, pending=True)
+    assert app.size_for_margin("XYZ", 300, 100.0)[0] == 200
+    app.refresh_funds()  # broker still shows ₹10,000 - the entry is not filled yet
+    assert app.size_for_margin("XYZ", 300, 100.0)[0] == 200
+    assert app.size_for_margin("ABC", 300, 100.0) == (300, None)  # a reversal frees ABC's own margin
+
+
+def test_close_releases_the_position_margin(account, funds):
+    account['positions']['ABC'] = make_position()
+    app.book_open("ABC", "NSE_EQ|ABC", "BUY", 10, 100.0)
+    assert funds['ledger'] == {"ABC": 200.0}
+
+    app.close_position_state("ABC", "MANUAL", 100.0)
+    assert funds['ledger'] == {} and funds['ledger_total'] == 0.0
+    assert app.size_for_margin("XYZ", 500, 100.0) == (500, None)
+
+
+def test_qty_that_cannot_fit_one_unit_is_rejected(account, funds, monkeypatch):
+    qty, reason = app.size_for_margin("ABC", 10, 60000.0)  # ₹12,000 a share
+    assert qty == 0 and funds['rejected'] == 1
+
+    monkeypatch.setattr(app, 'MARGIN_SIZING', "REJECT")
+    assert app.size_for_margin("ABC", 800, 100.0)[0] == 0  # no scaling - all or nothing
+
+    monkeypatch.setitem(account, 'recovery_ready', threading.Event())
+    account['recovery_ready'].set()
+    monkeypatch.setattr(app, 'get_instrument_key', lambda symbol: "NSE_EQ|ABC")
+    signal = app.parse_signal({'action': 'BUY', 'symbol': 'ABC', 'price': 100, 'qty': 800})
+    result, status = app.execute_signal({'action': 'BUY', 'symbol': 'ABC'}, signal, announce=False)
+    assert status == 400 and result['error'].startswith("Insufficient margin")
+    assert funds['ledger'] == {}  # nothing held for a rejected entry
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import app
+
+TODAY = np.datetime64('2026-10-19', 'D')  # Monday
+
+
+def option_row(option_type, strike, expiry, underlying="NIFTY"):
+    return (f"NSE_FO|{underlying}{expiry}{strike}{option_type}", {
+        'segment': 'NSE_FO', 'instrument_type': option_type, 'underlying_symbol': underlying,
+        'expiry': expiry, 'strike_price': strike, 'lot_size': 75,
+        'trading_symbol': f"{underlying} {strike} {option_type} {expiry}"})
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    """NIFTY expiries 20 Oct, 27 Oct (monthly), 3 Nov, 24 Nov (monthly) - strikes 24000-24500 step 100"""
+    monkeypatch.setattr(app, 'option_chains', {})
+    monkeypatch.setattr(app, 'option_contracts', {})
+    monkeypatch.setattr(app, 'OPTION_MIN_DAYS_TO_EXPIRY', 0)
+    rows = [option_row(t, k, e) for e in ('2026-10-20', '2026-10-27', '2026-11-03', '2026-11-24')
+            for k in range(24000, 24600, 100) for t in ('CE', 'PE')]
+    app.build_option_chains(rows)
+    return app.option_chains['NIFTY']
+
+
+def test_chain_is_sorted_and_marks_monthlies(chain):
+    assert [str(e) for e in chain['expiries']] == ['2026-10-20', '2026-10-27', '2026-11-03', '2026-11-24']
+    assert chain['monthly'].tolist() == [False, True, False, True]
+    strikes, contracts = chain['sides'][0]['CE']
+    assert strikes.tolist() == list(range(24000, 24600, 100))
+    assert app.option_contracts['NIFTY 24200 CE 2026-10-20']['lot_size'] == 75
+
+
+def test_atm_is_nearest_strike(chain):
+    assert app.select_option("NIFTY", "BUY", 24240.0, 0, "WEEKLY", TODAY)['strike'] == 24200
+    assert app.select_option("NIFTY", "BUY", 24260.0, 0, "WEEKLY", TODAY)['strike'] == 24300
+    put = app.select_option("NIFTY", "SELL", 24250.0, 0, "WEEKLY", TODAY)
+    assert put['option_type'] == "PE" and put['strike'] == 24200 and put['expiry'] == '2026-10-20'
+
+
+def test_otm_and_itm_offsets_follow_the_option_side(chain):
+    assert app.select_option("NIFTY", "BUY", 24200.0, 2, "WEEKLY", TODAY)['strike'] == 24400
+    assert app.select_option("NIFTY", "SELL", 24200.0, 2, "WEEKLY", TODAY)['strike'] == 24000
+    assert app.select_option("NIFTY", "BUY", 24200.0, -1, "WEEKLY", TODAY)['strike'] == 24100
+    assert app.select_option("NIFTY", "BUY", 24200.0, 5, "WEEKLY", TODAY) is None
+
+
+def test_expiry_selection(chain, monkeypatch):
+    assert app.select_option("NIFTY", "BUY", 24200.0, 0, "MONTHLY", TODAY)['expiry'] == '2026-10-27'
+    assert app.select_option("NIFTY", "BUY", 24200.0, 0, "WEEKLY", TODAY + 1)['expiry'] == '2026-10-20'
+    monkeypatch.setattr(app, 'OPTION_MIN_DAYS_TO_EXPIRY', 1)
+    assert app.select_option("NIFTY", "BUY", 24200.0, 0, "WEEKLY", TODAY + 1)['expiry'] == '2026-10-27'
+    assert app.select_option("NIFTY", "BUY", 24200.0, 0, "MONTHLY", TODAY + 8)['expiry'] == '2026-11-24'
+    assert app.select_option("NIFTY", "BUY", 24200.0, 0, "WEEKLY", TODAY + 40) is None
+
+
+def test_spot_outside_the_chain_is_rejected(chain):
+    assert app.select_option("NIFTY", "BUY", 99999.0, 0, "WEEKLY", TODAY) is None
+    assert app.select_option("NIFTY", "BUY", 0.0, 0, "WEEKLY", TODAY) is None
+    assert app.select_option("BANKNIFTY", "BUY", 24200.0, 0, "WEEKLY", TODAY) is None
+
+
+def test_raw_payload_is_spooled_before_routing(account, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, 'is_market_open', lambda: True)
+    monkeypatch.setattr(app, 'accounts', {account['name']: account})
+    monkeypatch.setattr(app, 'spool_append', lambda data, position_id, names: calls.append(('spool', dict(data))) or 7)
+    monkeypatch.setattr(app, 'spool_finish', lambda spool_id, name, status: calls.append(('finish', spool_id, status)))
+    monkeypatch.setattr(app, 'route_to_option',
+                        lambda data, signal_data: calls.append(('route',)) or (None, 'Instrument index not loaded'))
+
+    payload = {'action': 'BUY', 'symbol': 'NIFTY', 'price': 24200.0, 'route': 'option'}
+    result, status = app.route_signal(payload)
+    assert status == 400 and result['spool_id'] == 7
+    assert calls == [('spool', payload), ('route',), ('finish', 7, 400)]
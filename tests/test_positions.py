@@ -0,0 +1,76 @@
+import json
+
+import app
+from conftest import make_position
+
+
+def v1_position(gtt=False):
+    """positions.json entry as written before schema versioning"""
+    entry = {'quantity': 10, 'price': 0, 'trigger_price': 0, 'order_type': 'MARKET', 'transaction_type': 'BUY',
+             'instrument_token': 'NSE_EQ|ABC', 'tag': 'ADV-E-p1'}
+    sl = {'quantity': 10, 'price': 0, 'trigger_price': 95.0, 'order_type': 'SL-M', 'transaction_type': 'SELL',
+          'instrument_token': 'NSE_EQ|ABC', 'tag': 'ADV-S-p1'}
+    data = {'action': 'BUY', 'position_id': 'p1', 'qty_requested': 10, 'filled_qty': 10, 'entry_price': 100.0,
+            'entry_order_data': entry, 'entry_order_id': 'E1', 'sl_order_data': sl, 'sl_order_id': 'S1',
+            'partial_filled': False, 'trail_points': 2.5, 'signal': {'regime': 'TRENDING'},
+            'created_at': 1700000000.0, 'realized_pnl': 0}
+    if gtt:
+        data.update(bracket_mode='GTT', gtt_order_id='G1', entry_order_id=None)
+    return data
+
+
+def test_save_load_round_trip(account):
+    pos = make_position()
+    pos.signal = {'rr': 2.0}
+    account['positions']['ABC'] = pos
+    app.save_positions()
+    account['positions'] = {}
+    app.load_positions()
+
+    restored = account['positions']['ABC']
+    assert restored.to_row() == pos.to_row()
+    assert restored.sl.trigger_price == 95.0 and restored.remaining_qty == 10
+
+
+def test_v1_file_migrates_to_v2(account):
+    with open(account['positions_file'], "w") as f:
+        json.dump({'ABC': v1_position(), 'XYZ': v1_position(gtt=True)}, f)
+    app.load_positions()
+
+    pos = account['positions']['ABC']
+    assert pos.leg_id('entry') == "E1" and pos.leg_id('sl') == "S1" and pos.tp is None
+    assert pos.sl.trigger_price == 95.0 and pos.trail_points == 2.5
+    assert pos.signal == {'regime': 'TRENDING'} and pos.created_at == 1700000000.0
+    assert account['positions']['XYZ'].leg_id('entry') == "G1"
+
+    app.save_positions()
+    with open(account['positions_file']) as f:
+        doc = json.load(f)
+    assert doc['version'] == app.POSITIONS_SCHEMA_VERSION
+    assert doc['fields']['leg'] == list(app.OrderLeg.__slots__)
+    assert app.positions_from_document(doc)['ABC'].to_row() == pos.to_row()
+
+
+def test_unknown_and_missing_fields_are_tolerated():
+    pos = make_position()
+    doc = app.positions_document({'ABC': pos})
+    # Written by a newer version: extra position and leg fields
+    doc['fields']['position'].append('broker_note')
+    doc['fields']['leg'].append('exchange_id')
+    row = doc['positions']['ABC']
+    row.append("note")
+    for i, field in enumerate(doc['fields']['position']):
+        if field in app.Position.LEGS and row[i]:
+            row[i].append("X123")
+    restored = app.positions_from_document(json.loads(json.dumps(doc)))['ABC']
+    assert restored.to_row() == pos.to_row()
+
+    # Written by an older v2: legs without the timing fields
+    doc = app.positions_document({'ABC': pos})
+    doc['fields']['leg'] = [f for f in doc['fields']['leg'] if f not in ('sent_at', 'acked_at')]
+    row = doc['positions']['ABC']
+    for i, field in enumerate(app.Position.__slots__):
+        if field in app.Position.LEGS and row[i]:
+            row[i] = [v for f, v in zip(app.OrderLeg.__slots__, row[i]) if f not in ('sent_at', 'acked_at')]
+    restored = app.positions_from_document(doc)['ABC']
+    assert restored.sl.order_id == "S1" and restored.sl.sent_at == 0.0
@@ -0,0 +1,83 @@
+import pytest
+
+import app
+from conftest import make_position
+
+
+def order(order_id, qty, filled, status):
+    return {'order_id': order_id, 'quantity': qty, 'filled_quantity': filled, 'status': status}
+
+
+@pytest.fixture
+def broker(account, monkeypatch):
+    """Stub broker: tests fill in net positions and the order book; modifies and cancels are recorded"""
+    state = {'positions': {}, 'orders': {}, 'modify': [], 'cancel': []}
+    monkeypatch.setitem(account, 'reconcile', {'positions': None, 'orders': None, 'version': -1,
+                                               'suspects': {}, 'alerted': set()})
+    monkeypatch.setitem(account, 'order_ids', {})
+    monkeypatch.setattr(app, 'fetch_broker_positions', lambda: dict(state['positions']))
+    monkeypatch.setattr(app, 'fetch_order_book', lambda: dict(state['orders']))
+    monkeypatch.setattr(app, 'modify_order', lambda order_id, data, label="": state['modify'].append(
+        (order_id, data['quantity'])) or True)
+    monkeypatch.setattr(app, 'cancel_order', lambda order_id: state['cancel'].append(order_id) or True)
+    return state
+
+
+def test_ghost_is_removed_once_confirmed(account, broker):
+    account['positions']['ABC'] = make_position()
+    broker['orders'] = {'E1': order('E1', 10, 10, "complete"), 'S1': order('S1', 10, 0, "trigger pending")}
+
+    assert app.reconcile_once()['suspects'] == ["ABC"]  # first sighting - broker book may lag
+    assert "ABC" in account['positions']
+    result = app.reconcile_once()
+    assert result['repairs'] == [{'symbol': "ABC", 'repair': 'ghost_removed', 'expected': 10}]
+    assert "ABC" not in account['positions'] and broker['cancel'] == ["S1"]
+
+
+def test_untracked_position_is_reported_once_per_qty(account, broker):
+    broker['positions'] = {"XYZ": 5}
+    app.reconcile_once()
+    app.publish_event('position_opened', "OTHER")  # state changed - forces a full pass
+    app.reconcile_once()
+    assert len(account['telegram']) == 1 and "XYZ" in account['telegram'][0]
+
+    broker['positions'] = {"XYZ": 8}
+    app.reconcile_once()
+    assert len(account['telegram']) == 2
+
+
+def test_size_drift_resizes_the_sl_to_the_broker_qty(account, broker):
+    account['positions']['ABC'] = make_position()
+    broker['positions'] = {"ABC": 6}
+    broker['orders'] = {'E1': order('E1', 10, 10, "complete"), 'S1': order('S1', 10, 0, "trigger pending")}
+
+    app.reconcile_once()
+    result = app.reconcile_once()
+    assert result['repairs'] == [{'symbol': "ABC", 'repair': 'resized', 'held': 6, 'expected': 10}]
+    pos = account['positions']['ABC']
+    assert pos.filled_qty == 6 and broker['modify'] == [("S1", 6)] and pos.sl.quantity == 6
+
+
+def test_oversized_sl_is_resized_when_net_qty_agrees(account, broker):
+    pos = make_position()
+    pos.partial = app.OrderLeg("P1", 5, 105.0, 0, "LIMIT", "SELL", "NSE_EQ|ABC", "P-p1")
+    account['positions']['ABC'] = pos
+    broker['positions'] = {"ABC": 5}
+    broker['orders'] = {'E1': order('E1', 10, 10, "complete"), 'P1': order('P1', 5, 5, "complete"),
+                        'S1': order('S1', 10, 0, "trigger pending")}  # SL would sell 10 against 5 held
+
+    app.reconcile_once()
+    result = app.reconcile_once()
+    assert result['repairs'] == [{'symbol': "ABC", 'repair': 'sl_resized', 'sl_qty': 10, 'held': 5}]
+    assert broker['modify'] == [("S1", 5)] and pos.sl.quantity == 5 and pos.filled_qty == 10
+
+
+def test_flat_position_with_live_sl_is_left_to_the_monitor(account, broker):
+    pos = make_position()
+    pos.tp = app.OrderLeg("T1", 10, 110.0, 0, "LIMIT", "SELL", "NSE_EQ|ABC", "T-p1")
+    account['positions']['ABC'] = pos
+    broker['orders'] = {'E1': order('E1', 10, 10, "complete"), 'T1': order('T1', 10, 10, "complete"),
+                        'S1': order('S1', 10, 0, "trigger pending")}
+
+    assert app.reconcile_once() == {'changed': True, 'repairs': [], 'suspects': []}  # not even a suspect
+    assert broker['modify'] == [] and broker['cancel'] == []
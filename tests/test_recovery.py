@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+import app
+
+PID = "18f0a2b3c4d"
+
+
+def order(order_id, leg, side, qty, filled, status, order_type="MARKET", trigger=0.0, price=0.0):
+    return {'order_id': order_id, 'tag': app.order_tag(leg, PID), 'status': status, 'quantity': qty,
+            'filled_quantity': filled, 'transaction_type': side, 'trading_symbol': "ABC-EQ",
+            'instrument_token': "NSE_EQ|ABC", 'order_type': order_type, 'trigger_price': trigger, 'price': price,
+            'average_price': 100.0 if filled else 0.0, 'order_timestamp': f"2026-10-19 09:{20 + len(leg)}:00"}
+
+
+@pytest.fixture
+def broker(account, monkeypatch):
+    """Entry 10 filled, partial TP 5 filled while the bot was down, SL-M still live for 10, broker holds 5"""
+    calls = {'modify': [], 'cancel': [], 'place': []}
+    orders = {o['order_id']: o for o in [
+        order("E1", "E", "BUY", 10, 10, "complete"),
+        order("P1", "P", "SELL", 5, 5, "complete", "LIMIT", price=105.0),
+        order("S1", "S", "SELL", 10, 0, "trigger pending", "SL-M", trigger=95.0)]}
+    monkeypatch.setitem(account, 'recovery_ready', threading.Event())
+    monkeypatch.setattr(app, 'get_token', lambda: "token")
+    monkeypatch.setattr(app, 'fetch_order_book', lambda: orders)
+    monkeypatch.setattr(app, 'fetch_trades_for_day', lambda: {"E1": (10, 100.0), "P1": (5, 105.0)})
+    monkeypatch.setattr(app, 'fetch_broker_positions', lambda: {"ABC": 5})
+    monkeypatch.setattr(app, 'modify_order', lambda order_id, data, label="": calls['modify'].append((order_id, data['quantity'])) or True)
+    monkeypatch.setattr(app, 'cancel_order', lambda order_id: calls['cancel'].append(order_id) or True)
+    monkeypatch.setattr(app, 'get_order_status', lambda order_id: "trigger pending")
+    monkeypatch.setattr(app, 'place_order', lambda data, label="", retry_count=0: calls['place'].append(data) or
+                        {"success": True, "order_id": f"X{len(calls['place'])}"})
+    return calls
+
+
+def test_sl_is_resized_to_the_qty_left_after_a_partial_fill_while_down(account, broker):
+    assert app.run_recovery()
+    pos = account['positions']['ABC']
+    assert pos.partial_filled and pos.remaining_qty == 5
+    assert broker['modify'] == [("S1", 5)]
+    assert pos.sl.order_id == "S1" and pos.sl.quantity == 5
+    assert broker['place'] == [] and broker['cancel'] == []
+
+
+def test_sl_that_cannot_be_resized_is_flattened(account, broker, monkeypatch):
+    monkeypatch.setattr(app, 'modify_order', lambda order_id, data, label="": False)
+    monkeypatch.setattr(app, 'cancel_order', lambda order_id: broker['cancel'].append(order_id) and False)
+    assert app.run_recovery()
+    exit_order = broker['place'][-1]
+    assert exit_order['order_type'] == "MARKET" and exit_order['quantity'] == 5
+    assert exit_order['transaction_type'] == "SELL" and exit_order['tag'] == app.order_tag("X", PID)
+    assert "ABC" not in account['positions']
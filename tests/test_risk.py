@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+import pytz
+
+import app
+
+
+@pytest.fixture
+def book(account, monkeypatch):
+    """Empty day totals with a ₹500 daily loss and ₹20,000 exposure limit; positions opened are closed after"""
+    monkeypatch.setattr(app, 'book_totals', {'unrealized': 0.0, 'realized': 0.0, 'exposure': 0.0,
+                                             'peak_equity': 0.0, 'max_drawdown': 0.0, 'day': None})
+    monkeypatch.setattr(app, 'MAX_DAILY_LOSS', 500.0)
+    monkeypatch.setattr(app, 'MAX_EXPOSURE', 20000.0)
+    opened = []
+
+    def open_position(symbol, qty, price, action="BUY"):
+        opened.append(symbol)
+        app.book_open(symbol, f"NSE_EQ|{symbol}", action, qty, price)
+    yield open_position
+    for symbol in opened:
+        app.book_close(symbol)
+
+
+def at_utc(*args):
+    """datetime stand-in whose now() is a fixed UTC instant"""
+    instant = datetime(*args, tzinfo=pytz.utc)
+
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return instant.astimezone(tz) if tz else instant.replace(tzinfo=None)
+    return Clock
+
+
+def test_unrealized_loss_trips_the_daily_limit(book):
+    book("ABC", 100, 100.0)
+    assert app.check_risk_limits("XYZ", 1, 100.0) == (True, None)
+    app.book_on_tick("NSE_EQ|ABC", 94.9)  # -₹510 open
+    ok, reason = app.check_risk_limits("XYZ", 1, 100.0)
+    assert not ok and reason.startswith("Daily loss limit hit")
+
+
+def test_realized_loss_stays_counted_after_the_close(book):
+    book("ABC", 100, 100.0)
+    app.book_close("ABC", 94.0)
+    assert app.book_totals['realized'] == -600.0
+    assert not app.check_risk_limits("XYZ", 1, 100.0)[0]
+
+
+def test_exposure_limit_counts_held_notional_at_ltp(book):
+    book("ABC", 100, 100.0)                      # ₹10,000 held
+    assert app.check_risk_limits("XYZ", 90, 100.0)[0]
+    ok, reason = app.check_risk_limits("XYZ", 110, 100.0)
+    assert not ok and "Exposure limit (₹21000.00" in reason
+    assert app.check_risk_limits("ABC", 150, 100.0)[0]  # a reversal frees ABC's own exposure
+
+    app.book_on_tick("NSE_EQ|ABC", 120.0)        # held notional now ₹12,000
+    assert not app.check_risk_limits("XYZ", 90, 100.0)[0]
+
+
+def test_loss_limit_resets_on_the_ist_day_not_the_host_day(book, monkeypatch):
+    monkeypatch.setattr(app, 'datetime', at_utc(2026, 10, 19, 18, 0))  # 23:30 IST
+    book("ABC", 100, 100.0)
+    app.book_close("ABC", 94.0)
+    assert not app.check_risk_limits("XYZ", 1, 100.0)[0]
+
+    monkeypatch.setattr(app, 'datetime', at_utc(2026, 10, 19, 18, 45))  # 00:15 IST next day, still the 19th in UTC
+    assert app.check_risk_limits("XYZ", 1, 100.0) == (True, None)
+    assert app.book_totals['day'] == "20261020" and app.book_totals['realized'] == 0.0
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+import app
+
+PAYLOAD = {'action': 'BUY', 'symbol': 'ABC', 'price': 100.0, 'sl': 99.0, 'tp': 102.0,
+           'confluence': 12, 'killzone': 'NSE Open'}
+
+
+def test_dispatch_dry_run_sends_nothing(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(app, 'SIGNAL_DRY_RUN', True)
+    monkeypatch.setattr(app.engine_pool, 'submit', lambda *args: submitted.append(args))
+    monkeypatch.setattr(app, 'publish_event', lambda *args, **kwargs: None)
+    app.engine_dispatch([PAYLOAD])
+    assert submitted == []
+
+
+def test_engine_signals_go_through_admission(account, monkeypatch):
+    routed = []
+    monkeypatch.setattr(app, 'route_signal', lambda data, received_at=None: routed.append(data) or ({}, 200))
+    monkeypatch.setattr(app, 'WEBHOOK_MAX_INFLIGHT', 1)
+    monkeypatch.setattr(app, 'WEBHOOK_MAX_QUEUE', 0)
+    monkeypatch.setitem(app.admission, 'inflight', 1)  # the only slot is busy
+    app.engine_execute(PAYLOAD)
+    assert routed == []
+
+    monkeypatch.setitem(app.admission, 'inflight', 0)
+    app.engine_execute(PAYLOAD)
+    assert routed == [PAYLOAD]
+    assert app.admission['inflight'] == 0
+
+
+KILLZONE_OPEN = 1704167400  # 2024-01-02 09:20 IST
+MIDDAY = 1704177000         # 2024-01-02 12:00 IST
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """Fresh one-symbol engine (ABC)"""
+    for name in ('engine_bars', 'engine_current', 'engine_symbols', 'engine_key_rows'):
+        monkeypatch.setattr(app, name, getattr(app, name))
+    monkeypatch.setattr(app, 'engine_features', {})
+    monkeypatch.setattr(app, 'engine_state', dict(app.engine_state))
+    app.engine_init(["ABC"])
+    return app.engine_features
+
+
+def setup(base, sweep_low):
+    """Range → sweep below it (bearish candle) → displacement leaving a bull FVG → retrace into the gap"""
+    return [(base + 0.5, base + 1, base, base + 0.5)] * 3 + [
+        (base + 0.6, base + 0.7, sweep_low, base + 0.2),      # sweep + order block
+        (base + 0.3, base + 2.5, base + 0.2, base + 2.4),     # displacement
+        (base + 2.4, base + 3.5, base + 1.5, base + 3.2),     # gap: low above the sweep candle's high
+        (base + 3.0, base + 3.1, base + 1.3, base + 1.8)]     # retrace into the gap
+
+
+def feed(candles, start=KILLZONE_OPEN):
+    signals = []
+    for i, candle in enumerate(candles):
+        signals.extend(app.engine_on_candles(start + i * 60, {"ABC": candle}))
+    return signals
+
+
+def test_sweep_displacement_retrace_emits_a_buy(engine):
+    signals = feed(setup(100, 99.0))
+    assert len(signals) == 1
+    signal = signals[0]
+    assert signal['action'] == "BUY" and signal['price'] == 101.8
+    assert signal['sl'] == 99.0  # beyond the swept liquidity
+    assert signal['partial_tp'] == 104.6 and signal['tp'] == 107.4  # 1R and SIGNAL_RR × R
+    assert signal['confluence'] == 15 and signal['killzone'] == "NSE Open"
+    assert np.isnan(engine['bull_fvg_top'][0])  # the gap is spent
+
+
+def test_second_setup_inside_the_cooldown_is_suppressed(engine, monkeypatch):
+    second = [(102, 102.5, 101.5, 102)] * 2 + [
+        (102.1, 102.2, 98.9, 101.7), (101.8, 104, 101.7, 103.9), (103.9, 105, 103, 104.7), (104.5, 104.6, 102.8, 103.3)]
+    assert len(feed(setup(100, 99.0))) == 1
+    assert feed(second, KILLZONE_OPEN + 600) == []
+
+    monkeypatch.setattr(app, 'SIGNAL_COOLDOWN_BARS', 0)
+    app.engine_init(["ABC"])
+    assert len(feed(setup(100, 99.0))) == 1
+    assert [s['sl'] for s in feed(second, KILLZONE_OPEN + 600)] == [98.9]
+
+
+def test_close_below_the_sweep_invalidates_it(engine):
+    feed(setup(100, 99.0)[:4])
+    assert engine['bull_sweep_price'][0] == 99.0
+    feed([(100, 100.2, 98.5, 98.8)], KILLZONE_OPEN + 240)
+    assert np.isnan(engine['bull_sweep_price'][0]) and np.isnan(engine['bull_sweep_bar'][0])
+
+
+def test_killzone_adds_the_confluence_a_strict_threshold_needs(engine, monkeypatch):
+    assert [(s['confluence'], s['killzone']) for s in feed(setup(100, 99.0), MIDDAY)] == [(13, "N/A")]
+
+    monkeypatch.setattr(app, 'SIGNAL_MIN_CONFLUENCE', 15)
+    app.engine_init(["ABC"])
+    assert feed(setup(100, 99.0), MIDDAY) == []
+
+    app.engine_init(["ABC"])
+    assert [s['confluence'] for s in feed(setup(100, 99.0), KILLZONE_OPEN)] == [15]
@@ -0,0 +1,64 @@
+import app
+from conftest import make_position
+
+
+def broker(monkeypatch, modify=False, status="open", cancel=True, replace=False):
+    """Fake order endpoints; returns the list of placed payloads"""
+    placed = []
+
+    def place(order_data, label="Order", retry_count=0):
+        placed.append(order_data)
+        ok = replace if order_data['order_type'] == "SL-M" else True
+        return {"success": ok, "order_id": f"N{len(placed)}" if ok else None}
+
+    monkeypatch.setattr(app, 'modify_order', lambda *args, **kwargs: modify)
+    monkeypatch.setattr(app, 'get_order_status', lambda order_id: status)
+    monkeypatch.setattr(app, 'cancel_order', lambda order_id: cancel)
+    monkeypatch.setattr(app, 'place_order', place)
+    monkeypatch.setattr(app, 'get_instrument_key', lambda symbol: "NSE_EQ|ABC")
+    return placed
+
+
+def test_modify_in_place(account, monkeypatch):
+    pos = make_position()
+    account['positions']['ABC'] = pos
+    placed = broker(monkeypatch, modify=True)
+    assert app.adjust_sl_order("ABC", pos, quantity=5)
+    assert pos.sl.quantity == 5 and pos.sl.order_id == "S1"
+    assert placed == []
+
+
+def test_replace_after_refused_modify(account, monkeypatch):
+    pos = make_position()
+    account['positions']['ABC'] = pos
+    placed = broker(monkeypatch, replace=True)
+    assert app.adjust_sl_order("ABC", pos, quantity=5)
+    assert pos.sl.order_id == "N1" and pos.sl.quantity == 5
+
+
+def test_final_sl_is_left_alone(account, monkeypatch):
+    for status in app.SL_FINAL_STATES:
+        pos = make_position()
+        account['positions']['ABC'] = pos
+        placed = broker(monkeypatch, status=status, replace=True)
+        assert not app.adjust_sl_order("ABC", pos, quantity=5)
+        assert placed == []
+        assert pos.sl.order_id == "S1"
+
+
+def test_closed_position_is_never_reprotected(account, monkeypatch):
+    pos = make_position()  # not in active_positions - the monitor already closed it
+    placed = broker(monkeypatch, replace=True)
+    assert not app.adjust_sl_order("ABC", pos, quantity=5)
+    assert placed == []
+
+
+def test_failed_replace_exits_position(account, monkeypatch):
+    pos = make_position()
+    account['positions']['ABC'] = pos
+    placed = broker(monkeypatch, replace=False)
+    assert not app.adjust_sl_order("ABC", pos, quantity=5)
+    assert [p['order_type'] for p in placed] == ["SL-M", "MARKET"]
+    assert placed[1]['quantity'] == 5 and placed[1]['transaction_type'] == "SELL"
+    assert "ABC" not in account['positions']
+    assert not pos.leg_id('sl')
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+import app
+from conftest import make_position
+
+
+class StopWorker(BaseException):
+    """Ends spool_worker's loop at its first sleep"""
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    """Empty spool under tmp_path"""
+    monkeypatch.setattr(app, 'SPOOL_DIR', str(tmp_path / "spool"))
+    state = {'file': None, 'segment': None, 'segment_bytes': 0, 'next_id': 1, 'written': 0, 'synced': 0,
+             'syncing': False, 'pending': {}, 'stats': {'appended': 0, 'fsyncs': 0, 'replayed': 0, 'expired': 0}}
+    monkeypatch.setattr(app, 'spool_state', state)
+    yield state
+    if state['file']:
+        state['file'].close()
+
+
+def segments():
+    return sorted(os.listdir(app.SPOOL_DIR))
+
+
+def restart(spool):
+    spool['file'].close()
+    spool['file'] = None
+    app.spool_load()
+
+
+def run_worker_once(monkeypatch):
+    def stop(seconds):
+        raise StopWorker()
+    monkeypatch.setattr(app.time, 'sleep', stop)
+    with pytest.raises(StopWorker):
+        app.spool_worker()
+
+
+def test_unfinished_signals_survive_a_restart(spool):
+    done = app.spool_append({'action': 'BUY', 'symbol': 'ABC'}, "p1", ["primary", "second"])
+    open_id = app.spool_append({'action': 'SELL', 'symbol': 'XYZ'}, "p2", ["primary"])
+    app.spool_finish(done, "primary", 200)
+    app.spool_finish(done, "second", 200)
+    app.spool_finish(open_id, "primary", 503)  # not ready - stays pending
+    spool['file'].write('{"op": "signal", "id": 9')  # torn last line
+    spool['file'].flush()
+
+    restart(spool)
+    assert list(spool['pending']) == [open_id]
+    assert spool['pending'][open_id]['position_id'] == "p2"
+    assert spool['pending'][open_id]['accounts'] == {"primary"}
+    assert spool['next_id'] == open_id + 1
+    assert app.spool_stats()['appended'] == 2
+
+
+def test_rolled_segments_are_dropped_once_finished(spool, monkeypatch):
+    monkeypatch.setattr(app, 'SPOOL_SEGMENT_BYTES', 1)
+    first = app.spool_append({'symbol': 'ABC'}, "p1", ["primary"])
+    second = app.spool_append({'symbol': 'XYZ'}, "p2", ["primary"])
+    assert len(segments()) == 2  # first is still pending
+
+    app.spool_finish(first, "primary", 200)
+    app.spool_finish(second, "primary", 200)
+    app.spool_append({'symbol': 'DEF'}, "p3", ["primary"])
+    assert segments() == [os.path.basename(spool['segment'])]
+
+
+def test_replay_skips_positions_already_executed(account, spool, monkeypatch):
+    monkeypatch.setattr(app, 'is_market_open', lambda: True)
+    executed = []
+    monkeypatch.setattr(app, 'execute_signal',
+                        lambda data, signal_data, announce, position_id: executed.append(position_id) or ({}, 200))
+
+    # p1 opened and closed before the crash - only the trade ledger knows it
+    closed = make_position()
+    closed.position_id = "p1"
+    app.ledger_append("ABC", closed, "TP", 50.0)
+    app.spool_append({'action': 'BUY', 'symbol': 'ABC', 'price': 100}, "p1", [account['name']])
+    app.spool_append({'action': 'BUY', 'symbol': 'XYZ', 'price': 100}, "p2", [account['name']])
+    restart(spool)
+
+    run_worker_once(monkeypatch)
+    assert executed == ["p2"]
+    assert spool['pending'] == {}
+    assert app.spool_stats()['replayed'] == 1
+
+
+def test_ledger_position_ids_are_per_account(account):
+    pos = make_position()
+    app.ledger_append("ABC", pos, "SL", -20.0)
+    assert app.ledger_position_ids(account['name'], {app.ledger_day()}) == {"p1"}
+    assert app.ledger_position_ids("someone-else", {app.ledger_day()}) == set()
+
+
+def test_done_records_survive_compaction_of_their_segment(spool, monkeypatch):
+    monkeypatch.setattr(app, 'SPOOL_SEGMENT_BYTES', 1)
+    signal = app.spool_append({'symbol': 'ABC'}, "p1", ["primary", "second"])
+    other = app.spool_append({'symbol': 'XYZ'}, "p2", ["primary"])  # rotates into a second segment
+    app.spool_finish(signal, "primary", 200)   # 'done' lands in the second segment
+    app.spool_finish(signal, "second", 503)    # second not ready - signal stays pending
+    app.spool_finish(other, "primary", 200)
+    done_segment = spool['segment']
+    app.spool_append({'symbol': 'DEF'}, "p3", ["primary"])  # rotates again and compacts
+    assert not os.path.exists(done_segment)
+
+    restart(spool)
+    assert set(spool['pending']) == {signal, signal + 2}
+    assert spool['pending'][signal]['accounts'] == {"second"}
@@ -0,0 +1,93 @@
+import base64
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+from cryptography.fernet import Fernet
+
+import app
+
+
+def jwt(exp):
+    """Unsigned JWT carrying only an exp claim"""
+    claims = base64.urlsafe_b64encode(json.dumps({'exp': exp}).encode()).decode().rstrip('=')
+    return f"eyJhbGciOiJIUzI1NiJ9.{claims}.signature"
+
+
+@pytest.fixture
+def vault(account, tmp_path, monkeypatch):
+    """No token in memory, vault under tmp_path; broker_request answers with 'status' and 'token'"""
+    for field, value in (('access_token', None), ('token_generated_at', None), ('token_expires_at', None),
+                         ('token_verified', False), ('vault_file', str(tmp_path / "token.vault"))):
+        monkeypatch.setitem(account, field, value)
+    monkeypatch.setattr(app, 'TOKEN_VAULT_KEY', Fernet.generate_key())
+    broker = {'status': 200, 'token': None, 'calls': []}
+
+    def request(method, url, **kwargs):
+        broker['calls'].append(url.rsplit('/', 1)[-1])
+        return SimpleNamespace(status_code=broker['status'], text="",
+                               json=lambda: {'access_token': broker['token']})
+    monkeypatch.setattr(app, 'broker_request', request)
+    return broker
+
+
+def test_expiry_comes_from_the_jwt_exp_claim():
+    assert app.decode_token_expiry(jwt(1760000000)) == 1760000000.0
+    assert app.decode_token_expiry("not-a-jwt") is None
+    assert app.decode_token_expiry("a.%%%.c") is None
+
+
+def test_login_token_round_trips_through_the_vault(account, vault):
+    exp = time.time() + 3600
+    vault['token'] = jwt(exp)
+    assert app.generate_access_token("code")
+    assert app.get_token() == vault['token'] and account['token_expires_at'] == exp
+    with open(account['vault_file'], "rb") as f:
+        assert vault['token'].encode() not in f.read()  # encrypted at rest
+
+    account['access_token'] = None
+    assert app.load_token_vault()
+    assert account['access_token'] == vault['token'] and not account['token_verified']
+    assert app.get_token() == vault['token'] and vault['calls'][-1] == "profile"  # verified once on first use
+
+
+def test_expired_jwt_is_not_restored_or_used(account, vault):
+    vault['token'] = jwt(time.time() - 60)
+    app.generate_access_token("code")
+    assert app.get_token() is None and app.token_seconds_left() == 0
+
+    account['access_token'] = None
+    assert not app.load_token_vault()
+    assert account['access_token'] is None
+
+
+def test_garbled_vault_token_is_dropped_when_the_broker_rejects_it(account, vault):
+    vault['token'] = "garbled"
+    app.generate_access_token("code")
+    assert account['token_expires_at'] is None  # no exp claim - fallback window applies
+    account['access_token'] = None
+
+    assert app.load_token_vault()
+    vault['status'] = 401
+    assert app.get_token() is None
+    assert account['access_token'] is None and not app.os.path.exists(account['vault_file'])
+
+
+def test_vault_written_with_another_key_is_ignored(account, vault, monkeypatch):
+    vault['token'] = jwt(time.time() + 3600)
+    app.generate_access_token("code")
+    account['access_token'] = None
+    monkeypatch.setattr(app, 'TOKEN_VAULT_KEY', Fernet.generate_key())
+    assert not app.load_token_vault() and account['access_token'] is None
+
+
+def test_relogin_replaces_the_vault_token(account, vault):
+    vault['token'] = jwt(time.time() + 60)
+    app.generate_access_token("code")
+    vault['token'] = jwt(time.time() + 7200)  # refreshed login
+    app.generate_access_token("code")
+
+    account['access_token'] = None
+    assert app.load_token_vault() and account['access_token'] == vault['token']
+    assert app.token_seconds_left() > 3600